@@ -0,0 +1,147 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+from rest_framework.exceptions import NotFound
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from . import listing, views
+from .cache import aget_cached_response, aget_generations, get_reference_data
+from .conditional import not_modified, set_validators
+from .models import ProductCard
+from .pagination import KeysetPagination
+from .serializers import ProductCardSerializer
+
+# Асинхронные версии горячих эндпоинтов чтения для запуска под ASGI (включаются ASYNC_READ_VIEWS).
+# Товары читаются из карточек асинхронным ORM, пока запрос ждёт БД или медленного клиента,
+# воркер обслуживает другие. Запись и запросы с токеном уходят в обычные DRF-представления
+
+renderer = JSONRenderer()
+product_list_view = views.ProductList.as_view()
+product_search_view = views.ProductSearchView.as_view()
+product_detail_view = views.ProductDetail.as_view()
+
+
+class CardReadMixin:
+    # Фильтры берём у синхронных представлений, а читаем всегда карточки
+
+    def get_product_queryset(self):
+        return ProductCard.objects.all()
+
+
+class ProductListReader(CardReadMixin, views.ProductList):
+    pass
+
+
+class ProductSearchReader(CardReadMixin, views.ProductSearchView):
+    pass
+
+
+def render(data, status=200):
+    # Те же байты, что отдаёт DRF с JSONRenderer
+    return HttpResponse(renderer.render(data), content_type='application/json', status=status)
+
+
+def is_async_read(request):
+    # Пользователь из токена нужен только DRF-аутентификации, поэтому анонимность видна по заголовку
+    return request.method == 'GET' and 'HTTP_AUTHORIZATION' not in request.META
+
+
+def get_reader(view_class, request):
+    # Request без аутентификаторов: пользователь анонимный и не требует запросов к БД
+    return view_class(request=Request(request), args=(), kwargs={}, format_kwarg=None)
+
+
+async def paginate(view, queryset, min_price=None, max_price=None):
+    paginator = KeysetPagination()
+    page = await paginator.apaginate_queryset(listing.get_rows(queryset), view.request, view)
+    return paginator.get_paginated_data(listing.render_products(page, view.request, min_price, max_price))
+
+
+async def get_list_response(request, view_class, generation_names, compute):
+    # То же, что AnonymousResponseCacheMixin.get: валидаторы и кэш ответов по поколениям
+    try:
+        if generation_names is None or not settings.RESPONSE_CACHE_TIMEOUT:
+            return render(await compute())
+        # Ключи общие с синхронными представлениями: под WSGI и ASGI кэш один
+        params = {name: request.GET[name] for name in view_class.cache_query_params if name in request.GET}
+        base_key = views.get_response_cache_key(view_class.__name__, request, params)
+        etag, last_modified = views.get_list_validators(base_key, await aget_generations(*generation_names))
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+        data, state = await aget_cached_response(base_key, generation_names, compute)
+    except NotFound as error:
+        return render({'detail': error.detail}, status=error.status_code)
+    response = render(data)
+    response['X-Cache'] = state
+    if state != 'STALE':
+        set_validators(response, etag, last_modified)
+    return response
+
+
+async def get_category_tree(request):
+    reference_data = await sync_to_async(get_reference_data)()
+    category_id = request.GET.get('category')
+    if category_id:
+        subtree = reference_data.get_subtree(int(category_id)) if category_id.isdigit() else None
+        if subtree is None:
+            return render({'error': 'Category not found'}, status=404)
+        return render(subtree)
+    return render(reference_data.category_tree)
+
+
+async def get_category_list(request):
+    return render((await sync_to_async(get_reference_data)()).category_list)
+
+
+async def get_city_list(request):
+    return render((await sync_to_async(get_reference_data)()).city_list)
+
+
+async def product_list(request):
+    if not is_async_read(request):
+        return await sync_to_async(product_list_view)(request)
+    view = get_reader(ProductListReader, request)
+
+    async def compute():
+        return await paginate(view, view.get_list_queryset(view.request))
+
+    generation_names = views.get_location_generation_names({'city': request.GET.get('city')})
+    return await get_list_response(request, views.ProductList, generation_names, compute)
+
+
+async def product_search(request):
+    if not is_async_read(request):
+        return await sync_to_async(product_search_view)(request)
+    view = get_reader(ProductSearchReader, request)
+
+    async def compute():
+        # Категория и границы цен читаются синхронно, страница — асинхронным ORM
+        queryset = await sync_to_async(view.get_queryset)()
+        return await paginate(view, queryset, view.kwargs.get('min_price'), view.kwargs.get('max_price'))
+
+    params = {name: request.GET[name] for name in ('city', 'category') if name in request.GET}
+    generation_names = views.get_location_generation_names(params)
+    return await get_list_response(request, views.ProductSearchView, generation_names, compute)
+
+
+async def product_detail(request, pk):
+    if not is_async_read(request):
+        return await sync_to_async(product_detail_view)(request, pk=pk)
+    card = await ProductCard.objects.filter(product_id=pk).afirst()
+    if card is None:
+        # Ответ 404 как у DRF
+        return await sync_to_async(product_detail_view)(request, pk=pk)
+
+    etag, last_modified = views.get_detail_validators(pk, card.updated_at, None, False)
+    response = not_modified(request, etag, last_modified, vary=['Authorization'])
+    if response is None:
+        data = ProductCardSerializer(card, context={'request': Request(request)}).data
+        response = set_validators(render(data), etag, last_modified, vary=['Authorization'])
+    return response
+
+
+# Как у DRF: сессии не используются, CSRF для токенов не нужен
+for async_view in (product_list, product_search, product_detail):
+    async_view.csrf_exempt = True
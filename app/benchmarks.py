@@ -0,0 +1,244 @@
+import platform
+import statistics
+import subprocess
+import time
+from types import SimpleNamespace
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import facets, listing
+from .cache import ReferenceData
+from .models import Category, City, Product, ProductFavorite, User
+from .serializers import ProductSerializer, UserSerializer
+from .views import ProductList, ProductSearchView
+
+# Замеры эндпоинтов app/urls.py по слоям:
+#   orm       — запросы страницы к БД без отрисовки;
+#   serialize — сборка ответа по уже прочитанным строкам (со связанными запросами) и JSON;
+#   view      — полный запрос через тестовый клиент со всеми middleware.
+# Результаты пишутся в JSON, два файла сравниваются командой benchmark --compare
+
+renderer = JSONRenderer()
+
+
+class Fixture:
+    # Что подставлять в адреса: самые наполненные город и корневая категория, свежий товар,
+    # пользователь с избранным и слово из названий товаров
+
+    def __init__(self, password=None):
+        active = Product.objects.filter(status=Product.Status.ACTIVE)
+        self.product = active.order_by('-created_at', '-id').first()
+        if self.product is None:
+            raise ValueError('Нет активных товаров, сначала запустите generate_data')
+        self.city_id = (
+            City.objects.filter(products__status=Product.Status.ACTIVE).annotate(count=Count('products'))
+            .order_by('-count').values_list('id', flat=True).first()
+        )
+        self.category = Category.objects.filter(parent=None).order_by('id').first()
+        self.word = self.product.name.split()[-1]
+        user_id = (
+            ProductFavorite.objects.values('user_id').annotate(count=Count('id'))
+            .order_by('-count').values_list('user_id', flat=True).first()
+        )
+        self.user = User.objects.get(id=user_id) if user_id else self.product.author
+        self.password = password
+        self.price_range = (self.product.price // 2, self.product.price * 2)
+
+
+class Case:
+
+    def __init__(self, name, path, params=None, method='get', auth=False, data=None, layers=None):
+        self.name = name
+        self.path = path
+        self.params = params or {}
+        self.method = method
+        self.auth = auth
+        self.data = data
+        # Слой -> функция подготовки, возвращающая функцию одного прогона
+        self.layers = layers or {}
+
+
+def make_view(view_class, path, params, user=None):
+    # Представление с DRF-запросом, как его видит list(), без прохода через dispatch
+    request = APIRequestFactory().get(path, params)
+    force_authenticate(request, user)
+    view = view_class()
+    view.setup(request)
+    view.request = view.initialize_request(request)
+    view.format_kwarg = None
+    return view
+
+
+def list_layers(view_class, get_queryset, path, params):
+    def fetch(view):
+        return list(view.paginator.paginate_queryset(listing.get_rows(get_queryset(view)), view.request, view))
+
+    def prepare_orm():
+        view = make_view(view_class, path, params, AnonymousUser())
+        return lambda: fetch(view)
+
+    def prepare_serialize():
+        view = make_view(view_class, path, params, AnonymousUser())
+        rows = fetch(view)
+        # render_products дописывает в строки связанные данные, поэтому каждый прогон на копии
+        return lambda: renderer.render(listing.render_products(
+            [dict(row) for row in rows], view.request, view.kwargs.get('min_price'), view.kwargs.get('max_price'),
+        ))
+
+    return {'orm': prepare_orm, 'serialize': prepare_serialize}
+
+
+def get_cases(fixture):
+    list_params = {'city': fixture.city_id, 'status': Product.Status.ACTIVE}
+    search_params = {'name': fixture.word}
+    category_params = {
+        'category': fixture.category.id if fixture.category else '',
+        'minRange': fixture.price_range[0], 'maxRange': fixture.price_range[1],
+    }
+    product_id = fixture.product.id
+
+    def prepare_detail_orm():
+        return lambda: Product.objects.with_related().get(pk=product_id)
+
+    def prepare_detail_serialize():
+        product = Product.objects.with_related().get(pk=product_id)
+        request = SimpleNamespace(user=AnonymousUser())
+        return lambda: renderer.render(ProductSerializer(product, context={'request': request}).data)
+
+    def prepare_user_serialize():
+        request = SimpleNamespace(user=fixture.user)
+        return lambda: renderer.render(UserSerializer(fixture.user, context={'request': request}).data)
+
+    def toggle_favorite(client):
+        # Добавить и снова убрать: база после прогона та же
+        client.post(f'/product/{product_id}/favorite/')
+        return client.post(f'/product/{product_id}/favorite/')
+
+    cases = [
+        Case('category_tree', '/category/tree', layers={'orm': lambda: lambda: ReferenceData(0)}),
+        Case('category_list', '/category'),
+        Case('city_list', '/city'),
+        Case('product_list', '/product', list_params, layers=list_layers(
+            ProductList, lambda view: view.get_list_queryset(view.request), '/product', list_params,
+        )),
+        Case('product_list_own', '/product', {'own': 1, 'status': Product.Status.ACTIVE}, auth=True),
+        Case('product_search', '/search/', search_params, layers=list_layers(
+            ProductSearchView, lambda view: view.get_queryset(), '/search/', search_params,
+        )),
+        Case('product_search_category_price', '/search/', category_params, layers=list_layers(
+            ProductSearchView, lambda view: view.get_queryset(), '/search/', category_params,
+        )),
+        Case('price_facets', '/search/facets', {'city': fixture.city_id}, layers={
+            'orm': lambda: lambda: facets.get_price_facets(fixture.city_id),
+        }),
+        Case('product_detail', f'/product/{product_id}/', layers={
+            'orm': prepare_detail_orm, 'serialize': prepare_detail_serialize,
+        }),
+        Case('user', '/api/user/', auth=True, layers={'serialize': prepare_user_serialize}),
+        Case('favorite_toggle', None, method=toggle_favorite, auth=True),
+    ]
+    if fixture.password:
+        cases.append(Case('token', '/api/token/', method='post', data={
+            'username': fixture.user.username, 'password': fixture.password,
+        }))
+    return cases
+
+
+def measure(run, repeat, warmup=1):
+    for _ in range(warmup):
+        run()
+    timings = []
+    with CaptureQueriesContext(connection) as queries:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - started)
+    timings.sort()
+    return {
+        'median_ms': round(statistics.median(timings) * 1000, 3),
+        'p95_ms': round(timings[min(int(len(timings) * 0.95), len(timings) - 1)] * 1000, 3),
+        'min_ms': round(timings[0] * 1000, 3),
+        'queries': round(len(queries) / repeat, 2),
+        'repeat': repeat,
+    }
+
+
+def prepare_view(case, fixture):
+    client = Client(HTTP_HOST='localhost')
+    if case.auth:
+        client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {AccessToken.for_user(fixture.user)}'
+    if callable(case.method):
+        request = lambda: case.method(client)
+    elif case.method == 'post':
+        request = lambda: client.post(case.path, case.data)
+    else:
+        request = lambda: client.get(case.path, case.params)
+
+    def run():
+        response = request()
+        if response.status_code >= 400:
+            raise RuntimeError(f'{case.name}: ответ {response.status_code}')
+        return response
+    return run
+
+
+def run(repeat=20, names=None, layers=None, password=None, progress=None):
+    fixture = Fixture(password)
+    results = {}
+    for case in get_cases(fixture):
+        if names and case.name not in names:
+            continue
+        prepared = {**case.layers, 'view': lambda case=case: prepare_view(case, fixture)}
+        for layer, prepare in prepared.items():
+            if layers and layer not in layers:
+                continue
+            key = f'{case.name}.{layer}'
+            results[key] = measure(prepare(), repeat)
+            if progress is not None:
+                progress(key, results[key])
+    return {'meta': get_meta(repeat), 'results': results}
+
+
+def get_meta(repeat):
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=10,
+        ).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'commit': commit,
+        'created_at': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'products': Product.objects.count(),
+        'repeat': repeat,
+        'response_cache_timeout': settings.RESPONSE_CACHE_TIMEOUT,
+        'product_read_model': settings.PRODUCT_READ_MODEL,
+    }
+
+
+def compare(old, new, threshold=0.1):
+    # Строки (замер, было, стало, изменение) по медиане для замеров нового прогона;
+    # изменение больше threshold помечается
+    rows = []
+    for key in sorted(new['results']):
+        before = old['results'].get(key, {}).get('median_ms')
+        after = new['results'].get(key, {}).get('median_ms')
+        change = (after - before) / before if before and after is not None else None
+        flag = ''
+        if change is not None and abs(change) > threshold:
+            flag = 'медленнее' if change > 0 else 'быстрее'
+        rows.append((key, before, after, change, flag))
+    return rows
@@ -0,0 +1,237 @@
+import csv
+import json
+from itertools import islice
+
+from django.db import transaction
+
+from . import cards
+from .cache import bump_product_generations
+from .models import Category, City, Product, ProductCard, ProductFeature, User
+
+FIELDS = [
+    'id', 'name', 'description', 'price', 'price_suffix', 'is_lower_bound', 'status', 'category', 'city', 'author',
+    'features',
+]
+TRUE_VALUES = {'1', 'true', 'yes', 'да'}
+# Больше не помещается в IntegerField на PostgreSQL
+MAX_PRICE = 2 ** 31 - 1
+
+
+class RowError(ValueError):
+    pass
+
+
+def read_rows(file, file_format):
+    # Построчно, без чтения файла целиком. Разбор JSON — в parse_row: битая строка
+    # становится ошибкой этой строки, а не обрывает весь импорт
+    if file_format == 'csv':
+        yield from csv.DictReader(file)
+    else:
+        for line in file:
+            if line.strip():
+                yield line
+
+
+TEXT_FIELDS = ('name', 'description', 'price_suffix', 'status', 'author')
+FEATURE_NAME_LENGTH = ProductFeature._meta.get_field('name').max_length
+FEATURE_VALUE_LENGTH = ProductFeature._meta.get_field('value').max_length
+
+
+def parse_json(value, label):
+    try:
+        return json.loads(value)
+    except ValueError as error:
+        raise RowError(f'invalid {label} JSON: {error}')
+
+
+def parse_features(features):
+    if isinstance(features, str):
+        features = parse_json(features, 'features') if features.strip() else []
+    if isinstance(features, dict):
+        features = [{'name': key, 'value': value} for key, value in features.items()]
+    if not isinstance(features, list):
+        raise RowError('features must be a list')
+    parsed = []
+    for feature in features:
+        if not isinstance(feature, dict) or 'name' not in feature or 'value' not in feature:
+            raise RowError('feature must be an object with name and value')
+        name, value = feature['name'], feature['value']
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = str(value)
+        if not isinstance(name, str) or not name.strip() or len(name) > FEATURE_NAME_LENGTH:
+            raise RowError(f'invalid feature name {name!r}')
+        if not isinstance(value, str) or len(value) > FEATURE_VALUE_LENGTH:
+            raise RowError(f'invalid feature value {value!r}')
+        parsed.append({'name': name, 'value': value})
+    return parsed
+
+
+def parse_row(row):
+    # Строка JSONL или словарь CSV -> словарь с проверенными типами, иначе RowError
+    if isinstance(row, str):
+        row = parse_json(row, 'row')
+    if not isinstance(row, dict):
+        raise RowError('row must be an object')
+    for field in TEXT_FIELDS:
+        if row.get(field) is not None and not isinstance(row[field], str):
+            raise RowError(f'{field} must be a string')
+    for field in ('category', 'city'):
+        if isinstance(row.get(field), (bool, list, dict, float)):
+            raise RowError(f'invalid {field} {row[field]!r}')
+    if not isinstance(row.get('is_lower_bound'), (str, bool, int, type(None))):
+        raise RowError(f'invalid is_lower_bound {row["is_lower_bound"]!r}')
+    return {**row, 'features': parse_features(row.get('features') or [])}
+
+
+def write_rows(file, file_format, rows):
+    if file_format == 'csv':
+        writer = csv.DictWriter(file, FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({**row, 'features': json.dumps(row['features'], ensure_ascii=False)})
+    else:
+        for row in rows:
+            file.write(json.dumps(row, ensure_ascii=False))
+            file.write('\n')
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class ProductImporter:
+    # Категории, города и авторы ищутся по словарям в памяти, а не запросом на каждую строку
+
+    def __init__(self, default_author=None, default_status=Product.Status.ON_MODERATE, build_cards=True):
+        self.default_author = default_author
+        self.default_status = default_status
+        self.build_cards = build_cards
+        self.statuses = set(Product.Status.values)
+        self.price_suffixes = set(Product.PriceSuffix.values)
+        self.categories = {}
+        for category_id, name in Category.objects.values_list('id', 'name'):
+            self.categories[str(category_id)] = category_id
+            self.categories.setdefault(name, category_id)
+        self.cities = {}
+        for city in City.objects.all():
+            self.cities[str(city.id)] = city
+            self.cities[city.name] = city
+        self.authors = {default_author.username: default_author} if default_author else {}
+
+    def load_authors(self, rows):
+        usernames = {row['author'] for row in rows if row.get('author')} - set(self.authors)
+        if usernames:
+            self.authors.update((user.username, user) for user in User.objects.filter(username__in=usernames))
+
+    def lookup(self, mapping, value, label):
+        if value in (None, ''):
+            return None
+        try:
+            return mapping[str(value)]
+        except KeyError:
+            raise RowError(f'unknown {label} {value!r}')
+
+    def build(self, row):
+        name = (row.get('name') or '').strip()
+        if not name or len(name) > Product._meta.get_field('name').max_length:
+            raise RowError('name is empty or too long')
+        try:
+            price = int(row.get('price'))
+        except (TypeError, ValueError, OverflowError):
+            raise RowError(f'invalid price {row.get("price")!r}')
+        if not 0 <= price <= MAX_PRICE:
+            raise RowError(f'price out of range {price}')
+        price_suffix = row.get('price_suffix') or Product.PriceSuffix.NONE
+        if price_suffix not in self.price_suffixes:
+            raise RowError(f'invalid price_suffix {price_suffix!r}')
+        status = row.get('status') or self.default_status
+        if status not in self.statuses:
+            raise RowError(f'invalid status {status!r}')
+        category_id = self.lookup(self.categories, row.get('category'), 'category')
+        if category_id is None:
+            raise RowError('category is required')
+        author = self.lookup(self.authors, row.get('author'), 'author') or self.default_author
+        if author is None:
+            raise RowError('author is required')
+
+        is_lower_bound = row.get('is_lower_bound')
+        if isinstance(is_lower_bound, str):
+            is_lower_bound = is_lower_bound.strip().lower() in TRUE_VALUES
+        features = row['features']
+
+        product = Product(
+            name=name,
+            description=row.get('description') or '',
+            price=price,
+            price_suffix=price_suffix,
+            is_lower_bound=bool(is_lower_bound),
+            status=status,
+            category_id=category_id,
+            # Объекты, а не id: карточка возьмёт название города и автора без запросов
+            city=self.lookup(self.cities, row.get('city'), 'city'),
+            author=author,
+        )
+        return product, [ProductFeature(name=feature['name'], value=feature['value']) for feature in features]
+
+    def import_chunk(self, rows):
+        # Одна транзакция на пачку: при ошибке откатывается только она.
+        # Возвращает число записанных строк и список (номер строки в пачке, ошибка)
+        parsed, errors = [], []
+        for index, row in enumerate(rows):
+            try:
+                parsed.append((index, parse_row(row)))
+            except RowError as error:
+                errors.append((index, str(error)))
+        self.load_authors([row for _, row in parsed])
+        built = []
+        for index, row in parsed:
+            try:
+                built.append(self.build(row))
+            except RowError as error:
+                errors.append((index, str(error)))
+        errors.sort()
+
+        with transaction.atomic():
+            # bulk_create на SQLite возвращает id, по ним привязываем характеристики
+            products = Product.objects.bulk_create([product for product, _ in built])
+            features = []
+            for product, product_features in built:
+                for feature in product_features:
+                    feature.product_id = product.id
+                    features.append(feature)
+            ProductFeature.objects.bulk_create(features)
+            if self.build_cards:
+                # bulk_create не шлёт сигналов, карточки собираем сами из того, что уже в памяти
+                ProductCard.objects.bulk_create([
+                    cards.build_card(product, features=product_features, images=[])
+                    for product, product_features in built
+                ])
+            bump_product_generations({(product.city_id, product.category_id) for product in products})
+        return len(products), errors
+
+
+def export_rows(queryset, chunk_size=2000):
+    # Курсор по id: в памяти не больше одной пачки товаров с характеристиками
+    queryset = queryset.select_related('city', 'author').prefetch_related('features').order_by('id')
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id)[:chunk_size])
+        if not chunk:
+            return
+        for product in chunk:
+            yield {
+                'id': product.id,
+                'name': product.name,
+                'description': product.description,
+                'price': product.price,
+                'price_suffix': product.price_suffix,
+                'is_lower_bound': product.is_lower_bound,
+                'status': product.status,
+                'category': product.category_id,
+                'city': product.city.name if product.city_id else None,
+                'author': product.author.username,
+                'features': [{'name': feature.name, 'value': feature.value} for feature in product.features.all()],
+            }
+        last_id = chunk[-1].id
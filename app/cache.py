@@ -0,0 +1,179 @@
+import asyncio
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Category, City
+from .serializers import CategoryHierarchySerializer, CategorySerializer, CitySerializer
+
+REFERENCE_GENERATION = 'reference'
+# Сколько держим блокировку пересчёта ответа и как часто её опрашивают ожидающие
+RESPONSE_LOCK_TIMEOUT = 10
+RESPONSE_LOCK_POLL = 0.05
+
+
+def get_generations(*names):
+    # Поколения лежат в общем кэше, поэтому их видят все воркеры gunicorn.
+    # Пропавший ключ (вытеснен или кэш очищен) сразу получает новое значение
+    keys = [f'generation:{name}' for name in names]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, time.time_ns(), None)
+            found[key] = cache.get(key)
+    return tuple(found[key] for key in keys)
+
+
+async def aget_generations(*names):
+    keys = [f'generation:{name}' for name in names]
+    found = await cache.aget_many(keys)
+    for key in keys:
+        if key not in found:
+            await cache.aadd(key, time.time_ns(), None)
+            found[key] = await cache.aget(key)
+    return tuple(found[key] for key in keys)
+
+
+def bump_generation(*names):
+    def bump():
+        cache.set_many({f'generation:{name}': time.time_ns() for name in names}, None)
+
+    # Сдвигаем сразу, чтобы текущий процесс не отдал старые данные, и ещё раз после
+    # коммита: другой воркер мог успеть перечитать незакоммиченное состояние
+    bump()
+    transaction.on_commit(bump)
+
+
+class ReferenceData:
+    # Снимок категорий и городов с готовыми ответами для справочных эндпоинтов
+
+    def __init__(self, generation):
+        self.generation = generation
+        categories = list(Category.objects.order_by('id'))
+        self.categories = {category.id: category for category in categories}
+        self.children = CategoryHierarchySerializer.group_children(categories)
+        parent_categories = self.children.get(None, [])
+
+        self.category_list = CategorySerializer(parent_categories, many=True).data
+        self.city_list = CitySerializer(City.objects.order_by('id'), many=True).data
+        self.category_tree = self.serialize_tree(parent_categories)
+        self._subtrees = {}
+
+    def serialize_tree(self, categories):
+        return CategoryHierarchySerializer(categories, many=True, context={'children': self.children}).data
+
+    def get_descendants(self, category_id):
+        # Потомки в порядке обхода в глубину, как их возвращал рекурсивный get_descendants
+        descendants = []
+        for child in self.children.get(category_id, []):
+            descendants.append(child)
+            descendants += self.get_descendants(child.id)
+        return descendants
+
+    def get_subtree(self, category_id):
+        if category_id not in self.categories:
+            return None
+        if category_id not in self._subtrees:
+            categories = self.get_descendants(category_id) + [self.categories[category_id]]
+            self._subtrees[category_id] = self.serialize_tree(categories)
+        return self._subtrees[category_id]
+
+
+_reference_data = None
+_reference_lock = threading.Lock()
+
+
+def get_reference_data():
+    global _reference_data
+    generation, = get_generations(REFERENCE_GENERATION)
+    reference_data = _reference_data
+    if reference_data is None or reference_data.generation != generation:
+        with _reference_lock:
+            if _reference_data is None or _reference_data.generation != generation:
+                _reference_data = ReferenceData(generation)
+            reference_data = _reference_data
+    return reference_data
+
+
+def product_generation(kind, value=None):
+    # products:city:5 — товары города 5, products:city:* — товары любого города,
+    # products:category:3 — товары ветки категории 3
+    return f'products:{kind}:{"*" if value is None else value}'
+
+
+def bump_product_generations(locations):
+    # locations — пары (город, категория) изменившихся товаров, старые и новые.
+    # Категория сдвигает и всех предков: поиск по ветке включает товары подкатегорий
+    categories = get_reference_data().categories
+    names = {product_generation('city')}
+    for city_id, category_id in locations:
+        if city_id:
+            names.add(product_generation('city', city_id))
+        category = categories.get(category_id)
+        ancestor_ids = category.get_ancestor_ids() if category is not None else []
+        names.update(product_generation('category', pk) for pk in ancestor_ids + [category_id])
+    bump_generation(*sorted(names))
+
+
+def get_response_keys(base_key, generations):
+    key = f'response:{base_key}:{":".join(map(str, generations))}'
+    return key, f'response:{base_key}:latest', f'lock:{key}'
+
+
+def get_cached_response(base_key, generation_names, compute):
+    # Ключ содержит поколения, поэтому после изменения товаров старая запись просто перестаёт читаться.
+    # Считает ответ только тот, кто взял блокировку; остальные в это время получают последнюю
+    # посчитанную версию (base_key:latest) или ждут. Возвращает (данные, HIT | STALE | MISS)
+    key, latest_key, lock_key = get_response_keys(base_key, get_generations(*generation_names))
+    data = cache.get(key)
+    if data is not None:
+        return data, 'HIT'
+
+    deadline = time.monotonic() + RESPONSE_LOCK_TIMEOUT
+    while not cache.add(lock_key, True, RESPONSE_LOCK_TIMEOUT):
+        data = cache.get(latest_key)
+        if data is not None:
+            return data, 'STALE'
+        if time.monotonic() > deadline:
+            break
+        time.sleep(RESPONSE_LOCK_POLL)
+        data = cache.get(key)
+        if data is not None:
+            return data, 'HIT'
+    try:
+        data = compute()
+        if data is not None:
+            cache.set_many({key: data, latest_key: data}, settings.RESPONSE_CACHE_TIMEOUT)
+    finally:
+        cache.delete(lock_key)
+    return data, 'MISS'
+
+
+async def aget_cached_response(base_key, generation_names, compute):
+    # То же для async-представлений: compute — корутина, ожидание блокировки не занимает поток
+    key, latest_key, lock_key = get_response_keys(base_key, await aget_generations(*generation_names))
+    data = await cache.aget(key)
+    if data is not None:
+        return data, 'HIT'
+
+    deadline = time.monotonic() + RESPONSE_LOCK_TIMEOUT
+    while not await cache.aadd(lock_key, True, RESPONSE_LOCK_TIMEOUT):
+        data = await cache.aget(latest_key)
+        if data is not None:
+            return data, 'STALE'
+        if time.monotonic() > deadline:
+            break
+        await asyncio.sleep(RESPONSE_LOCK_POLL)
+        data = await cache.aget(key)
+        if data is not None:
+            return data, 'HIT'
+    try:
+        data = await compute()
+        if data is not None:
+            await cache.aset_many({key: data, latest_key: data}, settings.RESPONSE_CACHE_TIMEOUT)
+    finally:
+        await cache.adelete(lock_key)
+    return data, 'MISS'
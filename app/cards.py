@@ -0,0 +1,143 @@
+import threading
+from contextlib import contextmanager
+
+from django.db.models import Case, JSONField, Value, When
+from django.utils import timezone
+
+from .cache import bump_product_generations, get_reference_data
+from .models import Product, ProductCard, User
+from .serializers import ProductFeatureSerializer, UserDataSerializer, serialize_images
+
+CARD_FIELDS = [
+    'status', 'author_id', 'city_id', 'category_id', 'price', 'created_at', 'name', 'description', 'price_suffix',
+    'is_lower_bound', 'city_name', 'category_path', 'image', 'images', 'author', 'features',
+]
+
+# Категорий в одном UPDATE путей: два параметра на ветку CASE
+CATEGORY_PATH_BATCH = 400
+
+_deferred = threading.local()
+
+
+def get_category_path(category_id):
+    # Путь от корня до категории по снимку справочников, без запросов к БД
+    categories = get_reference_data().categories
+    category = categories.get(category_id)
+    if category is None:
+        return []
+    return [
+        {'id': pk, 'name': categories[pk].name}
+        for pk in category.get_ancestor_ids() + [category_id] if pk in categories
+    ]
+
+
+def serialize_author(user: User):
+    # То же, что UserDataSerializer(user).data, но без построения сериализатора на каждую карточку:
+    # при массовой пересборке это большая часть времени
+    return {field: getattr(user, field) for field in UserDataSerializer.Meta.fields}
+
+
+def serialize_features(features):
+    return [{field: getattr(feature, field) for field in ProductFeatureSerializer.Meta.fields} for feature in features]
+
+
+def build_card(product: Product, features=None, images=None):
+    # Характеристики и фотографии можно передать готовыми, если они уже в памяти (массовая загрузка)
+    images = serialize_images(product) if images is None else images
+    return ProductCard(
+        product=product,
+        status=product.status,
+        author_id=product.author_id,
+        city_id=product.city_id,
+        category_id=product.category_id,
+        price=product.price,
+        created_at=product.created_at,
+        name=product.name,
+        description=product.description,
+        price_suffix=product.price_suffix,
+        is_lower_bound=product.is_lower_bound,
+        city_name=product.city.name if product.city_id else None,
+        category_path=get_category_path(product.category_id),
+        image=images[0]['img'] if images else '',
+        images=images,
+        author=serialize_author(product.author),
+        features=serialize_features(product.features.all() if features is None else features),
+    )
+
+
+@contextmanager
+def deferred_refresh():
+    # Внутри блока refresh_cards только копит id, а карточки пересобираются один раз на выходе:
+    # сохранение товара вместе с характеристиками не пересобирает карточку на каждую строку
+    if getattr(_deferred, 'product_ids', None) is not None:
+        yield
+        return
+    _deferred.product_ids = set()
+    try:
+        yield
+        product_ids = _deferred.product_ids
+    finally:
+        _deferred.product_ids = None
+    refresh_cards(product_ids)
+
+
+def refresh_cards(product_ids):
+    # Пересобирает карточки пачкой: один запрос товаров, два на связанные строки и один upsert
+    product_ids = set(product_ids)
+    if not product_ids:
+        return
+    if getattr(_deferred, 'product_ids', None) is not None:
+        _deferred.product_ids.update(product_ids)
+        return
+    # Где товары лежали до изменения: их прежние город и категорию тоже надо сбросить в кэше ответов
+    locations = set(ProductCard.objects.filter(product_id__in=product_ids).values_list('city_id', 'category_id'))
+    products = Product.objects.filter(id__in=product_ids).with_related()
+    cards = [build_card(product) for product in products]
+    locations.update((card.city_id, card.category_id) for card in cards)
+    bump_product_generations(locations)
+    # updated_at — версия карточки для ETag и Last-Modified, при upsert её надо обновлять явно
+    ProductCard.objects.bulk_create(
+        cards, batch_size=500, update_conflicts=True, unique_fields=['product'],
+        update_fields=CARD_FIELDS + ['updated_at'],
+    )
+    missing = product_ids - {card.product_id for card in cards}
+    if missing:
+        ProductCard.objects.filter(product_id__in=missing).delete()
+
+
+def refresh_city(city):
+    ProductCard.objects.filter(city_id=city.id).update(city_name=city.name, updated_at=timezone.now())
+
+
+def refresh_category_paths(category):
+    # Пути всей ветки одним UPDATE ... SET category_path = CASE category_id ... END
+    # (пачками, чтобы не упереться в число параметров SQLite)
+    category_ids = [category.id] + [child.id for child in get_reference_data().get_descendants(category.id)]
+    now = timezone.now()
+    for start in range(0, len(category_ids), CATEGORY_PATH_BATCH):
+        batch = category_ids[start:start + CATEGORY_PATH_BATCH]
+        ProductCard.objects.filter(category_id__in=batch).update(
+            category_path=Case(
+                *[When(category_id=pk, then=Value(get_category_path(pk), output_field=JSONField())) for pk in batch],
+            ),
+            updated_at=now,
+        )
+
+
+def refresh_author(user: User):
+    cards = ProductCard.objects.filter(author_id=user.id)
+    if cards.update(author=serialize_author(user), updated_at=timezone.now()):
+        bump_product_generations(set(cards.values_list('city_id', 'category_id')))
+
+
+def rebuild_cards(chunk_size=1000):
+    product_ids = Product.objects.order_by('id').values_list('id', flat=True)
+    count = 0
+    last_id = 0
+    while True:
+        chunk = list(product_ids.filter(id__gt=last_id)[:chunk_size])
+        if not chunk:
+            return count
+        refresh_cards(chunk)
+        count += len(chunk)
+        last_id = chunk[-1]
@@ -0,0 +1,29 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+
+def make_etag(*parts):
+    # Сильный валидатор из версий данных, а не из тела ответа: считается до сериализации
+    return quote_etag(hashlib.sha1(':'.join(map(str, parts)).encode()).hexdigest())
+
+
+def set_validators(response, etag, last_modified=None, vary=()):
+    # last_modified — unix-время в секундах
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    if vary:
+        patch_vary_headers(response, vary)
+    return response
+
+
+def not_modified(request, etag, last_modified=None, vary=()):
+    # 304 по If-None-Match / If-Modified-Since (412 по If-Match), None — нужен полный ответ
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(last_modified) if last_modified is not None else None,
+    )
+    if response is not None:
+        set_validators(response, etag, last_modified, vary)
+    return response
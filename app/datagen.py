@@ -0,0 +1,184 @@
+import random
+from datetime import timedelta
+from io import BytesIO
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+
+from . import cards, images
+from .bulk import chunked
+from .cache import REFERENCE_GENERATION, bump_generation, bump_product_generations
+from .models import Category, City, Product, ProductCard, ProductFavorite, ProductFeature, ProductImage, User
+
+# Синтетические данные для замеров: города, дерево категорий, пользователи и товары
+# с характеристиками, фотографиями и избранным. Всё пишется bulk_create пачками, поэтому
+# сигналы не срабатывают: карточки, счётчики файлов и поколения кэша обновляются здесь же.
+# Полнотекстовый индекс и статистику цен поддерживают триггеры БД
+
+NOUNS = ['велосипед', 'диван', 'телефон', 'ноутбук', 'шкаф', 'коляска', 'палатка', 'холодильник', 'самокат',
+         'гитара', 'куртка', 'стол', 'кресло', 'телевизор', 'пылесос', 'лыжи', 'сноуборд', 'принтер', 'аквариум',
+         'микроволновка', 'фотоаппарат', 'объектив', 'часы', 'рюкзак', 'чемодан', 'ёлка', 'кровать', 'комод']
+ADJECTIVES = ['новый', 'почти новый', 'б/у', 'горный', 'детский', 'складной', 'кожаный', 'деревянный', 'большой',
+              'компактный', 'рабочий', 'винтажный', 'электрический', 'зимний', 'летний']
+DESCRIPTION_WORDS = ['состояние', 'отличное', 'торг', 'самовывоз', 'доставка', 'гарантия', 'комплект', 'документы',
+                     'коробка', 'без', 'дефектов', 'срочно', 'обмен', 'недорого', 'пользовались', 'аккуратно',
+                     'зарядка', 'чехол', 'инструкция', 'возможен']
+FEATURES = {
+    'Цвет': ['белый', 'чёрный', 'красный', 'синий', 'зелёный', 'серый'],
+    'Состояние': ['новое', 'хорошее', 'среднее'],
+    'Материал': ['дерево', 'металл', 'пластик', 'ткань', 'кожа'],
+    'Бренд': ['Samsung', 'Apple', 'IKEA', 'Stels', 'Bosch', 'Xiaomi'],
+    'Размер': ['S', 'M', 'L', 'XL'],
+    'Год': [str(year) for year in range(2010, 2024)],
+}
+STATUS_WEIGHTS = {
+    Product.Status.ACTIVE: 80, Product.Status.ARCHIVED: 10, Product.Status.ON_MODERATE: 7, Product.Status.CANCELED: 3,
+}
+IMAGE_COLORS = ['#d33', '#3a3', '#36c', '#fc3', '#888', '#c6f', '#3cc', '#f93']
+
+
+class DatasetGenerator:
+
+    def __init__(self, seed=0, password='benchmark', prefix='gen'):
+        self.random = random.Random(seed)
+        self.prefix = prefix
+        # Хэш считается один раз: у всех сгенерированных пользователей один пароль для нагрузочных тестов
+        self.password = make_password(password)
+        self.now = timezone.now()
+
+    def create_cities(self, count):
+        start = City.objects.count()
+        return City.objects.bulk_create(
+            [City(name=f'{self.prefix} город {start + number}') for number in range(count)], batch_size=1000,
+        )
+
+    def create_categories(self, depth, branching):
+        # По уровню за раз: bulk_create на SQLite возвращает id, из них строятся материализованные пути
+        start = Category.objects.count()
+        created, parents, number = [], [None], start
+        for _ in range(depth):
+            level = []
+            for parent in parents:
+                for _ in range(branching):
+                    level.append(Category(name=f'{self.prefix} категория {number}', parent=parent))
+                    number += 1
+            level = Category.objects.bulk_create(level, batch_size=1000)
+            for category in level:
+                prefix = category.parent.path if category.parent else Category.PATH_SEPARATOR
+                category.path = f'{prefix}{category.id}{Category.PATH_SEPARATOR}'
+            Category.objects.bulk_update(level, ['path'], batch_size=1000)
+            created += level
+            parents = level
+        bump_generation(REFERENCE_GENERATION)
+        return created
+
+    def create_users(self, count):
+        start = User.objects.count()
+        return User.objects.bulk_create([
+            User(username=f'{self.prefix}_user{start + number}', phone=f'{self.prefix}-{start + number}',
+                 password=self.password, first_name=self.random.choice(['Иван', 'Мария', 'Олег', 'Анна']))
+            for number in range(count)
+        ], batch_size=1000)
+
+    def create_image_pool(self, count):
+        # Несколько настоящих файлов с уменьшенными копиями, товары ссылаются на них как на общие фотографии
+        storage = ProductImage._meta.get_field('image').storage
+        pool = []
+        for color in (IMAGE_COLORS * (count // len(IMAGE_COLORS) + 1))[:count]:
+            buffer = BytesIO()
+            Image.new('RGB', (800 + len(pool), 600), color).save(buffer, 'JPEG')
+            name = storage.save('images/generated.jpg', ContentFile(buffer.getvalue()))
+            pool.append((name, images.render_variants(name)))
+        return pool
+
+    def build_product(self, categories, cities, authors):
+        noun = self.random.choice(NOUNS)
+        return Product(
+            name=f'{self.random.choice(ADJECTIVES)} {noun}'.capitalize(),
+            description=' '.join([noun] + self.random.choices(DESCRIPTION_WORDS, k=self.random.randint(5, 25))),
+            # Логнормальное распределение: много дешёвого и длинный хвост дорогого
+            price=min(int(self.random.lognormvariate(8, 1.3)), 10 ** 8),
+            price_suffix=self.random.choice(Product.PriceSuffix.values),
+            is_lower_bound=self.random.random() < 0.1,
+            status=self.random.choices(list(STATUS_WEIGHTS), weights=list(STATUS_WEIGHTS.values()))[0],
+            category=self.random.choice(categories),
+            # Объекты, а не id: карточка возьмёт название города и автора без запросов
+            city=self.random.choice(cities) if cities and self.random.random() < 0.95 else None,
+            author=self.random.choice(authors),
+        )
+
+    def create_products(self, count, categories, cities, authors, features=4, image_pool=(), images_per_product=2,
+                        favorites=3, chunk_size=5000, progress=None):
+        # categories — листья дерева, товары лежат в них. Возвращает число созданных товаров
+        storage = ProductImage._meta.get_field('image').storage
+        pool_urls = {
+            name: {'img': storage.url(name), 'srcset': images.get_srcset(variants)}
+            for name, variants in image_pool
+        }
+        created = 0
+        for chunk in chunked(range(count), chunk_size):
+            with transaction.atomic():
+                products = Product.objects.bulk_create(
+                    [self.build_product(categories, cities, authors) for _ in chunk], batch_size=1000,
+                )
+                # auto_now_add ставит всем одно время, даты размазываем по последнему году
+                for product in products:
+                    product.created_at = self.now - timedelta(seconds=self.random.randint(0, 365 * 24 * 3600))
+                Product.objects.bulk_update(products, ['created_at'], batch_size=1000)
+
+                product_features, product_images, product_favorites = {}, {}, []
+                for product in products:
+                    names = self.random.sample(list(FEATURES), min(self.random.randint(0, features * 2), len(FEATURES)))
+                    product_features[product.id] = [
+                        ProductFeature(product_id=product.id, name=name, value=self.random.choice(FEATURES[name]))
+                        for name in names
+                    ]
+                    product_images[product.id] = [
+                        ProductImage(product_id=product.id, image=name, variants=variants,
+                                     variants_status=ProductImage.VariantsStatus.READY)
+                        for name, variants in self.random.sample(
+                            image_pool, min(self.random.randint(0, images_per_product * 2), len(image_pool)),
+                        )
+                    ]
+                    subscribers = self.random.sample(authors, min(self.random.randint(0, favorites * 2), len(authors)))
+                    product_favorites += [ProductFavorite(user=user, product_id=product.id) for user in subscribers]
+
+                ProductFeature.objects.bulk_create(
+                    [feature for rows in product_features.values() for feature in rows], batch_size=1000,
+                )
+                ProductImage.objects.bulk_create(
+                    [image for rows in product_images.values() for image in rows], batch_size=1000,
+                )
+                ProductFavorite.objects.bulk_create(product_favorites, batch_size=1000)
+                # Фотографии в карточке — как serialize_images, но адреса файлов из пула посчитаны заранее
+                ProductCard.objects.bulk_create([
+                    cards.build_card(product, features=product_features[product.id], images=[
+                        {'id': image.id, **pool_urls[image.image.name]} for image in product_images[product.id]
+                    ])
+                    for product in products
+                ], batch_size=1000)
+                bump_product_generations({(product.city_id, product.category_id) for product in products})
+            created += len(products)
+            if progress is not None:
+                progress(created)
+        return created
+
+    def generate(self, products=1000, cities=100, users=200, category_depth=3, category_branching=5, features=4,
+                 images_per_product=2, image_pool=8, favorites=3, chunk_size=5000, progress=None):
+        cities = self.create_cities(cities)
+        categories = self.create_categories(category_depth, category_branching)
+        leaves = categories[-category_branching ** category_depth:] if categories else []
+        authors = self.create_users(users)
+        pool = self.create_image_pool(image_pool) if images_per_product else []
+        created = self.create_products(
+            products, leaves, cities, authors, features, pool, images_per_product, favorites, chunk_size, progress,
+        )
+        images.rebuild_blobs()
+        return {
+            'cities': len(cities), 'categories': len(categories), 'users': len(authors), 'products': created,
+            'features': ProductFeature.objects.count(), 'images': ProductImage.objects.count(),
+            'favorites': ProductFavorite.objects.count(),
+        }
@@ -0,0 +1,48 @@
+from django.db import connection
+from django.db.models import Count, F, Max, Min, Sum
+
+from .models import Category, Product, ProductPriceStat
+
+DEFAULT_BUCKETS = 10
+MAX_BUCKETS = 50
+
+
+def get_price_rows(city_id=None, category=None):
+    # На SQLite читаем предагрегированные счётчики, на других БД — сами товары
+    if connection.vendor == 'sqlite':
+        rows, count = ProductPriceStat.objects.all(), Sum('product_count')
+    else:
+        rows, count = Product.objects.filter(status=Product.Status.ACTIVE), Count('id')
+    if city_id:
+        rows = rows.filter(city_id=city_id)
+    if category is not None:
+        rows = rows.filter(category_id__in=Category.objects.subtree(category.path).values('id'))
+    return rows, count
+
+
+def get_price_range(city_id=None, category=None):
+    rows, count = get_price_rows(city_id, category)
+    return rows.aggregate(min_price=Min('price'), max_price=Max('price'), count=count)
+
+
+def get_price_facets(city_id=None, category=None, buckets=DEFAULT_BUCKETS):
+    rows, count = get_price_rows(city_id, category)
+    facets = rows.aggregate(min_price=Min('price'), max_price=Max('price'), count=count)
+    facets['count'] = facets['count'] or 0
+    facets['histogram'] = []
+    if not facets['count']:
+        return facets
+
+    min_price, max_price = facets['min_price'], facets['max_price']
+    width = max(-(-(max_price - min_price + 1) // buckets), 1)
+    counts = dict(
+        rows.annotate(bucket=(F('price') - min_price) / width)
+        .values('bucket').annotate(bucket_count=count).values_list('bucket', 'bucket_count')
+    )
+    for bucket in range((max_price - min_price) // width + 1):
+        facets['histogram'].append({
+            'from': min_price + bucket * width,
+            'to': min(min_price + (bucket + 1) * width - 1, max_price),
+            'count': counts.get(bucket, 0),
+        })
+    return facets
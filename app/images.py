@@ -0,0 +1,155 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.db.models import Count, F
+from PIL import Image, ImageOps
+
+from .models import MediaBlob, ProductImage
+
+logger = logging.getLogger(__name__)
+
+# Формат Pillow -> расширение файла
+VARIANT_FORMATS = {'jpeg': 'jpg', 'webp': 'webp'}
+VARIANT_QUALITY = 80
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def variant_directory(image_name):
+    # Копии лежат в каталоге, повторяющем имя оригинала: по пути копии всегда видно, чья она
+    return f'variants/{image_name}'
+
+
+def variant_name(image_name, width, image_format):
+    return f'{variant_directory(image_name)}/{width}.{VARIANT_FORMATS[image_format]}'
+
+
+def get_srcset(variants):
+    return {
+        image_format: ', '.join(f'{default_storage.url(name)} {width}w' for width, name in names.items())
+        for image_format, names in variants.items()
+    }
+
+
+def render_variants(image_name):
+    variants = {image_format: {} for image_format in VARIANT_FORMATS}
+    with default_storage.open(image_name, 'rb') as file:
+        original = ImageOps.exif_transpose(Image.open(file))
+        original = original.convert('RGB')
+
+    widths = sorted(settings.IMAGE_VARIANT_WIDTHS)
+    # Увеличенных копий не делаем, но самая маленькая есть всегда
+    widths = [width for width in widths if width < original.width] or widths[:1]
+    for width in widths:
+        resized = original.copy()
+        resized.thumbnail((width, original.height), Image.LANCZOS)
+        for image_format in VARIANT_FORMATS:
+            buffer = BytesIO()
+            resized.save(buffer, image_format, quality=VARIANT_QUALITY)
+            name = variant_name(image_name, width, image_format)
+            if default_storage.exists(name):
+                default_storage.delete(name)
+            variants[image_format][str(width)] = default_storage.save(name, ContentFile(buffer.getvalue()))
+    return variants
+
+
+def generate_variants(image_id):
+    from .cards import refresh_cards
+
+    image = ProductImage.objects.filter(id=image_id).first()
+    if image is None:
+        return None
+    # Тот же файл у другого объявления уже обработан: копии общие, строить их заново незачем
+    variants = ProductImage.objects.filter(
+        image=image.image.name, variants_status=ProductImage.VariantsStatus.READY,
+    ).exclude(id=image_id).values_list('variants', flat=True).first()
+    variants_status = ProductImage.VariantsStatus.READY
+    if variants is None:
+        try:
+            variants = render_variants(image.image.name)
+        except Exception:
+            logger.exception('Не удалось построить копии изображения %s', image_id)
+            variants, variants_status = {}, ProductImage.VariantsStatus.FAILED
+
+    ProductImage.objects.filter(id=image_id).update(variants=variants, variants_status=variants_status)
+    # update() не шлёт сигналов, поэтому карточку товара обновляем сами
+    refresh_cards([image.product_id])
+    return variants_status
+
+
+def run_in_background(image_id):
+    try:
+        generate_variants(image_id)
+    finally:
+        close_old_connections()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(settings.IMAGE_VARIANT_WORKERS, thread_name_prefix='image-variants')
+        return _executor
+
+
+def schedule_variants(image_ids):
+    # Запускаем после коммита, иначе поток может не увидеть новую строку
+    def submit():
+        executor = get_executor()
+        for image_id in image_ids:
+            executor.submit(run_in_background, image_id)
+
+    transaction.on_commit(submit)
+
+
+def is_tracked(name):
+    # Картинка по умолчанию общая для всех и не удаляется
+    return bool(name) and name != ProductImage._meta.get_field('image').default
+
+
+def acquire_blob(name):
+    if not is_tracked(name):
+        return
+    storage = ProductImage._meta.get_field('image').storage
+    MediaBlob.objects.get_or_create(name=name, defaults={'size': storage.size(name) if storage.exists(name) else 0})
+    MediaBlob.objects.filter(name=name).update(ref_count=F('ref_count') + 1)
+
+
+def release_blob(name, variants):
+    if not is_tracked(name):
+        return
+    MediaBlob.objects.filter(name=name).update(ref_count=F('ref_count') - 1)
+    if MediaBlob.objects.filter(name=name, ref_count__lte=0).delete()[0]:
+        transaction.on_commit(lambda: delete_blob_files(name, variants))
+
+
+def delete_blob_files(name, variants):
+    # Пока ждали коммита, ту же фотографию могли загрузить снова
+    if ProductImage.objects.filter(image=name).exists():
+        return
+    for names in variants.values():
+        for variant in names.values():
+            default_storage.delete(variant)
+    ProductImage._meta.get_field('image').storage.delete(name)
+
+
+def rebuild_blobs():
+    # Счётчики ссылок заново по таблице фотографий
+    storage = ProductImage._meta.get_field('image').storage
+    rows = ProductImage.objects.exclude(image=ProductImage._meta.get_field('image').default)
+    blobs = [
+        MediaBlob(name=row['image'], size=storage.size(row['image']) if storage.exists(row['image']) else 0,
+                  ref_count=row['ref_count'])
+        for row in rows.values('image').annotate(ref_count=Count('id'))
+    ]
+    with transaction.atomic():
+        MediaBlob.objects.all().delete()
+        MediaBlob.objects.bulk_create(blobs, batch_size=500)
+    return len(blobs)
@@ -0,0 +1,79 @@
+from .images import get_srcset
+from .metrics import timed
+from .models import Product, ProductCard, ProductFeature, ProductImage
+from .serializers import UserDataSerializer, get_favorite_ids
+
+# Лента и поиск без DRF-сериализаторов: словари ответа собираются прямо из строк values()
+# и заранее сгруппированных характеристик и фотографий. JSON совпадает с ProductSerializer
+# байт в байт, порядок ключей — ProductSerializer.Meta.fields
+
+PRICE_SUFFIX_LABELS = dict(Product.PriceSuffix.choices)
+AUTHOR_FIELDS = UserDataSerializer.Meta.fields
+# created_at — для курсора пагинатора, в ответ не попадает
+COMMON_FIELDS = ['pk', 'created_at', 'name', 'description', 'price', 'price_suffix', 'is_lower_bound', 'category_id',
+                 'city_id']
+PRODUCT_FIELDS = COMMON_FIELDS + ['city__name'] + [f'author__{field}' for field in AUTHOR_FIELDS]
+CARD_FIELDS = COMMON_FIELDS + ['city_name', 'images', 'features', 'author']
+image_storage = ProductImage._meta.get_field('image').storage
+
+
+def get_rows(queryset):
+    # Товары или карточки как словари; аннотации (search_rank) остаются для сортировки и курсора
+    fields = CARD_FIELDS if queryset.model is ProductCard else PRODUCT_FIELDS
+    return queryset.prefetch_related(None).values(*fields, *queryset.query.annotations)
+
+
+def group_by_product(rows):
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row.pop('product_id'), []).append(row)
+    return grouped
+
+
+def load_related(rows):
+    # Те же два запроса, что prefetch_related('features', 'images'), но без экземпляров моделей
+    product_ids = [row['pk'] for row in rows]
+    features = group_by_product(ProductFeature.objects.filter(product_id__in=product_ids).values(
+        'product_id', 'name', 'value',
+    ))
+    images = group_by_product(ProductImage.objects.filter(product_id__in=product_ids).values(
+        'product_id', 'id', 'image', 'variants',
+    ))
+    for row in rows:
+        row['features'] = features.get(row['pk'], [])
+        row['images'] = [
+            {'id': image['id'], 'img': image_storage.url(image['image']), 'srcset': get_srcset(image['variants'])}
+            for image in images.get(row['pk'], [])
+        ]
+        row['author'] = {field: row[f'author__{field}'] for field in AUTHOR_FIELDS}
+        row['city_name'] = row['city__name'] if row['city_id'] else None
+
+
+@timed('serialize')
+def render_products(rows, request, min_price=None, max_price=None):
+    # rows — строки get_rows одной страницы. min_price и max_price — как в контексте ProductSerializer
+    if not rows:
+        return []
+    if 'city__name' in rows[0]:
+        load_related(rows)
+    favorite_ids = get_favorite_ids(request, [row['pk'] for row in rows])
+    return [
+        {
+            'id': row['pk'],
+            'images': row['images'],
+            'name': row['name'],
+            'description': row['description'],
+            'price': row['price'],
+            'price_suffix': PRICE_SUFFIX_LABELS.get(row['price_suffix'], row['price_suffix']),
+            'is_lower_bound': row['is_lower_bound'],
+            'category': row['category_id'],
+            'city_id': row['city_id'],
+            'city_name': row['city_name'],
+            'min_price': row['price'] if min_price is None else min(row['price'], min_price),
+            'max_price': row['price'] if max_price is None else max(row['price'], max_price),
+            'features': row['features'],
+            'is_favorite': row['pk'] in favorite_ids,
+            'author': row['author'],
+        }
+        for row in rows
+    ]
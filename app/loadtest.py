@@ -0,0 +1,303 @@
+import asyncio
+import json
+import os
+import random
+import time
+from io import BytesIO
+from urllib.parse import urlencode, urlsplit
+
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from PIL import Image
+
+# Нагрузочный прогон по HTTP против запущенного сервера (runserver, gunicorn backend.wsgi,
+# uvicorn backend.asgi). Клиент HTTP/1.1 на asyncio-потоках без сторонних библиотек:
+# каждый виртуальный пользователь держит своё keep-alive соединение и свой JWT
+
+DEFAULT_WEIGHTS = {
+    'city_listing': 40,
+    'search': 25,
+    'product_detail': 25,
+    'favorite_toggle': 8,
+    'image_upload': 2,
+}
+UPLOAD_BODIES = 4
+
+
+class LoadTestError(Exception):
+    pass
+
+
+class Connection:
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, headers=None, body=b''):
+        # Сервер мог закрыть простаивающее keep-alive соединение: тогда один раз переподключаемся.
+        # Повторяем только если ответ ещё не начался, запрос до сервера не дошёл
+        for attempt in range(2):
+            if self.writer is None:
+                self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+            head = [f'{method} {path} HTTP/1.1', f'Host: {self.host}:{self.port}', f'Content-Length: {len(body)}']
+            head += [f'{name}: {value}' for name, value in (headers or {}).items()]
+            try:
+                self.writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+                await self.writer.drain()
+                status_line = await self.reader.readline()
+            except ConnectionError:
+                status_line = b''
+            if status_line:
+                return await self.read_response(status_line)
+            self.close()
+        raise ConnectionResetError(f'{self.host}:{self.port} закрыл соединение')
+
+    async def read_response(self, status_line):
+        status = int(status_line.split()[1])
+        headers = {}
+        while (line := await self.reader.readline()) not in (b'\r\n', b'\n', b''):
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if 'chunked' in headers.get('transfer-encoding', ''):
+            body = b''
+            while size := int((await self.reader.readline()).split(b';')[0], 16):
+                body += await self.reader.readexactly(size)
+                await self.reader.readline()
+            await self.reader.readline()
+        elif 'content-length' in headers:
+            body = await self.reader.readexactly(int(headers['content-length']))
+        else:
+            body = await self.reader.read()
+            headers['connection'] = 'close'
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status, body
+
+    async def get_json(self, path, params=None, token=None):
+        status, body = await self.request('GET', path + ('?' + urlencode(params) if params else ''), auth(token))
+        if status != 200:
+            raise LoadTestError(f'GET {path}: ответ {status}')
+        return json.loads(body)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+def auth(token):
+    return {'Authorization': f'Bearer {token}'} if token else {}
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else 0.0
+
+
+def build_upload_bodies(count=UPLOAD_BODIES):
+    # Разные файлы: одинаковые хранилище по хэшу сложило бы в один и не писало бы на диск
+    bodies = []
+    for _ in range(count):
+        buffer = BytesIO()
+        Image.frombytes('RGB', (640, 480), os.urandom(640 * 480 * 3)).save(buffer, 'jpeg', quality=85)
+        buffer.name = 'photo.jpg'
+        buffer.seek(0)
+        bodies.append(encode_multipart(BOUNDARY, {'images': [buffer]}))
+    return bodies
+
+
+class VirtualUser:
+
+    def __init__(self, connection, token=None, own_product_ids=()):
+        self.connection = connection
+        self.token = token
+        self.own_product_ids = list(own_product_ids)
+
+
+class Target:
+    # Что подставлять в запросы: города, категории и товары с ценами, прочитанные через API
+
+    def __init__(self, city_ids, category_ids, products, upload_bodies):
+        self.city_ids = city_ids
+        self.category_ids = category_ids
+        self.products = products
+        self.upload_bodies = upload_bodies
+
+
+# Сценарий получает пользователя, цель и генератор случайных чисел и возвращает
+# (маршрут для отчёта, метод, путь, заголовки, тело) или None, если пользователю он недоступен
+
+def city_listing(user, target, rnd):
+    params = {'status': 'AC', 'city': rnd.choice(target.city_ids)} if target.city_ids else {'status': 'AC'}
+    return 'GET /product', 'GET', f'/product?{urlencode(params)}', {}, b''
+
+
+def search(user, target, rnd):
+    price = rnd.choice(target.products)['price']
+    params = {'minRange': price // 2, 'maxRange': price * 2}
+    if target.category_ids:
+        params['category'] = rnd.choice(target.category_ids)
+    if target.city_ids and rnd.random() < 0.5:
+        params['city'] = rnd.choice(target.city_ids)
+    return 'GET /search/', 'GET', f'/search/?{urlencode(params)}', auth(user.token), b''
+
+
+def product_detail(user, target, rnd):
+    # Без токена: с токеном чужой товар отдаёт 403, карточку читают анонимно
+    product_id = rnd.choice(target.products)['id']
+    return 'GET /product/<pk>/', 'GET', f'/product/{product_id}/', {}, b''
+
+
+def favorite_toggle(user, target, rnd):
+    if not user.token:
+        return None
+    product_id = rnd.choice(target.products)['id']
+    return 'POST /product/<id>/favorite/', 'POST', f'/product/{product_id}/favorite/', auth(user.token), b''
+
+
+def image_upload(user, target, rnd):
+    if not user.own_product_ids:
+        return None
+    headers = {**auth(user.token), 'Content-Type': MULTIPART_CONTENT}
+    path = f'/product/{rnd.choice(user.own_product_ids)}/image'
+    return 'POST /product/<id>/image', 'POST', path, headers, rnd.choice(target.upload_bodies)
+
+
+SCENARIOS = {
+    'city_listing': city_listing,
+    'search': search,
+    'product_detail': product_detail,
+    'favorite_toggle': favorite_toggle,
+    'image_upload': image_upload,
+}
+
+
+class RouteStats:
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.statuses = {}
+
+    def add(self, latency, status):
+        self.latencies.append(latency)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if not isinstance(status, int) or status >= 400:
+            self.errors += 1
+
+    def summary(self, elapsed):
+        count = len(self.latencies)
+        return {
+            'requests': count,
+            'rps': round(count / elapsed, 2),
+            'error_rate': round(self.errors / count, 4) if count else 0.0,
+            'p50_ms': round(percentile(self.latencies, 0.5) * 1000, 2),
+            'p95_ms': round(percentile(self.latencies, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(self.latencies, 0.99) * 1000, 2),
+            'statuses': {str(status): number for status, number in sorted(self.statuses.items(), key=str)},
+        }
+
+
+class LoadTest:
+
+    def __init__(self, url, concurrency=20, duration=30.0, users=10, username='gen_user{}', password='benchmark',
+                 weights=None, think_time=0.0, seed=0):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.concurrency = concurrency
+        self.duration = duration
+        self.usernames = [username.format(number) for number in range(users)]
+        self.password = password
+        self.weights = {name: weight for name, weight in (weights or DEFAULT_WEIGHTS).items() if weight > 0}
+        self.think_time = think_time
+        self.seed = seed
+        self.stats = {}
+
+    def connect(self):
+        return Connection(self.host, self.port)
+
+    async def login(self, username):
+        connection = self.connect()
+        try:
+            body = json.dumps({'username': username, 'password': self.password}).encode()
+            status, response = await connection.request(
+                'POST', '/api/token/', {'Content-Type': 'application/json'}, body,
+            )
+            if status != 200:
+                raise LoadTestError(f'Вход {username}: ответ {status}')
+            token = json.loads(response)['access']
+            # Свои товары нужны для загрузки фотографий
+            own = await connection.get_json('/product', {'own': 1, 'status': 'AC'}, token)
+            return token, [product['id'] for product in own['results']]
+        finally:
+            connection.close()
+
+    async def prepare(self):
+        connection = self.connect()
+        try:
+            city_ids = [city['id'] for city in await connection.get_json('/city')]
+            category_ids = [category['id'] for category in await connection.get_json('/category')]
+            products = (await connection.get_json('/product', {'status': 'AC', 'page_size': 100}))['results']
+        finally:
+            connection.close()
+        if not products:
+            raise LoadTestError('На сервере нет активных товаров, заполните базу командой generate_data')
+        upload_bodies = build_upload_bodies() if self.weights.get('image_upload') else []
+        target = Target(city_ids, category_ids, products, upload_bodies)
+
+        accounts = await asyncio.gather(*(self.login(username) for username in self.usernames)) \
+            if self.usernames else []
+        # Без учётных записей — только анонимные сценарии
+        users = [VirtualUser(self.connect(), *accounts[number % len(accounts)]) if accounts
+                 else VirtualUser(self.connect()) for number in range(self.concurrency)]
+        return target, users
+
+    async def run_user(self, user, target, deadline, rnd):
+        names, weights = list(self.weights), list(self.weights.values())
+        try:
+            while time.monotonic() < deadline:
+                request = SCENARIOS[rnd.choices(names, weights)[0]](user, target, rnd)
+                if request is None:
+                    # Сценарий недоступен этому пользователю; уступаем цикл, чтобы не крутиться без await
+                    await asyncio.sleep(0)
+                    continue
+                route, method, path, headers, body = request
+                started = time.perf_counter()
+                try:
+                    status, _ = await user.connection.request(method, path, headers, body)
+                except (OSError, asyncio.IncompleteReadError, ValueError) as error:
+                    status = type(error).__name__
+                    user.connection.close()
+                self.stats.setdefault(route, RouteStats()).add(time.perf_counter() - started, status)
+                if self.think_time:
+                    await asyncio.sleep(rnd.expovariate(1 / self.think_time))
+        finally:
+            user.connection.close()
+
+    async def run(self):
+        target, users = await self.prepare()
+        started = time.monotonic()
+        deadline = started + self.duration
+        await asyncio.gather(*(
+            self.run_user(user, target, deadline, random.Random(self.seed + number))
+            for number, user in enumerate(users)
+        ))
+        return self.report(time.monotonic() - started)
+
+    def report(self, elapsed):
+        routes = {route: stats.summary(elapsed) for route, stats in sorted(self.stats.items())}
+        total = RouteStats()
+        for stats in self.stats.values():
+            total.latencies += stats.latencies
+            total.errors += stats.errors
+            for status, number in stats.statuses.items():
+                total.statuses[status] = total.statuses.get(status, 0) + number
+        return {
+            'url': f'http://{self.host}:{self.port}',
+            'concurrency': self.concurrency,
+            'duration_s': round(elapsed, 2),
+            'weights': self.weights,
+            'routes': routes,
+            'total': total.summary(elapsed),
+        }
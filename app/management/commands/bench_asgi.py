@@ -0,0 +1,178 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from app.models import ProductCard
+
+# wsgi — синхронные DRF-представления в пуле потоков, как gunicorn с --threads;
+# asgi — async_views под ASGI в одном цикле событий, как uvicorn
+MODES = ('wsgi', 'asgi')
+
+
+def build_paths(count):
+    # Смесь анонимных запросов чтения: лента, поиск, карточка товара, справочники
+    product_ids = list(ProductCard.objects.filter(status='AC').order_by('?').values_list('product_id', flat=True)[:50])
+    if not product_ids:
+        raise ValueError('Нет карточек товаров: заполните их командой rebuild_product_cards')
+    city_ids = list(ProductCard.objects.exclude(city_id=None).values_list('city_id', flat=True).distinct()[:5])
+    templates = [
+        lambda i: ('/product', {'status': 'AC'}),
+        lambda i: ('/product', {'status': 'AC', 'city': city_ids[i % len(city_ids)]} if city_ids else {'status': 'AC'}),
+        lambda i: ('/search/', {'name': ('телефон', 'велосипед', 'диван')[i % 3]}),
+        lambda i: (f'/product/{product_ids[i % len(product_ids)]}/', {}),
+        lambda i: ('/category', {}),
+        lambda i: ('/city', {}),
+    ]
+    return [templates[i % len(templates)](i) for i in range(count)]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает пропускную способность и p99 синхронных представлений под WSGI и async_views под ASGI'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=100, help='Одновременных клиентов')
+        parser.add_argument('--requests', type=int, default=2000, help='Запросов на каждый режим')
+        parser.add_argument('--threads', type=int, default=8, help='Потоков WSGI-воркера')
+        parser.add_argument('--client-delay', type=float, default=0.0,
+                            help='Сколько секунд медленный клиент принимает ответ')
+        parser.add_argument('--response-cache', action='store_true',
+                            help='Не отключать кэш ответов: по умолчанию меряем чтение из БД')
+        parser.add_argument('--mode', choices=MODES, help='Запустить один режим в текущем процессе')
+
+    def handle(self, *args, **options):
+        if options['mode']:
+            self.stdout.write(json.dumps(self.run_mode(options)))
+            return
+
+        self.stdout.write(
+            f'{options["requests"]} запросов, {options["connections"]} клиентов, '
+            f'задержка клиента {options["client_delay"] * 1000:.0f} мс'
+        )
+        for mode in MODES:
+            # Каждый режим в отдельном процессе: набор url выбирается при первом импорте urls.py
+            command = [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'bench_asgi', '--mode', mode]
+            for option in ('connections', 'requests', 'threads', 'client_delay'):
+                command += [f'--{option.replace("_", "-")}', str(options[option])]
+            if options['response_cache']:
+                command.append('--response-cache')
+            output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+            result = json.loads(output.splitlines()[-1])
+            self.stdout.write(
+                f'{mode:>5}: {result["rps"]:.0f} запросов/с, p50 {result["p50_ms"]:.1f} мс, '
+                f'p99 {result["p99_ms"]:.1f} мс, ошибок {result["errors"]}'
+            )
+
+    def run_mode(self, options):
+        mode = options['mode']
+        overrides = {'ASYNC_READ_VIEWS': mode == 'asgi'}
+        if not options['response_cache']:
+            overrides['RESPONSE_CACHE_TIMEOUT'] = 0
+        with override_settings(**overrides):
+            paths = build_paths(options['requests'])
+            runner = self.run_asgi if mode == 'asgi' else self.run_wsgi
+            # Прогрев: импорт urls.py, снимок справочников, соединения
+            asyncio.run(runner(paths[:12], options))
+            started = time.perf_counter()
+            results = asyncio.run(runner(paths, options))
+            elapsed = time.perf_counter() - started
+
+        latencies = [latency for latency, _ in results]
+        return {
+            'rps': len(results) / elapsed,
+            'p50_ms': percentile(latencies, 0.5) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'errors': sum(status != 200 for _, status in results),
+        }
+
+    async def run_clients(self, paths, options, request):
+        # Клиенты по очереди забирают следующий запрос, пока список не кончится
+        queue = iter(paths)
+        results = []
+
+        async def client():
+            for path, params in queue:
+                started = time.perf_counter()
+                status = await request(path, urlencode(params))
+                results.append((time.perf_counter() - started, status))
+
+        await asyncio.gather(*(client() for _ in range(options['connections'])))
+        return results
+
+    async def run_wsgi(self, paths, options):
+        from django.core.wsgi import get_wsgi_application
+
+        application = get_wsgi_application()
+        loop = asyncio.get_running_loop()
+
+        def call(path, query):
+            status = []
+            body = application({
+                'REQUEST_METHOD': 'GET',
+                'PATH_INFO': path,
+                'QUERY_STRING': query,
+                'SERVER_NAME': 'localhost',
+                'SERVER_PORT': '80',
+                'HTTP_HOST': 'localhost',
+                'wsgi.url_scheme': 'http',
+                'wsgi.input': sys.stdin.buffer,
+                'wsgi.errors': sys.stderr,
+            }, lambda code, headers: status.append(int(code.split()[0])))
+            b''.join(body)
+            body.close()
+            # Синхронный воркер занят, пока медленный клиент не примет ответ
+            time.sleep(options['client_delay'])
+            return status[0]
+
+        with ThreadPoolExecutor(options['threads']) as executor:
+            async def request(path, query):
+                return await loop.run_in_executor(executor, call, path, query)
+
+            return await self.run_clients(paths, options, request)
+
+    async def run_asgi(self, paths, options):
+        from django.core.asgi import get_asgi_application
+
+        application = get_asgi_application()
+
+        async def request(path, query):
+            status = []
+
+            async def receive():
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+                elif not message.get('more_body'):
+                    # Цикл событий свободен, пока клиент принимает ответ
+                    await asyncio.sleep(options['client_delay'])
+
+            await application({
+                'type': 'http',
+                'asgi': {'version': '3.0'},
+                'http_version': '1.1',
+                'method': 'GET',
+                'scheme': 'http',
+                'path': path,
+                'query_string': query.encode(),
+                'headers': [(b'host', b'localhost')],
+                'server': ('localhost', 80),
+                'client': ('127.0.0.1', 0),
+            }, receive, send)
+            return status[0]
+
+        return await self.run_clients(paths, options, request)
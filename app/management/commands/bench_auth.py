@@ -0,0 +1,45 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.tokens import AccessToken
+
+from app.models import User
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает задержку аутентифицированных запросов с кэшем пользователя из JWT и без него'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help='Чей токен использовать, по умолчанию первый пользователь')
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--path', default='/product?own=1&status=AC&page_size=20')
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('id')
+        user = users.filter(username=options['username']).first() if options['username'] else users.first()
+        if user is None:
+            raise CommandError('Пользователь не найден')
+        client = Client(HTTP_HOST='localhost', HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+
+        for name, timeout in (('без кэша', 0), ('с кэшем', 60)):
+            with override_settings(AUTH_USER_CACHE_TIMEOUT=timeout):
+                client.get(options['path'])
+                timings = []
+                with CaptureQueriesContext(connection) as queries:
+                    for _ in range(options['requests']):
+                        started = time.perf_counter()
+                        response = client.get(options['path'])
+                        timings.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    raise CommandError(f'{options["path"]}: ответ {response.status_code}')
+                user_queries = sum('FROM "app_user"' in query['sql'] for query in queries.captured_queries)
+                self.stdout.write(
+                    f'{name:>9}: медиана {statistics.median(timings) * 1000:.2f} мс, '
+                    f'p99 {sorted(timings)[int(len(timings) * 0.99)] * 1000:.2f} мс, '
+                    f'запросов к БД на запрос {len(queries) / len(timings):.1f}, '
+                    f'из них к пользователям {user_queries / len(timings):.1f}'
+                )
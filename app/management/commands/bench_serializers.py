@@ -0,0 +1,55 @@
+import statistics
+import time
+from types import SimpleNamespace
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from app import listing
+from app.models import Product, ProductCard
+from app.serializers import ProductCardSerializer, ProductSerializer
+
+
+def serialize(queryset, serializer_class, request):
+    return serializer_class(queryset, many=True, context={'request': request}).data
+
+
+def render_lean(queryset, request):
+    return listing.render_products(list(listing.get_rows(queryset)), request)
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает скорость отрисовки ленты через DRF-сериализаторы и через listing.render_products'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[20, 200, 2000], help='Товаров в одной выдаче')
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, **options):
+        request = SimpleNamespace(user=AnonymousUser())
+        renderer = JSONRenderer()
+        for size in options['sizes']:
+            products = Product.objects.with_related().order_by('-pk')[:size]
+            cards = ProductCard.objects.order_by('-pk')[:size]
+            modes = {
+                'ProductSerializer': lambda: serialize(products, ProductSerializer, request),
+                'лёгкий, товары': lambda: render_lean(products, request),
+                'ProductCardSerializer': lambda: serialize(cards, ProductCardSerializer, request),
+                'лёгкий, карточки': lambda: render_lean(cards, request),
+            }
+            self.stdout.write(f'Выдача из {size} товаров (время с запросами к БД и JSON):')
+            outputs = {}
+            for name, build in modes.items():
+                timings = []
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    outputs[name] = renderer.render(build())
+                    timings.append(time.perf_counter() - started)
+                median = statistics.median(timings)
+                self.stdout.write(f'  {name:>22}: {median * 1000:8.1f} мс, {size / median:8.0f} товаров/с')
+
+            # Лёгкий путь обязан отдавать те же байты
+            for reference, lean in (('ProductSerializer', 'лёгкий, товары'), ('ProductCardSerializer', 'лёгкий, карточки')):
+                if outputs[reference] != outputs[lean]:
+                    self.stderr.write(f'  JSON отличается: {reference} и {lean}')
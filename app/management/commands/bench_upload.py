@@ -0,0 +1,135 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from PIL import Image
+from rest_framework.parsers import MultiPartParser
+from rest_framework.request import Request
+
+from app import uploads
+from app.serializers import ProductImageSerializer
+
+# Режим -> (парсер, число процессов проверки). memory — как было: файлы до 2.5 МБ
+# держатся в памяти и проверяются по очереди в потоке запроса
+MODES = {
+    'memory': (MultiPartParser, 0),
+    'streaming': (uploads.ImageUploadParser, None),
+}
+
+
+def peak_rss_mb(pid='self'):
+    # VmHWM, а не ru_maxrss: ru_maxrss наследуется от родителя через fork/exec
+    with open(f'/proc/{pid}/status') as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    return 0
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает память и время разбора загрузки фотографий до и после потоковой загрузки'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--files', type=int, default=10, help='Фотографий в одном запросе')
+        parser.add_argument('--width', type=int, default=1600)
+        parser.add_argument('--height', type=int, default=1200)
+        parser.add_argument('--format', choices=('jpeg', 'png', 'webp'), default='jpeg',
+                            help='Уменьшенное декодирование при проверке есть только у JPEG')
+        parser.add_argument('--repeat', type=int, default=5, help='Запросов на каждый режим')
+        parser.add_argument('--mode', choices=MODES, help='Запустить один режим в текущем процессе')
+        parser.add_argument('--body', help='Файл с телом запроса для --mode')
+
+    def handle(self, *args, **options):
+        if options['mode']:
+            self.stdout.write(json.dumps(self.run_mode(options['mode'], options['body'], options['repeat'])))
+            return
+
+        with tempfile.TemporaryDirectory() as directory:
+            body_path = self.build_body(directory, options)
+            self.stdout.write(
+                f'{options["files"]} фото {options["format"].upper()} {options["width"]}x{options["height"]}, '
+                f'тело запроса {os.path.getsize(body_path) / 2 ** 20:.1f} МБ'
+            )
+            if options['format'] != 'jpeg':
+                # Память процесса проверки растёт с числом пикселей, потолок — MAX_IMAGE_DECODE_PIXELS
+                self.stdout.write(
+                    f'  {options["format"].upper()} проверяется полным декодированием, '
+                    f'не больше {settings.MAX_IMAGE_DECODE_PIXELS} пикселей на файл'
+                )
+            for mode in MODES:
+                # Каждый режим в отдельном процессе, иначе пиковая память одного скроет другой
+                output = subprocess.run(
+                    [
+                        sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'bench_upload',
+                        '--mode', mode, '--body', body_path, '--repeat', str(options['repeat']),
+                    ],
+                    check=True, capture_output=True, text=True,
+                ).stdout
+                result = json.loads(output.splitlines()[-1])
+                self.stdout.write(
+                    f'{mode:>10}: среднее {result["mean_ms"]:.0f} мс, максимум {result["max_ms"]:.0f} мс, '
+                    f'пик памяти процесса {result["rss_mb"]:.0f} МБ, процесса проверки {result["workers_rss_mb"]:.0f} МБ'
+                )
+
+    def build_body(self, directory, options):
+        files = []
+        for index in range(options['files']):
+            size = (options['width'], options['height'])
+            # Шум плохо сжимается, поэтому размер файла близок к снимку с телефона
+            photo = Image.frombytes('RGB', size, os.urandom(size[0] * size[1] * 3))
+            buffer = BytesIO()
+            photo.save(buffer, options['format'], quality=90)
+            buffer.name = f'photo{index}.{options["format"]}'
+            buffer.seek(0)
+            files.append(buffer)
+
+        body_path = os.path.join(directory, 'body')
+        with open(body_path, 'wb') as body:
+            body.write(encode_multipart(BOUNDARY, {'images': files}))
+        return body_path
+
+    def run_mode(self, mode, body_path, repeat):
+        parser_class, workers = MODES[mode]
+        latencies = []
+        with override_settings(IMAGE_VERIFY_WORKERS=settings.IMAGE_VERIFY_WORKERS if workers is None else workers):
+            # Первый запрос прогревочный: в нём поднимается пул процессов
+            for _ in range(repeat + 1):
+                with open(body_path, 'rb') as body:
+                    request = Request(WSGIRequest({
+                        'REQUEST_METHOD': 'POST',
+                        'PATH_INFO': '/',
+                        'SERVER_NAME': 'localhost',
+                        'SERVER_PORT': '80',
+                        'wsgi.url_scheme': 'http',
+                        'wsgi.input': body,
+                        'CONTENT_TYPE': MULTIPART_CONTENT,
+                        'CONTENT_LENGTH': str(os.path.getsize(body_path)),
+                    }), parsers=[parser_class()])
+                    started = time.perf_counter()
+                    serializer = ProductImageSerializer(data=request.data)
+                    if not serializer.is_valid():
+                        raise ValueError(serializer.errors)
+                    latencies.append((time.perf_counter() - started) * 1000)
+                    for file in request.FILES.getlist('images'):
+                        file.close()
+
+        workers_rss = 0
+        if uploads._pool is not None:
+            workers_rss = max(peak_rss_mb(pid) for pid in uploads._pool._processes)
+            uploads._pool.shutdown()
+        return {
+            'mean_ms': statistics.mean(latencies[1:]),
+            'max_ms': max(latencies[1:]),
+            'rss_mb': peak_rss_mb(),
+            'workers_rss_mb': workers_rss,
+        }
@@ -0,0 +1,57 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from app import benchmarks
+
+
+class Command(BaseCommand):
+    help = ('Замеряет эндпоинты по слоям (запросы к БД, сериализация, представление целиком), '
+            'пишет результаты в JSON и сравнивает с прошлым прогоном')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='Куда записать результаты, например bench/$(git rev-parse --short HEAD).json')
+        parser.add_argument('--compare', help='JSON прошлого прогона, с которым сравнить')
+        parser.add_argument('--repeat', type=int, default=20, help='Прогонов каждого замера')
+        parser.add_argument('--case', action='append', help='Только эти эндпоинты, можно повторять')
+        parser.add_argument('--layer', action='append', choices=('orm', 'serialize', 'view'))
+        parser.add_argument('--password', help='Пароль пользователей generate_data, чтобы замерить api/token/')
+        parser.add_argument('--threshold', type=float, default=0.1, help='Изменение медианы, которое отмечать')
+        parser.add_argument('--response-cache', action='store_true',
+                            help='Не выключать кэш ответов: замерять попадания, а не работу представлений')
+
+    def handle(self, *args, **options):
+        previous = None
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as file:
+                previous = json.load(file)
+
+        overrides = {'QUERY_BUDGET_MODE': None}
+        if not options['response_cache']:
+            overrides['RESPONSE_CACHE_TIMEOUT'] = 0
+        try:
+            with override_settings(**overrides):
+                report = benchmarks.run(
+                    options['repeat'], options['case'], options['layer'], options['password'], self.progress,
+                )
+        except (ValueError, RuntimeError) as error:
+            raise CommandError(error)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+            self.stdout.write(f'Записано в {options["output"]}')
+        if previous is not None:
+            self.stdout.write(f'Сравнение с {previous["meta"].get("commit") or options["compare"]}:')
+            for key, before, after, change, flag in benchmarks.compare(previous, report, options['threshold']):
+                before = '—' if before is None else f'{before:.2f}'
+                after = '—' if after is None else f'{after:.2f}'
+                change = '' if change is None else f'{change:+.0%}'
+                self.stdout.write(f'  {key:<42} {before:>9} → {after:>9} мс {change:>6} {flag}')
+
+    def progress(self, key, result):
+        self.stdout.write(
+            f'  {key:<42} медиана {result["median_ms"]:8.2f} мс, p95 {result["p95_ms"]:8.2f} мс, '
+            f'запросов {result["queries"]:g}'
+        )
@@ -0,0 +1,125 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import resolve
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from app.models import Category, City, Product, ProductCard, User
+
+PRODUCT_TABLES = (Product._meta.db_table, ProductCard._meta.db_table)
+# Как выглядит в плане выборка строки по первичному ключу
+PK_LOOKUPS = (f'{Product._meta.db_table} USING INTEGER PRIMARY KEY (rowid=?)', f'({ProductCard._meta.pk.column}=?)')
+
+
+class Command(BaseCommand):
+    help = 'Проверяет через EXPLAIN QUERY PLAN, что запросы эндпоинтов к товарам идут по индексам'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--analyze', action='store_true',
+            help='Собрать статистику (ANALYZE) перед проверкой. Без неё SQLite выбирает индексы наугад',
+        )
+        parser.add_argument(
+            '--read-model', action='store_true', help='Проверить запросы к таблице карточек (PRODUCT_READ_MODEL)',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Проверка планов написана для SQLite')
+
+        with connection.cursor() as cursor:
+            if options['analyze']:
+                cursor.execute('ANALYZE')
+            cursor.execute("SELECT count(*) FROM sqlite_master WHERE name = 'sqlite_stat1'")
+            if not cursor.fetchone()[0]:
+                # Без статистики SQLite не знает, что совпадений FTS мало, и ведёт поиск по индексу статуса
+                self.stdout.write(self.style.WARNING(
+                    'Статистика не собрана, планы могут отличаться от боевых, поиск по названию не пройдёт (--analyze)'
+                ))
+
+        with override_settings(PRODUCT_READ_MODEL=options['read_model']):
+            failures = self.check_scenarios()
+        if failures:
+            raise CommandError(f'Запросов без индекса или с сортировкой во временном B-дереве: {failures}')
+
+    def check_scenarios(self):
+        failures = 0
+        for url, params, user, sorted_in_memory in self.get_scenarios():
+            for sql in self.capture_queries(url, params, user):
+                plan = self.explain(sql)
+                problems = self.find_problems(plan, ranked='name' in params, sorted_in_memory=sorted_in_memory)
+                title = f'{url} {params}'
+                if problems:
+                    failures += 1
+                    self.stdout.write(self.style.ERROR(f'FAIL {title}'))
+                    self.stdout.write(f'  {sql}')
+                    for line in plan:
+                        self.stdout.write(f'  | {line}')
+                else:
+                    self.stdout.write(self.style.SUCCESS(f'OK   {title}'))
+                    self.stdout.write(f'  {"; ".join(plan)}')
+        return failures
+
+    def get_scenarios(self):
+        # (адрес, параметры, пользователь, допустима ли сортировка во временном B-дереве)
+        city_id = City.objects.values_list('id', flat=True).first() or 1
+        branch_id = Category.objects.filter(children__isnull=False).values_list('id', flat=True).first()
+        leaf_id = Category.objects.filter(children=None).values_list('id', flat=True).first() or 1
+        product = Product.objects.filter(status=Product.Status.ACTIVE).order_by('-id').first()
+        product_id = product.id if product else 1
+        # Слово из названия настоящего товара: по несуществующему слову план строится на пустом совпадении
+        word = product.name.split()[-1] if product else 'товар'
+        user = User.objects.first()
+
+        scenarios = [
+            ('/product', {'city': city_id, 'status': 'AC'}, None, False),
+            ('/product', {'city': city_id, 'status': 'AC', 'ordering': 'price'}, None, False),
+            ('/product', {'status': 'AC'}, None, False),
+            ('/search/', {}, None, False),
+            ('/search/', {'city': city_id}, None, False),
+            ('/search/', {'category': leaf_id}, None, False),
+            ('/search/', {'category': leaf_id, 'city': city_id}, None, False),
+            ('/search/', {'city': city_id, 'minRange': 0, 'maxRange': 100000, 'ordering': 'price'}, None, False),
+            ('/search/', {'name': word}, None, False),
+            (f'/product/{product_id}/', {}, None, False),
+        ]
+        if branch_id is not None:
+            # В ветке несколько category_id, порядок индекса теряется: товары выбираются по индексу,
+            # а страница досортировывается в памяти
+            scenarios += [
+                ('/search/', {'category': branch_id}, None, True),
+                ('/search/', {'category': branch_id, 'city': city_id}, None, True),
+            ]
+        if user is not None:
+            scenarios.append(('/product', {'own': 1, 'status': 'AC'}, user, False))
+        return scenarios
+
+    def capture_queries(self, url, params, user):
+        request = APIRequestFactory().get(url, params, HTTP_HOST='localhost')
+        if user is not None:
+            force_authenticate(request, user)
+        match = resolve(url)
+        with CaptureQueriesContext(connection) as context:
+            match.func(request, *match.args, **match.kwargs).render()
+        return [
+            query['sql'] for query in context.captured_queries
+            if query['sql'].startswith('SELECT') and any(f'FROM "{table}"' in query['sql'] for table in PRODUCT_TABLES)
+        ]
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+
+    def find_problems(self, plan, ranked=False, sorted_in_memory=False):
+        # Полный проход по таблице товаров или сортировка результата во временном B-дереве.
+        # Ранг bm25 не индексируется, поэтому при полнотекстовом поиске сортировка допустима,
+        # но товары должны выбираться по id из индекса FTS, а не перебором
+        if ranked:
+            found = any(line.startswith('SEARCH') and line.endswith(PK_LOOKUPS) for line in plan)
+            return [] if found else ['нет выборки товаров по id']
+        return [
+            line for line in plan
+            if line in [f'SCAN {table}' for table in PRODUCT_TABLES]
+            or (line.startswith('USE TEMP B-TREE FOR ORDER BY') and not sorted_in_memory)
+        ]
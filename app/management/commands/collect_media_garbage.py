@@ -0,0 +1,131 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app.images import variant_directory
+from app.models import MediaBlob, ProductImage
+from app.storage import HASHED_DIRECTORY
+
+VARIANTS_DIRECTORY = variant_directory('').rstrip('/')
+# Только каталоги, которыми управляет приложение: остальное в MEDIA_ROOT не трогаем
+MANAGED_DIRECTORIES = (HASHED_DIRECTORY, VARIANTS_DIRECTORY)
+
+
+def walk(root, parts, checkpoint):
+    # Обход в отсортированном порядке по компонентам пути, по одному каталогу в памяти.
+    # Поддеревья целиком до контрольной точки пропускаем, не заходя в них
+    with os.scandir(os.path.join(root, *parts)) as entries:
+        entries = sorted(entries, key=lambda entry: entry.name)
+    for entry in entries:
+        entry_parts = parts + [entry.name]
+        if entry.is_dir(follow_symlinks=False):
+            if entry_parts >= checkpoint[:len(entry_parts)]:
+                yield from walk(root, entry_parts, checkpoint)
+        elif entry.is_file(follow_symlinks=False) and entry_parts > checkpoint:
+            yield entry_parts, entry
+
+
+def get_original_name(name):
+    # variants/<имя оригинала>/<ширина>.<расширение> -> имя оригинала
+    return name[len(VARIANTS_DIRECTORY) + 1:].rsplit('/', 1)[0]
+
+
+def find_orphans(names):
+    originals = {name: get_original_name(name) if name.startswith(VARIANTS_DIRECTORY + '/') else name for name in names}
+    referenced = set(
+        ProductImage.objects.filter(image__in=set(originals.values())).values_list('image', flat=True)
+    )
+    return [name for name in names if originals[name] not in referenced]
+
+
+class Command(BaseCommand):
+    help = 'Удаляет из MEDIA_ROOT фотографии и их копии, на которые не ссылается ни одна строка ProductImage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать, сколько места освободится')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Сколько путей проверять одним запросом')
+        parser.add_argument('--limit', type=int, help='Остановиться после стольких файлов и запомнить место')
+        parser.add_argument('--min-age', type=int, default=3600,
+                            help='Не трогать файлы моложе стольких секунд: строка в БД могла ещё не закоммититься')
+        parser.add_argument('--checkpoint', default=os.path.join(settings.BASE_DIR, 'var', 'media_gc.checkpoint'),
+                            help='Файл с последним обработанным путём')
+
+    def handle(self, *args, **options):
+        root = settings.MEDIA_ROOT
+        checkpoint = self.read_checkpoint(options['checkpoint'])
+        newest = time.time() - options['min_age']
+        examined = orphaned = reclaimed = 0
+        finished = True
+        last = None
+        batch = {}
+
+        files = (
+            item for top in MANAGED_DIRECTORIES if os.path.isdir(os.path.join(root, top))
+            for item in walk(root, [top], checkpoint)
+        )
+        for parts, entry in files:
+            if options['limit'] is not None and examined >= options['limit']:
+                finished = False
+                break
+            examined += 1
+            last = parts
+            stat = entry.stat(follow_symlinks=False)
+            if stat.st_mtime <= newest:
+                batch['/'.join(parts)] = (entry.path, stat.st_size)
+            if len(batch) >= options['batch_size']:
+                count, size = self.collect(root, batch, options['dry_run'])
+                orphaned, reclaimed = orphaned + count, reclaimed + size
+                self.save_checkpoint(options, last)
+                batch = {}
+
+        count, size = self.collect(root, batch, options['dry_run'])
+        orphaned, reclaimed = orphaned + count, reclaimed + size
+        # Дошли до конца — следующий запуск начнёт обход заново
+        self.save_checkpoint(options, None if finished else last)
+
+        verb = 'Можно удалить' if options['dry_run'] else 'Удалено'
+        self.stdout.write(
+            f'Просмотрено файлов: {examined}. {verb} файлов без ссылок: {orphaned} ({reclaimed / 2 ** 20:.1f} МБ)'
+        )
+        if not finished:
+            self.stdout.write('Обход не закончен, следующий запуск продолжит с того же места')
+
+    def collect(self, root, batch, dry_run):
+        if not batch:
+            return 0, 0
+        orphans = find_orphans(list(batch))
+        if not dry_run:
+            for name in orphans:
+                os.remove(batch[name][0])
+                self.remove_empty_directories(root, name)
+            MediaBlob.objects.filter(name__in=orphans).delete()
+        return len(orphans), sum(batch[name][1] for name in orphans)
+
+    def remove_empty_directories(self, root, name):
+        # Каталоги, опустевшие после удаления, убираем, но не выше images/ и variants/
+        parts = name.split('/')[:-1]
+        while len(parts) > 1:
+            try:
+                os.rmdir(os.path.join(root, *parts))
+            except OSError:
+                return
+            parts.pop()
+
+    def read_checkpoint(self, path):
+        if not os.path.exists(path):
+            return []
+        with open(path) as file:
+            return file.read().strip().split('/')
+
+    def save_checkpoint(self, options, parts):
+        if options['dry_run']:
+            return
+        if parts is None:
+            if os.path.exists(options['checkpoint']):
+                os.remove(options['checkpoint'])
+            return
+        os.makedirs(os.path.dirname(options['checkpoint']), exist_ok=True)
+        with open(options['checkpoint'], 'w') as file:
+            file.write('/'.join(parts))
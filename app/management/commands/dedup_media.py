@@ -0,0 +1,83 @@
+import os
+import re
+import shutil
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from app import cards, images
+from app.models import ProductImage
+from app.storage import HASHED_DIRECTORY, hash_content, hashed_name, is_hashed_name
+
+HASHED_PREFIX_RE = re.compile(r'^[0-9a-f]{2}$')
+
+
+class Command(BaseCommand):
+    help = 'Переносит фотографии из старых каталогов по датам в хранилище по хэшу, склеивая одинаковые файлы'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать, ничего не менять')
+
+    def handle(self, *args, **options):
+        storage = ProductImage._meta.get_field('image').storage
+        moved = duplicates = skipped = reclaimed = 0
+        seen = set()
+        product_ids = set()
+
+        root = storage.path(HASHED_DIRECTORY)
+        for directory, directory_names, file_names in os.walk(root):
+            if directory == root:
+                # Уже перенесённые файлы лежат в images/ab/..., их не обходим
+                directory_names[:] = [d for d in directory_names if not HASHED_PREFIX_RE.match(d)]
+            for file_name in sorted(file_names):
+                path = os.path.join(directory, file_name)
+                name = os.path.relpath(path, storage.location).replace(os.sep, '/')
+                if is_hashed_name(name):
+                    continue
+                rows = ProductImage.objects.filter(image=name)
+                if not rows.exists():
+                    # Файлы без ссылок удаляет сборщик мусора, здесь их не трогаем
+                    skipped += 1
+                    continue
+
+                with storage.open(name, 'rb') as content:
+                    target = hashed_name(hash_content(content), name)
+                if target in seen or storage.exists(target):
+                    duplicates += 1
+                    reclaimed += os.path.getsize(path)
+                else:
+                    moved += 1
+                seen.add(target)
+                if options['dry_run']:
+                    continue
+
+                if not storage.exists(target):
+                    os.makedirs(os.path.dirname(storage.path(target)), exist_ok=True)
+                    # Сначала новое имя, потом строки в БД и только затем удаляем старый файл
+                    try:
+                        os.link(path, storage.path(target))
+                    except OSError:
+                        shutil.copy2(path, storage.path(target))
+                with transaction.atomic():
+                    product_ids.update(rows.values_list('product_id', flat=True))
+                    # Копии строились от старого имени: строки снова ждут обработки
+                    rows.update(image=target, variants={}, variants_status=ProductImage.VariantsStatus.PENDING)
+                os.remove(path)
+                shutil.rmtree(storage.path(images.variant_directory(name)), ignore_errors=True)
+
+        if options['dry_run']:
+            self.stdout.write(
+                f'Будет перенесено файлов: {moved}, дубликатов: {duplicates} ({reclaimed / 2 ** 20:.1f} МБ), '
+                f'без ссылок: {skipped}'
+            )
+            return
+
+        blobs = images.rebuild_blobs()
+        product_ids = sorted(product_ids)
+        for start in range(0, len(product_ids), 1000):
+            cards.refresh_cards(product_ids[start:start + 1000])
+        self.stdout.write(self.style.SUCCESS(
+            f'Перенесено файлов: {moved}, удалено дубликатов: {duplicates} ({reclaimed / 2 ** 20:.1f} МБ), '
+            f'без ссылок: {skipped}, уникальных файлов: {blobs}'
+        ))
+        self.stdout.write('Уменьшенные копии перенесённых фотографий построит generate_image_variants')
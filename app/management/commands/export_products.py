@@ -0,0 +1,42 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from app import bulk
+from app.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Выгружает товары в CSV или JSONL потоком, пачками по id'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Куда писать, - для stdout')
+        parser.add_argument('--format', choices=('csv', 'jsonl'), help='По умолчанию по расширению файла')
+        parser.add_argument('--status', choices=Product.Status.values, help='Только товары с этим статусом')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Товаров в одном запросе')
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or ('csv' if options['path'].endswith('.csv') else 'jsonl')
+        queryset = Product.objects.all()
+        if options['status']:
+            queryset = queryset.filter(status=options['status'])
+
+        exported = 0
+        started = time.monotonic()
+
+        def counted(rows):
+            nonlocal exported
+            for row in rows:
+                exported += 1
+                yield row
+
+        file = sys.stdout if options['path'] == '-' else open(options['path'], 'w', newline='', encoding='utf-8')
+        try:
+            bulk.write_rows(file, file_format, counted(bulk.export_rows(queryset, options['chunk_size'])))
+        finally:
+            if file is not sys.stdout:
+                file.close()
+
+        elapsed = time.monotonic() - started
+        self.stderr.write(f'Выгружено товаров: {exported}, {elapsed:.1f} с, {exported / max(elapsed, 1e-9):.0f} строк/с')
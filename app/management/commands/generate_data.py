@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.datagen import DatasetGenerator
+
+
+class Command(BaseCommand):
+    help = 'Заполняет базу синтетическими товарами для замеров: города, категории, пользователи, избранное'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--cities', type=int, default=1000)
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--category-depth', type=int, default=3, help='Уровней в дереве категорий')
+        parser.add_argument('--category-branching', type=int, default=6, help='Подкатегорий у каждой категории')
+        parser.add_argument('--features', type=int, default=4, help='Характеристик у товара в среднем')
+        parser.add_argument('--images', type=int, default=2, help='Фотографий у товара в среднем')
+        parser.add_argument('--image-pool', type=int, default=8, help='Разных файлов фотографий')
+        parser.add_argument('--favorites', type=int, default=3, help='Добавлений в избранное на товар в среднем')
+        parser.add_argument('--password', default='benchmark', help='Пароль всех созданных пользователей')
+        parser.add_argument('--prefix', default='gen', help='Начало имён городов, категорий и пользователей')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Товаров в одной транзакции')
+
+    def handle(self, *args, **options):
+        if options['category_depth'] < 1 or options['category_branching'] < 1 or options['users'] < 1:
+            raise CommandError('Нужны хотя бы одна категория и один пользователь')
+        generator = DatasetGenerator(options['seed'], options['password'], options['prefix'])
+        started = time.monotonic()
+
+        def progress(created):
+            elapsed = time.monotonic() - started
+            self.stdout.write(f'  товаров: {created}, {elapsed:.0f} с')
+
+        counts = generator.generate(
+            products=options['products'], cities=options['cities'], users=options['users'],
+            category_depth=options['category_depth'], category_branching=options['category_branching'],
+            features=options['features'], images_per_product=options['images'], image_pool=options['image_pool'],
+            favorites=options['favorites'], chunk_size=options['chunk_size'], progress=progress,
+        )
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            ', '.join(f'{name}: {count}' for name, count in counts.items())
+            + f'; {elapsed:.1f} с, {counts["products"] / max(elapsed, 1e-9):.0f} товаров/с'
+        ))
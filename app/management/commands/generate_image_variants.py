@@ -0,0 +1,37 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from app import images
+from app.models import ProductImage
+
+
+class Command(BaseCommand):
+    help = 'Строит уменьшенные JPEG и WebP копии для уже загруженных фотографий товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Перестроить копии и для уже обработанных фотографий')
+        parser.add_argument('--workers', type=int, default=settings.IMAGE_VARIANT_WORKERS, help='Число потоков')
+
+    def handle(self, *args, **options):
+        queryset = ProductImage.objects.order_by('id')
+        if not options['all']:
+            queryset = queryset.exclude(variants_status=ProductImage.VariantsStatus.READY)
+        image_ids = list(queryset.values_list('id', flat=True))
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(options['workers']) as executor:
+            statuses = list(executor.map(self.generate, image_ids))
+        elapsed = time.monotonic() - started
+
+        failed = statuses.count(ProductImage.VariantsStatus.FAILED)
+        self.stdout.write(f'Обработано фотографий: {len(image_ids)} за {elapsed:.1f} с, с ошибкой: {failed}')
+
+    def generate(self, image_id):
+        try:
+            return images.generate_variants(image_id)
+        finally:
+            close_old_connections()
@@ -0,0 +1,50 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app import bulk
+from app.models import Product, User
+
+
+class Command(BaseCommand):
+    help = 'Загружает товары партнёра из CSV или JSONL пачками через bulk_create (колонка id игнорируется)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл с товарами, - для stdin')
+        parser.add_argument('--format', choices=('csv', 'jsonl'), help='По умолчанию по расширению файла')
+        parser.add_argument('--author', help='Пользователь для строк без колонки author')
+        parser.add_argument('--status', choices=Product.Status.values, default=Product.Status.ON_MODERATE,
+                            help='Статус для строк без колонки status')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Строк в одной транзакции')
+        parser.add_argument('--skip-cards', action='store_true',
+                            help='Не собирать карточки, потом запустить rebuild_product_cards')
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or ('csv' if options['path'].endswith('.csv') else 'jsonl')
+        author = None
+        if options['author']:
+            author = User.objects.filter(username=options['author']).first()
+            if author is None:
+                raise CommandError(f'Пользователь {options["author"]} не найден')
+        importer = bulk.ProductImporter(author, options['status'], build_cards=not options['skip_cards'])
+
+        file = sys.stdin if options['path'] == '-' else open(options['path'], newline='', encoding='utf-8')
+        imported = failed = 0
+        started = time.monotonic()
+        try:
+            for number, chunk in enumerate(bulk.chunked(bulk.read_rows(file, file_format), options['chunk_size'])):
+                count, errors = importer.import_chunk(chunk)
+                imported += count
+                failed += len(errors)
+                for index, error in errors[:10]:
+                    self.stderr.write(f'Строка {number * options["chunk_size"] + index + 1}: {error}')
+        finally:
+            if file is not sys.stdin:
+                file.close()
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено товаров: {imported}, с ошибкой: {failed}, '
+            f'{elapsed:.1f} с, {imported / max(elapsed, 1e-9):.0f} строк/с'
+        ))
@@ -0,0 +1,58 @@
+import asyncio
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app import loadtest
+
+
+def parse_weight(value):
+    name, _, weight = value.partition('=')
+    if name not in loadtest.SCENARIOS or not weight.isdigit():
+        raise ValueError(value)
+    return name, int(weight)
+
+
+class Command(BaseCommand):
+    help = ('Нагружает запущенный сервер смесью сценариев (лента города, поиск, карточка товара, избранное, '
+            'загрузка фото) и выводит пропускную способность, долю ошибок и p50/p95/p99 по маршрутам')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Адрес сервера')
+        parser.add_argument('--concurrency', type=int, default=20, help='Виртуальных пользователей')
+        parser.add_argument('--duration', type=float, default=30, help='Секунд нагрузки')
+        parser.add_argument('--users', type=int, default=10, help='Учётных записей для входа через api/token/')
+        parser.add_argument('--username', default='gen_user{}', help='Шаблон имени, {} — номер с нуля')
+        parser.add_argument('--password', default='benchmark', help='Пароль учётных записей, см. generate_data')
+        parser.add_argument('--weight', action='append', type=parse_weight, default=[],
+                            help=f'Вес сценария, например search=50. Сценарии: {", ".join(loadtest.SCENARIOS)}')
+        parser.add_argument('--think-time', type=float, default=0.0, help='Средняя пауза между запросами, с')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Куда записать отчёт в JSON')
+
+    def handle(self, *args, **options):
+        weights = {**loadtest.DEFAULT_WEIGHTS, **dict(options['weight'])}
+        test = loadtest.LoadTest(
+            options['url'], options['concurrency'], options['duration'], options['users'], options['username'],
+            options['password'], weights, options['think_time'], options['seed'],
+        )
+        self.stdout.write(
+            f'{options["url"]}: {options["concurrency"]} пользователей, {options["duration"]:g} с, '
+            + ', '.join(f'{name}={weight}' for name, weight in test.weights.items())
+        )
+        try:
+            report = asyncio.run(test.run())
+        except (loadtest.LoadTestError, OSError) as error:
+            raise CommandError(error)
+
+        self.stdout.write(f'{"маршрут":<30} {"запросов":>8} {"в секунду":>9} {"ошибок":>7} '
+                          f'{"p50, мс":>8} {"p95, мс":>8} {"p99, мс":>8}')
+        for route, result in [*report['routes'].items(), ('всего', report['total'])]:
+            self.stdout.write(
+                f'{route:<30} {result["requests"]:>8} {result["rps"]:>9.1f} {result["error_rate"]:>7.1%} '
+                f'{result["p50_ms"]:>8.1f} {result["p95_ms"]:>8.1f} {result["p99_ms"]:>8.1f}'
+            )
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+            self.stdout.write(f'Записано в {options["output"]}')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from app import cards
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает денормализованные карточки товаров (ProductCard)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Сколько товаров пересобирать за раз')
+
+    def handle(self, *args, **options):
+        count = cards.rebuild_cards(options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Пересобрано карточек: {count}'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app import search
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовый индекс товаров по текущим данным'
+
+    def handle(self, *args, **options):
+        if not search.uses_fts():
+            raise CommandError('Полнотекстовый индекс поддерживается только для SQLite')
+        count = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Проиндексировано товаров: {count}'))
@@ -0,0 +1,180 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# Метрики запросов: PerformanceMiddleware (app/middleware.py) собирает их на каждый запрос,
+# отдаёт заголовком Server-Timing и копит гистограммы по маршрутам для /metrics.
+# Гистограммы живут в памяти процесса, у каждого воркера gunicorn свои
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 ** 2, 10 * 1024 ** 2)
+
+
+class RequestStats:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view_started = None
+        self.queries = 0
+        self.db_time = 0.0
+        self.spans = {}
+        self.active = set()
+
+
+# contextvar, а не thread-local: asgiref переносит контекст в потоки sync_to_async,
+# поэтому запросы асинхронного ORM тоже попадают в статистику своего запроса
+_current = contextvars.ContextVar('request_stats', default=None)
+
+
+def start_request():
+    stats = RequestStats()
+    return stats, _current.set(stats)
+
+
+def finish_request(token):
+    _current.reset(token)
+
+
+def get_current():
+    return _current.get()
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_time += time.perf_counter() - started
+
+
+def instrument(connection):
+    # Вызывается на каждое новое соединение (сигнал connection_created)
+    if execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(execute_wrapper)
+
+
+@contextmanager
+def span(name):
+    # Вложенные участки с тем же именем не считаются повторно
+    stats = _current.get()
+    if stats is None or name in stats.active:
+        yield
+        return
+    stats.active.add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.active.discard(name)
+        stats.spans[name] = stats.spans.get(name, 0.0) + time.perf_counter() - started
+
+
+def timed(name):
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}' if pairs else ''
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels):
+        self.name, self.documentation, self.labels = name, documentation, labels
+        self.series = {}
+
+    def inc(self, labels, value=1):
+        self.series[labels] = self.series.get(labels, 0) + value
+
+    def render(self):
+        for labels, value in sorted(self.series.items()):
+            yield f'{self.name}{format_labels(self.labels, labels)} {value}'
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels, buckets):
+        self.name, self.documentation, self.labels, self.buckets = name, documentation, labels, buckets
+        # метки -> [счётчики по корзинам с последней +Inf, сумма, количество]
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        for labels, (counts, total, count) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                yield f'{self.name}_bucket{format_labels(self.labels, labels, [("le", bound)])} {cumulative}'
+            yield f'{self.name}_sum{format_labels(self.labels, labels)} {total}'
+            yield f'{self.name}_count{format_labels(self.labels, labels)} {count}'
+
+
+ROUTE_LABELS = ('route', 'method')
+REQUESTS = Counter('http_requests_total', 'Запросы по маршруту, методу и статусу', ROUTE_LABELS + ('status',))
+DURATION = Histogram('http_request_duration_seconds', 'Полное время запроса', ROUTE_LABELS, DURATION_BUCKETS)
+VIEW = Histogram('http_request_view_seconds', 'Время представления с отрисовкой ответа', ROUTE_LABELS,
+                 DURATION_BUCKETS)
+DB = Histogram('http_request_db_seconds', 'Время SQL-запросов', ROUTE_LABELS, DURATION_BUCKETS)
+QUERIES = Histogram('http_request_db_queries', 'Число SQL-запросов', ROUTE_LABELS, QUERY_BUCKETS)
+SERIALIZE = Histogram('http_request_serialize_seconds', 'Время сериализации ответа', ROUTE_LABELS, DURATION_BUCKETS)
+SIZE = Histogram('http_response_size_bytes', 'Размер тела ответа', ROUTE_LABELS, SIZE_BUCKETS)
+METRICS = (REQUESTS, DURATION, VIEW, DB, QUERIES, SERIALIZE, SIZE)
+_lock = threading.Lock()
+
+
+def observe(route, method, status, stats, total, view, size):
+    labels = (route, method)
+    with _lock:
+        REQUESTS.inc(labels + (str(status),))
+        DURATION.observe(labels, total)
+        VIEW.observe(labels, view)
+        DB.observe(labels, stats.db_time)
+        QUERIES.observe(labels, stats.queries)
+        SERIALIZE.observe(labels, stats.spans.get('serialize', 0.0))
+        if size is not None:
+            SIZE.observe(labels, size)
+
+
+def render():
+    # Текстовый формат Prometheus 0.0.4
+    lines = []
+    with _lock:
+        for metric in METRICS:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    with _lock:
+        for metric in METRICS:
+            metric.series.clear()
@@ -0,0 +1,71 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import metrics
+
+
+class PerformanceMiddleware:
+    # Замеры запроса: число и время SQL, сериализация, представление, размер ответа.
+    # Отдаёт их заголовком Server-Timing и добавляет в гистограммы /metrics.
+    # Работает и под WSGI, и под ASGI без переключения между потоками; ставится первым в MIDDLEWARE
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+            # Django берёт process_view у экземпляра: в async-режиме нужна корутина
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not settings.PERFORMANCE_METRICS:
+            return self.get_response(request)
+        stats, token = metrics.start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.finish_request(token)
+        return self.finish(request, response, stats)
+
+    async def __acall__(self, request):
+        if not settings.PERFORMANCE_METRICS:
+            return await self.get_response(request)
+        stats, token = metrics.start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.finish_request(token)
+        return self.finish(request, response, stats)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        stats = metrics.get_current()
+        if stats is not None:
+            stats.view_started = time.perf_counter()
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        PerformanceMiddleware.process_view(self, request, view_func, view_args, view_kwargs)
+
+    def finish(self, request, response, stats):
+        finished = time.perf_counter()
+        total = finished - stats.started
+        view = finished - stats.view_started if stats.view_started is not None else 0.0
+        serialize = stats.spans.get('serialize', 0.0)
+        size = None if response.streaming else len(response.content)
+
+        match = request.resolver_match
+        route = match.route if match is not None else 'unmatched'
+        metrics.observe(route, request.method, response.status_code, stats, total, view, size)
+
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries"',
+            f'serialize;dur={serialize * 1000:.1f}',
+            f'view;dur={view * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ])
+        return response
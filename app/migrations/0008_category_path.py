@@ -0,0 +1,34 @@
+from django.db import migrations, models
+
+
+def fill_category_path(apps, schema_editor):
+    Category = apps.get_model('app', 'Category')
+    categories = list(Category.objects.only('id', 'parent_id'))
+    children = {}
+    for category in categories:
+        children.setdefault(category.parent_id, []).append(category)
+
+    # Обходим дерево от корней: путь ребёнка = путь родителя + его id
+    queue = [(category, '/') for category in children.get(None, [])]
+    while queue:
+        category, prefix = queue.pop()
+        category.path = f'{prefix}{category.id}/'
+        queue += [(child, category.path) for child in children.get(category.id, [])]
+
+    Category.objects.bulk_update(categories, ['path'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_merge_20230422_2242'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(fill_category_path, migrations.RunPython.noop),
+    ]
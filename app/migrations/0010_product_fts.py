@@ -0,0 +1,95 @@
+from django.db import migrations
+
+# Полнотекстовый индекс товаров (SQLite FTS5). rowid строки индекса равен id товара,
+# синхронизация с app_product и app_productfeature выполняется триггерами.
+# 'ё' приводится к 'е' при записи, так как unicode61 их не отождествляет.
+FORWARD_SQL = [
+    """
+    CREATE VIRTUAL TABLE app_product_fts USING fts5(
+        name, description, features, tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER app_product_fts_insert AFTER INSERT ON app_product BEGIN
+        INSERT INTO app_product_fts (rowid, name, description, features)
+        VALUES (new.id, replace(replace(new.name, 'ё', 'е'), 'Ё', 'Е'),
+                replace(replace(new.description, 'ё', 'е'), 'Ё', 'Е'), NULL);
+    END
+    """,
+    """
+    CREATE TRIGGER app_product_fts_update AFTER UPDATE OF name, description ON app_product
+    WHEN old.name IS NOT new.name OR old.description IS NOT new.description BEGIN
+        UPDATE app_product_fts
+        SET name = replace(replace(new.name, 'ё', 'е'), 'Ё', 'Е'),
+            description = replace(replace(new.description, 'ё', 'е'), 'Ё', 'Е')
+        WHERE rowid = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER app_product_fts_delete AFTER DELETE ON app_product BEGIN
+        DELETE FROM app_product_fts WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER app_productfeature_fts_insert AFTER INSERT ON app_productfeature BEGIN
+        UPDATE app_product_fts
+        SET features = (SELECT replace(replace(group_concat(value, ' '), 'ё', 'е'), 'Ё', 'Е')
+                        FROM app_productfeature WHERE product_id = new.product_id)
+        WHERE rowid = new.product_id;
+    END
+    """,
+    """
+    CREATE TRIGGER app_productfeature_fts_update AFTER UPDATE OF value, product_id ON app_productfeature BEGIN
+        UPDATE app_product_fts
+        SET features = (SELECT replace(replace(group_concat(value, ' '), 'ё', 'е'), 'Ё', 'Е')
+                        FROM app_productfeature WHERE product_id = app_product_fts.rowid)
+        WHERE rowid IN (old.product_id, new.product_id);
+    END
+    """,
+    """
+    CREATE TRIGGER app_productfeature_fts_delete AFTER DELETE ON app_productfeature BEGIN
+        UPDATE app_product_fts
+        SET features = (SELECT replace(replace(group_concat(value, ' '), 'ё', 'е'), 'Ё', 'Е')
+                        FROM app_productfeature WHERE product_id = old.product_id)
+        WHERE rowid = old.product_id;
+    END
+    """,
+    """
+    INSERT INTO app_product_fts (rowid, name, description, features)
+    SELECT p.id, replace(replace(p.name, 'ё', 'е'), 'Ё', 'Е'), replace(replace(p.description, 'ё', 'е'), 'Ё', 'Е'),
+           (SELECT replace(replace(group_concat(f.value, ' '), 'ё', 'е'), 'Ё', 'Е')
+            FROM app_productfeature f WHERE f.product_id = p.id)
+    FROM app_product p
+    """,
+]
+
+BACKWARD_SQL = [
+    'DROP TRIGGER IF EXISTS app_productfeature_fts_delete',
+    'DROP TRIGGER IF EXISTS app_productfeature_fts_update',
+    'DROP TRIGGER IF EXISTS app_productfeature_fts_insert',
+    'DROP TRIGGER IF EXISTS app_product_fts_delete',
+    'DROP TRIGGER IF EXISTS app_product_fts_update',
+    'DROP TRIGGER IF EXISTS app_product_fts_insert',
+    'DROP TABLE IF EXISTS app_product_fts',
+]
+
+
+def run_sql(statements):
+    def run(apps, schema_editor):
+        # FTS5 есть только в SQLite, на других БД поиск работает через icontains
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_productfavorite'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_sql(FORWARD_SQL), run_sql(BACKWARD_SQL)),
+    ]
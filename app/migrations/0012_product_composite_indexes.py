@@ -0,0 +1,42 @@
+# Generated by Django 4.2 on 2026-10-18 12:17
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def remove_duplicate_favorites(apps, schema_editor):
+    # Без ограничения уникальности могли накопиться повторные строки, оставляем первую
+    ProductFavorite = apps.get_model('app', 'ProductFavorite')
+    keep = ProductFavorite.objects.values('user_id', 'product_id').annotate(first_id=Min('id')).values('first_id')
+    ProductFavorite.objects.exclude(id__in=keep).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_product_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['status', 'city', 'created_at', 'id'], name='product_city_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['status', 'city', 'price', 'id'], name='product_city_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['status', 'category', 'created_at', 'id'], name='product_category_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['author', 'status', 'created_at', 'id'], name='product_author_created_idx'),
+        ),
+        migrations.RunPython(remove_duplicate_favorites, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='productfavorite',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='product_favorite_unique'),
+        ),
+    ]
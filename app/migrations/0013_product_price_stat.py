@@ -0,0 +1,87 @@
+# Generated by Django 4.2 on 2026-10-18 12:20
+
+from django.db import migrations, models
+
+# Счётчики цен активных товаров по (город, категория) обновляются триггерами,
+# поэтому их не обходят ни bulk-операции, ни каскадные удаления
+FORWARD_SQL = [
+    """
+    CREATE TRIGGER app_product_price_stat_insert AFTER INSERT ON app_product WHEN new.status = 'AC' BEGIN
+        INSERT INTO app_productpricestat (city_id, category_id, price, product_count)
+        VALUES (IFNULL(new.city_id, 0), new.category_id, new.price, 1)
+        ON CONFLICT (city_id, category_id, price) DO UPDATE SET product_count = product_count + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER app_product_price_stat_delete AFTER DELETE ON app_product WHEN old.status = 'AC' BEGIN
+        UPDATE app_productpricestat SET product_count = product_count - 1
+        WHERE city_id = IFNULL(old.city_id, 0) AND category_id = old.category_id AND price = old.price;
+        DELETE FROM app_productpricestat
+        WHERE city_id = IFNULL(old.city_id, 0) AND category_id = old.category_id AND price = old.price
+          AND product_count <= 0;
+    END
+    """,
+    """
+    CREATE TRIGGER app_product_price_stat_update AFTER UPDATE OF status, price, city_id, category_id ON app_product
+    WHEN (old.status = 'AC' OR new.status = 'AC')
+     AND (old.status IS NOT new.status OR old.price IS NOT new.price
+          OR old.city_id IS NOT new.city_id OR old.category_id IS NOT new.category_id) BEGIN
+        UPDATE app_productpricestat SET product_count = product_count - 1
+        WHERE old.status = 'AC'
+          AND city_id = IFNULL(old.city_id, 0) AND category_id = old.category_id AND price = old.price;
+        DELETE FROM app_productpricestat
+        WHERE old.status = 'AC'
+          AND city_id = IFNULL(old.city_id, 0) AND category_id = old.category_id AND price = old.price
+          AND product_count <= 0;
+        INSERT INTO app_productpricestat (city_id, category_id, price, product_count)
+        SELECT IFNULL(new.city_id, 0), new.category_id, new.price, 1 WHERE new.status = 'AC'
+        ON CONFLICT (city_id, category_id, price) DO UPDATE SET product_count = product_count + 1;
+    END
+    """,
+    """
+    INSERT INTO app_productpricestat (city_id, category_id, price, product_count)
+    SELECT IFNULL(city_id, 0), category_id, price, count(*) FROM app_product WHERE status = 'AC'
+    GROUP BY IFNULL(city_id, 0), category_id, price
+    """,
+]
+
+BACKWARD_SQL = [
+    'DROP TRIGGER IF EXISTS app_product_price_stat_update',
+    'DROP TRIGGER IF EXISTS app_product_price_stat_delete',
+    'DROP TRIGGER IF EXISTS app_product_price_stat_insert',
+]
+
+
+def run_sql(statements):
+    def run(apps, schema_editor):
+        # На других БД фасеты считаются прямо по товарам, см. app/facets.py
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_product_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductPriceStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('city_id', models.IntegerField()),
+                ('category_id', models.IntegerField()),
+                ('price', models.IntegerField()),
+                ('product_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='productpricestat',
+            constraint=models.UniqueConstraint(fields=('city_id', 'category_id', 'price'), name='product_price_stat_unique'),
+        ),
+        migrations.RunPython(run_sql(FORWARD_SQL), run_sql(BACKWARD_SQL)),
+    ]
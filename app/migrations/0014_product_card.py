@@ -0,0 +1,61 @@
+# Generated by Django 4.2 on 2026-10-18 12:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_product_price_stat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductCard',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='card', serialize=False, to='app.product')),
+                ('status', models.CharField(choices=[('AC', 'Активен'), ('AR', 'В архиве'), ('MD', 'На модерации'), ('CN', 'Отклонен')], max_length=2)),
+                ('author_id', models.IntegerField()),
+                ('city_id', models.IntegerField(null=True)),
+                ('category_id', models.IntegerField()),
+                ('price', models.IntegerField()),
+                ('created_at', models.DateTimeField()),
+                ('name', models.CharField(max_length=255)),
+                ('description', models.TextField()),
+                ('price_suffix', models.CharField(choices=[('N', 'руб'), ('S', 'за услугу'), ('H', 'за час'), ('U', 'за единицу'), ('D', 'за день'), ('MT', 'за месяц'), ('M2', 'за м2'), ('M', 'за м')], max_length=3)),
+                ('is_lower_bound', models.BooleanField(default=False)),
+                ('city_name', models.CharField(max_length=255, null=True)),
+                ('category_path', models.JSONField(default=list)),
+                ('image', models.CharField(blank=True, default='', max_length=255)),
+                ('images', models.JSONField(default=list)),
+                ('author', models.JSONField(default=dict)),
+                ('features', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='productcard',
+            index=models.Index(fields=['status', 'created_at', 'product'], name='card_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productcard',
+            index=models.Index(fields=['status', 'price', 'product'], name='card_status_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productcard',
+            index=models.Index(fields=['status', 'city_id', 'created_at', 'product'], name='card_city_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productcard',
+            index=models.Index(fields=['status', 'city_id', 'price', 'product'], name='card_city_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productcard',
+            index=models.Index(fields=['status', 'category_id', 'created_at', 'product'], name='card_category_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productcard',
+            index=models.Index(fields=['author_id', 'status', 'created_at', 'product'], name='card_author_created_idx'),
+        ),
+    ]
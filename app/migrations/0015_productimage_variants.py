@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-18 12:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0014_product_card'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimage',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='variants_status',
+            field=models.CharField(choices=[('P', 'Ожидает обработки'), ('R', 'Готово'), ('F', 'Ошибка')], default='P', max_length=1),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2 on 2026-10-18 12:31
+
+import app.storage
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_media_blobs(apps, schema_editor):
+    ProductImage = apps.get_model('app', 'ProductImage')
+    MediaBlob = apps.get_model('app', 'MediaBlob')
+    default = ProductImage._meta.get_field('image').default
+    blobs = []
+    for row in ProductImage.objects.exclude(image=default).values('image').annotate(ref_count=Count('id')):
+        try:
+            size = default_storage.size(row['image'])
+        except OSError:
+            size = 0
+        blobs.append(MediaBlob(name=row['image'], size=size, ref_count=row['ref_count']))
+    MediaBlob.objects.bulk_create(blobs, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0015_productimage_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('size', models.BigIntegerField(default=0)),
+                ('ref_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='image',
+            field=models.ImageField(default='default_image.png', storage=app.storage.ContentAddressedStorage(), upload_to='images'),
+        ),
+        migrations.RunPython(fill_media_blobs, migrations.RunPython.noop),
+    ]
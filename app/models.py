@@ -1,6 +1,10 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Value
+from django.db.models.functions import Concat, Substr
 from django.contrib.auth.models import AbstractUser
 
+from .storage import ContentAddressedStorage
+
 
 class City(models.Model):
     name = models.CharField(max_length=255, unique=True)
@@ -10,7 +14,16 @@ class User(AbstractUser):
     phone = models.CharField(max_length=30, unique=True)
 
 
+class CategoryQuerySet(models.QuerySet):
+
+    def subtree(self, path):
+        # Все узлы, путь которых начинается с path. Вместо LIKE используем диапазон,
+        # чтобы запрос шёл по индексу на любой БД: '/1/' <= path < '/10'
+        return self.filter(path__gte=path, path__lt=path[:-1] + chr(ord(Category.PATH_SEPARATOR) + 1))
+
+
 class Category(models.Model):
+    PATH_SEPARATOR = '/'
 
     class Meta:
         verbose_name = 'Категория'
@@ -18,17 +31,61 @@ class Category(models.Model):
 
     name = models.CharField(max_length=255, unique=True)
     parent = models.ForeignKey('self', related_name='children', on_delete=models.CASCADE, blank=True, null=True)
+    # Материализованный путь из id предков, например '/3/9/'
+    path = models.CharField(max_length=255, db_index=True, editable=False, default='')
+
+    objects = CategoryQuerySet.as_manager()
 
     def __str__(self):
         return f'{self.name}'
 
-    def get_descendants(self):
-        descendants = []
-        children = self.children.all()
-        for child in children:
-            descendants.append(child)
-            descendants += child.get_descendants()
-        return descendants
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            if self.pk is None:
+                super().save(*args, **kwargs)
+                self.path = self.build_path()
+                Category.objects.filter(pk=self.pk).update(path=self.path)
+                return
+
+            old_path = Category.objects.filter(pk=self.pk).values_list('path', flat=True).first()
+            self.path = self.build_path()
+            if old_path and self.path.startswith(old_path) and self.path != old_path:
+                raise ValueError('Категорию нельзя перенести в её же потомка')
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'path'}
+            super().save(*args, **kwargs)
+
+            if old_path and old_path != self.path:
+                # Переносим всё поддерево одним UPDATE
+                Category.objects.subtree(old_path).exclude(pk=self.pk).update(
+                    path=Concat(Value(self.path), Substr('path', len(old_path) + 1))
+                )
+
+    def build_path(self):
+        if self.parent_id is None:
+            return f'{self.PATH_SEPARATOR}{self.pk}{self.PATH_SEPARATOR}'
+        # Путь родителя берём из БД: закэшированный self.parent мог устареть после переноса
+        prefix = Category.objects.filter(pk=self.parent_id).values_list('path', flat=True).get()
+        return f'{prefix}{self.pk}{self.PATH_SEPARATOR}'
+
+    def get_ancestor_ids(self):
+        return [int(pk) for pk in self.path.strip(self.PATH_SEPARATOR).split(self.PATH_SEPARATOR)[:-1]]
+
+    def get_ancestors(self):
+        return Category.objects.filter(id__in=self.get_ancestor_ids()).order_by('path')
+
+    def get_descendants(self, include_self=False):
+        queryset = Category.objects.subtree(self.path)
+        if not include_self:
+            queryset = queryset.exclude(pk=self.pk)
+        return queryset
+
+
+class ProductQuerySet(models.QuerySet):
+
+    def with_related(self):
+        # Всё, что читает ProductSerializer, фиксированным числом запросов
+        return self.select_related('city', 'author').prefetch_related('features', 'images')
 
 
 class Product(models.Model):
@@ -36,6 +93,17 @@ class Product(models.Model):
     class Meta:
         verbose_name = 'Товар'
         verbose_name_plural = 'Товары'
+        indexes = [
+            # Курсорная пагинация: поиск позиции и сортировка по индексу
+            models.Index(fields=['status', 'created_at', 'id'], name='product_status_created_idx'),
+            models.Index(fields=['status', 'price', 'id'], name='product_status_price_idx'),
+            # Лента города и поиск с фильтром по городу или категории
+            models.Index(fields=['status', 'city', 'created_at', 'id'], name='product_city_created_idx'),
+            models.Index(fields=['status', 'city', 'price', 'id'], name='product_city_price_idx'),
+            models.Index(fields=['status', 'category', 'created_at', 'id'], name='product_category_created_idx'),
+            # Собственные объявления автора
+            models.Index(fields=['author', 'status', 'created_at', 'id'], name='product_author_created_idx'),
+        ]
 
     class Status(models.TextChoices):
         ACTIVE = 'AC', 'Активен'
@@ -65,6 +133,44 @@ class Product(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     city = models.ForeignKey(City, related_name='products', on_delete=models.CASCADE, null=True)
 
+    objects = ProductQuerySet.as_manager()
+
+    def set_features(self, features):
+        # Приводит характеристики к списку features, меняя только отличающиеся строки:
+        # правка одной характеристики из сорока — один UPDATE, а не сорок DELETE и сорок INSERT.
+        # Порядок характеристик — порядок id, поэтому строки сопоставляются по позиции:
+        # совпавшие начало и конец не трогаем, середину переписываем на месте
+        rows = list(ProductFeature.objects.filter(product=self).order_by('id'))
+        target = [(feature['name'], feature['value']) for feature in features]
+        current = [(row.name, row.value) for row in rows]
+
+        prefix = 0
+        while prefix < min(len(rows), len(target)) and current[prefix] == target[prefix]:
+            prefix += 1
+        suffix = 0
+        while suffix < min(len(rows), len(target)) - prefix and current[-suffix - 1] == target[-suffix - 1]:
+            suffix += 1
+        if suffix and len(target) > len(rows):
+            # Новые строки получат id больше всех существующих, встать перед концом списка они не могут
+            suffix = 0
+        old, new = rows[prefix:len(rows) - suffix], target[prefix:len(target) - suffix]
+
+        changed = []
+        for row, (name, value) in zip(old, new):
+            if (row.name, row.value) != (name, value):
+                row.name, row.value = name, value
+                changed.append(row)
+
+        with transaction.atomic():
+            if changed:
+                ProductFeature.objects.bulk_update(changed, ['name', 'value'])
+            if old[len(new):]:
+                ProductFeature.objects.filter(id__in=[row.id for row in old[len(new):]]).delete()
+            if new[len(old):]:
+                ProductFeature.objects.bulk_create(
+                    [ProductFeature(product=self, name=name, value=value) for name, value in new[len(old):]]
+                )
+
 
 class ProductFeature(models.Model):
     name = models.CharField(max_length=255)
@@ -73,11 +179,84 @@ class ProductFeature(models.Model):
 
 
 class ProductImage(models.Model):
-    image = models.ImageField(upload_to='images/%Y/%m/%d', default='default_image.png')
+
+    class VariantsStatus(models.TextChoices):
+        PENDING = 'P', 'Ожидает обработки'
+        READY = 'R', 'Готово'
+        FAILED = 'F', 'Ошибка'
+
+    # Имя файла задаёт хранилище по хэшу содержимого, upload_to не используется
+    image = models.ImageField(upload_to='images', storage=ContentAddressedStorage(), default='default_image.png')
     product = models.ForeignKey(Product, related_name='images', on_delete=models.CASCADE)
     description = models.TextField(blank=True, default='')
+    # Уменьшенные копии: {'jpeg': {'200': 'variants/...'}, 'webp': {...}}, см. app/images.py
+    variants = models.JSONField(default=dict, blank=True)
+    variants_status = models.CharField(max_length=1, choices=VariantsStatus.choices, default=VariantsStatus.PENDING)
+
+
+class MediaBlob(models.Model):
+    # Один файл в хранилище и число строк ProductImage, которые на него ссылаются
+    name = models.CharField(max_length=100, unique=True)
+    size = models.BigIntegerField(default=0)
+    ref_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
 
 
 class ProductFavorite(models.Model):
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='product_favorite_unique'),
+        ]
+
     user = models.ForeignKey(User, related_name='favorites', on_delete=models.CASCADE)
     product = models.ForeignKey(Product, related_name='subscribers', on_delete=models.CASCADE)
+
+
+class ProductPriceStat(models.Model):
+    # Сколько активных товаров с такой ценой в паре (город, категория).
+    # Поддерживается триггерами на app_product, из неё строятся фасеты цены
+    city_id = models.IntegerField()  # 0 — товары без города
+    category_id = models.IntegerField()
+    price = models.IntegerField()
+    product_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['city_id', 'category_id', 'price'], name='product_price_stat_unique'),
+        ]
+
+
+class ProductCard(models.Model):
+    # Денормализованная карточка товара для ленты и поиска: всё, что нужно для отрисовки,
+    # в одной строке без join. Обновляется сигналами, см. app/cards.py
+    product = models.OneToOneField(Product, primary_key=True, related_name='card', on_delete=models.CASCADE)
+
+    status = models.CharField(max_length=2, choices=Product.Status.choices)
+    author_id = models.IntegerField()
+    city_id = models.IntegerField(null=True)
+    category_id = models.IntegerField()
+    price = models.IntegerField()
+    created_at = models.DateTimeField()
+
+    name = models.CharField(max_length=255)
+    description = models.TextField()
+    price_suffix = models.CharField(max_length=3, choices=Product.PriceSuffix.choices)
+    is_lower_bound = models.BooleanField(default=False)
+    city_name = models.CharField(max_length=255, null=True)
+    category_path = models.JSONField(default=list)
+    image = models.CharField(max_length=255, blank=True, default='')
+    images = models.JSONField(default=list)
+    author = models.JSONField(default=dict)
+    features = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at', 'product'], name='card_status_created_idx'),
+            models.Index(fields=['status', 'price', 'product'], name='card_status_price_idx'),
+            models.Index(fields=['status', 'city_id', 'created_at', 'product'], name='card_city_created_idx'),
+            models.Index(fields=['status', 'city_id', 'price', 'product'], name='card_city_price_idx'),
+            models.Index(fields=['status', 'category_id', 'created_at', 'product'], name='card_category_created_idx'),
+            models.Index(fields=['author_id', 'status', 'created_at', 'product'], name='card_author_created_idx'),
+        ]
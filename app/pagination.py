@@ -0,0 +1,141 @@
+import base64
+import json
+from datetime import datetime
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    # Постраничный вывод по ключу: курсор хранит значения сортировки последней строки,
+    # и следующая страница ищется по индексу, без OFFSET. Глубокие страницы стоят как первая
+    page_size = 20
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    ordering_query_param = 'ordering'
+    invalid_cursor_message = 'Invalid cursor'
+
+    # Последнее поле каждой сортировки уникально, поэтому позиция однозначна
+    orderings = {
+        '-created_at': ('-created_at', '-pk'),
+        'price': ('price', 'pk'),
+        '-price': ('-price', '-pk'),
+        'relevance': ('search_rank', 'pk'),
+    }
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.get_page(list(self.get_page_queryset(queryset, request, view)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        # Для async-представлений: та же страница, но строки читаются асинхронным ORM
+        return self.get_page([row async for row in self.get_page_queryset(queryset, request, view)])
+
+    def get_page_queryset(self, queryset, request, view=None):
+        # Запрос страницы с одной лишней строкой: по ней видно, есть ли следующая
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering, position = self.decode_cursor(request, queryset)
+        if self.ordering is None:
+            self.ordering = self.get_ordering(request, queryset, view)
+
+        fields = self.orderings[self.ordering]
+        queryset = queryset.order_by(*fields)
+        if position is not None:
+            queryset = queryset.filter(self.seek(fields, position))
+        return queryset[:self.page_size + 1]
+
+    def get_page(self, rows):
+        fields = self.orderings[self.ordering]
+        self.has_next = len(rows) > self.page_size
+        page = rows[:self.page_size]
+        self.next_position = None
+        if self.has_next:
+            # Строки — экземпляры моделей или словари values()
+            last = page[-1]
+            get = last.get if isinstance(last, dict) else lambda name: getattr(last, name)
+            self.next_position = [get(field.lstrip('-')) for field in fields]
+        return page
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_data(self, data):
+        return {
+            'next': self.get_next_link(),
+            'results': data,
+        }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_ordering(self, request, queryset, view):
+        ordering = request.query_params.get(self.ordering_query_param)
+        if ordering not in self.get_orderings(queryset):
+            ordering = getattr(view, 'default_ordering', '-created_at')
+        return ordering
+
+    def get_orderings(self, queryset):
+        # Сортировка по релевантности доступна только для полнотекстового поиска
+        if 'search_rank' in queryset.query.annotations:
+            return self.orderings
+        return [ordering for ordering in self.orderings if ordering != 'relevance']
+
+    def seek(self, fields, position):
+        # (a, id) после (v, i): a <= v AND (a < v OR id < i) для убывания.
+        # Первое условие задаёт границу диапазона по индексу
+        (field, value), (key, key_value) = zip((name.lstrip('-') for name in fields), position)
+        if fields[0].startswith('-'):
+            return Q(**{f'{field}__lte': value}) & (Q(**{f'{field}__lt': value}) | Q(**{f'{key}__lt': key_value}))
+        return Q(**{f'{field}__gte': value}) & (Q(**{f'{field}__gt': value}) | Q(**{f'{key}__gt': key_value}))
+
+    def parse_position(self, field, value):
+        if field == 'created_at':
+            value = parse_datetime(value)
+            if value is None:
+                raise ValueError
+            return value
+        if isinstance(value, bool):
+            raise ValueError
+        if field == 'search_rank':
+            if not isinstance(value, (int, float)):
+                raise ValueError
+            return float(value)
+        # price и pk
+        if not isinstance(value, int):
+            raise ValueError
+        return value
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        position = [value.isoformat() if isinstance(value, datetime) else value for value in self.next_position]
+        cursor = json.dumps({'o': self.ordering, 'p': position}, separators=(',', ':'))
+        encoded = base64.urlsafe_b64encode(cursor.encode()).decode()
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request, queryset):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            ordering, position = cursor['o'], cursor['p']
+            if ordering not in self.get_orderings(queryset) or not isinstance(position, list) or len(position) != 2:
+                raise ValueError
+            # Курсор приходит от клиента: значения приводятся к типу поля, иначе до фильтра дошёл бы мусор
+            position = [
+                self.parse_position(field.lstrip('-'), value)
+                for field, value in zip(self.orderings[ordering], position)
+            ]
+        except (TypeError, ValueError, KeyError, AttributeError):
+            raise NotFound(self.invalid_cursor_message)
+        return ordering, position
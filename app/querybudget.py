@@ -0,0 +1,144 @@
+import contextvars
+import logging
+import re
+import traceback
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+# Проверка SQL на запрос: одинаковые по форме запросы подряд (N+1) и бюджет запросов представления.
+# Включается QUERY_BUDGET_MODE: 'raise' — исключение (в тестах), 'log' — предупреждение (staging)
+
+logger = logging.getLogger(__name__)
+
+WHITESPACE_RE = re.compile(r'\s+')
+# IN (%s, %s, ...) с любым числом параметров — одна форма
+IN_LIST_RE = re.compile(r'\bIN \((?:%s, )*%s\)', re.IGNORECASE)
+NUMBER_RE = re.compile(r'\b\d+\b')
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+# Управление транзакцией повторяется законно
+TRANSACTION_RE = re.compile(r'^(SAVEPOINT|RELEASE|ROLLBACK|BEGIN|COMMIT)\b', re.IGNORECASE)
+STACK_DEPTH = 8
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def fingerprint(sql):
+    sql = WHITESPACE_RE.sub(' ', sql).strip()
+    sql = IN_LIST_RE.sub('IN (...)', sql)
+    return NUMBER_RE.sub('?', STRING_RE.sub('?', sql))
+
+
+def query_budget(budget):
+    # Бюджет SQL-запросов функции-представления: число или {'GET': число, ...}.
+    # У классов-представлений тот же атрибут query_budget задаётся в классе
+    def decorator(view):
+        view.query_budget = budget
+        return view
+    return decorator
+
+
+def get_budget(request):
+    match = request.resolver_match
+    if match is None:
+        return None
+    budget = getattr(match.func, 'query_budget', None)
+    if budget is None:
+        budget = getattr(getattr(match.func, 'cls', None), 'query_budget', None)
+    if isinstance(budget, dict):
+        budget = budget.get(request.method)
+    return budget
+
+
+_log = contextvars.ContextVar('query_log', default=None)
+
+
+def get_stack():
+    # Только кадры проекта, без Django, DRF и этого модуля
+    base_dir = str(settings.BASE_DIR)
+    frames = [
+        frame for frame in traceback.extract_stack()[:-2]
+        if frame.filename.startswith(base_dir) and 'site-packages' not in frame.filename
+        and not frame.filename.endswith(('querybudget.py', 'metrics.py'))
+    ]
+    return traceback.format_list(frames[-STACK_DEPTH:])
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    log = _log.get()
+    if log is not None and not TRANSACTION_RE.match(sql.lstrip()):
+        log.append((fingerprint(sql), get_stack()))
+    return execute(sql, params, many, context)
+
+
+def instrument(connection):
+    if execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(execute_wrapper)
+
+
+def find_problems(request, log):
+    problems = []
+    counts = Counter(shape for shape, _ in log)
+    for shape, count in counts.items():
+        if count > settings.QUERY_REPEAT_LIMIT:
+            stack = next(stack for logged_shape, stack in log if logged_shape == shape)
+            problems.append(f'{count} запросов одной формы, похоже на N+1:\n  {shape}\n' + ''.join(stack))
+    budget = get_budget(request)
+    if budget is not None and len(log) > budget:
+        # Каждая форма с ближайшим к запросу кадром проекта
+        places = {}
+        for shape, stack in log:
+            places.setdefault(shape, stack[-1] if stack else '')
+        problems.append(f'{len(log)} SQL-запросов при бюджете {budget}:\n' + ''.join(
+            f'  {count} x {shape}\n{places[shape]}' for shape, count in counts.most_common()
+        ))
+    return problems
+
+
+class QueryBudgetMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not settings.QUERY_BUDGET_MODE:
+            return self.get_response(request)
+        log = []
+        token = _log.set(log)
+        try:
+            response = self.get_response(request)
+        finally:
+            _log.reset(token)
+        self.check(request, log)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.QUERY_BUDGET_MODE:
+            return await self.get_response(request)
+        log = []
+        token = _log.set(log)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _log.reset(token)
+        self.check(request, log)
+        return response
+
+    def check(self, request, log):
+        problems = find_problems(request, log)
+        if not problems:
+            return
+        message = f'{request.method} {request.path}: ' + '\n'.join(problems)
+        if settings.QUERY_BUDGET_MODE == 'raise':
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
@@ -0,0 +1,83 @@
+import re
+
+from django.db import connection
+from django.db.models import Q, Value
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'app_product_fts'
+
+# Частые окончания русских слов. Отрезаем их у слов запроса и ищем по префиксу,
+# чтобы 'телефоны' находил 'телефон', а 'красная' — 'красный'
+RUSSIAN_ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ией', 'ий', 'ый', 'ой', 'ая', 'яя', 'ое',
+    'ее', 'ые', 'ие', 'ов', 'ев', 'ей', 'ам', 'ям', 'ах', 'ях', 'ом', 'ем', 'ую', 'юю', 'ию', 'ия', 'ье', 'ья',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+), key=len, reverse=True)
+CYRILLIC = re.compile('[а-я]')
+
+
+def normalize(text):
+    return text.lower().replace('ё', 'е')
+
+
+def fold(expression):
+    # unicode61 не считает 'ё' вариантом 'е', поэтому приводим её сами
+    return f"replace(replace({expression}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def stem(word):
+    if CYRILLIC.match(word):
+        for ending in RUSSIAN_ENDINGS:
+            if word.endswith(ending) and len(word) - len(ending) >= 3:
+                return word[:-len(ending)]
+    return word
+
+
+def build_match_query(text):
+    # Каждое слово — префиксный терм в кавычках, термы объединяются через AND
+    return ' '.join(f'"{stem(word)}"*' for word in re.findall(r'\w+', normalize(text)))
+
+
+def uses_fts():
+    return connection.vendor == 'sqlite'
+
+
+def filter_products(queryset, text):
+    if not uses_fts():
+        return queryset.filter(
+            Q(name__icontains=text) | Q(description__icontains=text) | Q(features__value__icontains=text)
+        ).distinct()
+    match = build_match_query(text)
+    if not match:
+        return queryset
+    # rowid индекса совпадает с id товара, поэтому фильтр подходит и для ProductCard
+    return queryset.filter(pk__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', (match,)))
+
+
+def annotate_rank(queryset, text):
+    # search_rank — значение bm25, чем меньше, тем релевантнее.
+    # MATERIALIZED: ранги считаются одним проходом по индексу на весь запрос. Без него
+    # коррелированный подзапрос заново читал весь список совпадений для каждой строки
+    match = build_match_query(text)
+    if not uses_fts() or not match:
+        return queryset.annotate(search_rank=Value(0.0))
+    opts = queryset.model._meta
+    return queryset.annotate(search_rank=RawSQL(
+        f'WITH ranks AS MATERIALIZED (SELECT rowid AS id, rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s) '
+        f'SELECT rank FROM ranks WHERE id = {opts.db_table}.{opts.pk.column}',
+        (match,),
+    ))
+
+
+def rebuild_index():
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(f'''
+            INSERT INTO {FTS_TABLE} (rowid, name, description, features)
+            SELECT p.id, {fold('p.name')}, {fold('p.description')},
+                   (SELECT {fold("group_concat(f.value, ' ')")} FROM app_productfeature f WHERE f.product_id = p.id)
+            FROM app_product p
+        ''')
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+        cursor.execute(f'SELECT count(*) FROM {FTS_TABLE}')
+        return cursor.fetchone()[0]
@@ -1,6 +1,19 @@
+from django.db import models, transaction
 from rest_framework import serializers
 
-from .models import Category, Product, User, City, ProductFeature, ProductImage
+from .images import get_srcset
+from .metrics import span
+from .uploads import verify_images
+from .models import Category, Product, User, City, ProductFeature, ProductImage, ProductFavorite, ProductCard
+
+
+class TimedDataMixin:
+    # Время построения ответа попадает в метрики запроса (serialize в Server-Timing)
+
+    @property
+    def data(self):
+        with span('serialize'):
+            return super().data
 
 
 class CategoryHierarchySerializer(serializers.ModelSerializer):
@@ -13,8 +26,19 @@ class CategoryHierarchySerializer(serializers.ModelSerializer):
         fields = ('value', 'title', 'children',)
 
     def get_children(self, obj):
+        # Если дерево уже загружено одним запросом, берём детей из контекста
+        children = self.context.get('children')
+        if children is not None:
+            return CategoryHierarchySerializer(children.get(obj.id, []), many=True, context=self.context).data
         return CategoryHierarchySerializer(obj.children, many=True).data
 
+    @staticmethod
+    def group_children(categories):
+        children = {}
+        for category in sorted(categories, key=lambda c: c.id):
+            children.setdefault(category.parent_id, []).append(category)
+        return children
+
 
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
@@ -46,7 +70,37 @@ class UserDataSerializer(serializers.ModelSerializer):
         fields = ('id', 'username', 'email', 'phone')
 
 
-class ProductSerializer(serializers.ModelSerializer):
+def serialize_images(product):
+    # srcset пуст, пока фоновый обработчик не построил уменьшенные копии
+    return [
+        {'id': image.id, 'img': image.image.url, 'srcset': get_srcset(image.variants)}
+        for image in product.images.all()
+    ]
+
+
+def get_favorite_ids(request, product_ids):
+    # id избранных товаров текущего пользователя, только среди отрисовываемых
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return set()
+    return set(ProductFavorite.objects.filter(
+        user_id=user.id, product_id__in=product_ids
+    ).values_list('product_id', flat=True))
+
+
+class ProductListSerializer(TimedDataMixin, serializers.ListSerializer):
+
+    def to_representation(self, data):
+        products = list(data.all() if isinstance(data, models.Manager) else data)
+        if self.root is self and 'favorite_ids' not in self._context:
+            # Один запрос на весь список вместо обхода подписчиков каждого товара
+            self._context = {**self._context, 'favorite_ids': get_favorite_ids(
+                self._context.get('request'), [product.pk for product in products]
+            )}
+        return super().to_representation(products)
+
+
+class ProductSerializer(TimedDataMixin, serializers.ModelSerializer):
     price_suffix = serializers.CharField(source='get_price_suffix_display')
     city_id = serializers.SerializerMethodField('get_city_id')
     city_name = serializers.SerializerMethodField('get_city_name')
@@ -61,15 +115,16 @@ class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = ('id', 'images', 'name', 'description', 'price', 'price_suffix', 'is_lower_bound', 'category', 'city_id', 'city_name', 'min_price', 'max_price', 'features', 'is_favorite', 'author')
+        list_serializer_class = ProductListSerializer
 
     def get_images(self, obj):
-        return [{'id': image.id, 'img': image.image.url} for image in obj.images.all()]
+        return serialize_images(obj)
 
     def get_city_id(self, obj: Product):
-        return obj.city.id if obj.city else None
+        return obj.city_id
 
     def get_city_name(self, obj: Product):
-        return obj.city.name if obj.city else None
+        return obj.city.name if obj.city_id else None
 
     def get_min_price(self, obj):
         min_price_filtered = self.context.get('min_price')
@@ -88,30 +143,44 @@ class ProductSerializer(serializers.ModelSerializer):
             return max(obj.price, max_price_filtered)
 
     def is_favorite_method(self, obj):
-        user = None
-        request = self.context.get("request")
-        if request and hasattr(request, "user"):
-            user = request.user
-        if user and user.id in [sub.user.id for sub in obj.subscribers.all()]:
-            return True
-        return False
+        favorite_ids = self.context.get('favorite_ids')
+        if favorite_ids is None:
+            favorite_ids = get_favorite_ids(self.context.get('request'), [obj.pk])
+        return obj.pk in favorite_ids
 
     def update(self, instance, validated_data):
+        from .cards import deferred_refresh
+
         features_data = validated_data.pop('features', [])
-        instance.features.all().delete()
-        for feature_data in features_data:
-            name = feature_data.get('name')
-            value = feature_data.get('value')
-            ProductFeature.objects.create(product=instance, name=name, value=value)
+        # Характеристики и товар в одной транзакции, карточка пересобирается один раз
+        with transaction.atomic(), deferred_refresh():
+            instance.set_features(features_data)
 
-        for key, value in validated_data.items():
-            setattr(instance, key, value)
+            for key, value in validated_data.items():
+                setattr(instance, key, value)
 
-        instance.save()
+            instance.save()
         return instance
 
 
-class UserSerializer(serializers.ModelSerializer):
+class ProductCardSerializer(ProductSerializer):
+    # Тот же ответ, что у ProductSerializer, но из денормализованной карточки без join
+    id = serializers.IntegerField(source='pk')
+    category = serializers.IntegerField(source='category_id')
+    features = serializers.JSONField()
+    author = serializers.JSONField()
+
+    class Meta(ProductSerializer.Meta):
+        model = ProductCard
+
+    def get_images(self, obj):
+        return obj.images
+
+    def get_city_name(self, obj):
+        return obj.city_name
+
+
+class UserSerializer(TimedDataMixin, serializers.ModelSerializer):
     favorites = serializers.SerializerMethodField('get_favorites')
 
     class Meta:
@@ -119,7 +188,12 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ('id', 'username', 'email', 'first_name', 'last_name', 'phone', 'favorites')
 
     def get_favorites(self, obj):
-        return ProductSerializer([fav.product for fav in obj.favorites.all()], many=True, context=self.context).data
+        favorites = obj.favorites.select_related('product__city', 'product__author').prefetch_related(
+            'product__features', 'product__images'
+        )
+        products = [fav.product for fav in favorites]
+        context = {**self.context, 'favorite_ids': {product.id for product in products}}
+        return ProductSerializer(products, many=True, context=context).data
 
     def update(self, instance, validated_data):
         instance.email = validated_data.get('email', instance.email)
@@ -151,17 +225,20 @@ class ProductCreateSerializer(serializers.ModelSerializer):
         )
 
     def create(self, validated_data):
+        from .cards import deferred_refresh
+
         features_data = validated_data.pop('features', [])
-        product = Product.objects.create(**validated_data)
-        for feature in features_data:
-            ProductFeature.objects.create(product=product, **feature)
+        # bulk_create не шлёт сигналов, карточку пересобирает deferred_refresh на выходе
+        with transaction.atomic(), deferred_refresh():
+            product = Product.objects.create(**validated_data)
+            ProductFeature.objects.bulk_create([ProductFeature(product=product, **feature) for feature in features_data])
         return product
 
 
 class ProductImageSerializer(serializers.ModelSerializer):
     id = serializers.IntegerField(required=False)
     images = serializers.ListField(
-        child=serializers.ImageField(allow_empty_file=False, use_url=False),
+        child=serializers.FileField(allow_empty_file=False, use_url=False),
         write_only=True
     )
 
@@ -169,6 +246,16 @@ class ProductImageSerializer(serializers.ModelSerializer):
         model = ProductImage
         fields = ('id', 'images')
 
+    def validate_images(self, files):
+        # Все файлы проверяются разом в пуле процессов, а не по очереди в потоке запроса
+        errors = {
+            index: [serializers.ImageField.default_error_messages['invalid_image']]
+            for index, valid in enumerate(verify_images(files)) if not valid
+        }
+        if errors:
+            raise serializers.ValidationError(errors)
+        return files
+
     def create(self, validated_data):
         uploaded_images = validated_data.pop("images")
         product_id = self.context['request'].parser_context['kwargs']['product_id']
@@ -177,6 +264,11 @@ class ProductImageSerializer(serializers.ModelSerializer):
         return uploaded_images
 
 
+class FavoriteBatchSerializer(serializers.Serializer):
+    add = serializers.ListField(child=serializers.IntegerField(min_value=1), max_length=1000, default=list)
+    remove = serializers.ListField(child=serializers.IntegerField(min_value=1), max_length=1000, default=list)
+
+
 class UserUpdateSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
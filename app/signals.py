@@ -0,0 +1,92 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import cards, images, metrics, querybudget
+from .authentication import invalidate_user
+from .cache import REFERENCE_GENERATION, bump_generation, bump_product_generations
+from .models import Category, City, Product, ProductFeature, ProductImage, User
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=City)
+@receiver(post_delete, sender=City)
+def invalidate_reference_data(sender, **kwargs):
+    bump_generation(REFERENCE_GENERATION)
+
+
+def is_direct_delete(origin, model):
+    # При каскадном удалении товара карточка удаляется вместе с ним, пересобирать её не нужно
+    return isinstance(origin, model) or getattr(origin, 'model', None) is model
+
+
+@receiver(post_save, sender=Product)
+def refresh_product_card(sender, instance, **kwargs):
+    cards.refresh_cards([instance.id])
+
+
+@receiver(post_delete, sender=Product)
+def invalidate_product_responses(sender, instance, **kwargs):
+    # Карточка удаляется каскадом без пересборки, поэтому кэш ответов сбрасываем здесь
+    bump_product_generations([(instance.city_id, instance.category_id)])
+
+
+@receiver(post_save, sender=ProductFeature)
+@receiver(post_save, sender=ProductImage)
+def refresh_card_on_related_save(sender, instance, **kwargs):
+    cards.refresh_cards([instance.product_id])
+
+
+@receiver(post_save, sender=ProductImage)
+def schedule_image_variants(sender, instance, created, **kwargs):
+    if created:
+        images.acquire_blob(instance.image.name)
+        images.schedule_variants([instance.id])
+
+
+@receiver(post_delete, sender=ProductImage)
+def release_image_blob(sender, instance, **kwargs):
+    # И при удалении одной фотографии, и каскадом вместе с товаром
+    images.release_blob(instance.image.name, instance.variants)
+
+
+@receiver(post_delete, sender=ProductFeature)
+@receiver(post_delete, sender=ProductImage)
+def refresh_card_on_related_delete(sender, instance, origin=None, **kwargs):
+    if is_direct_delete(origin, sender):
+        cards.refresh_cards([instance.product_id])
+
+
+@receiver(post_save, sender=City)
+def refresh_city_cards(sender, instance, created, **kwargs):
+    if not created:
+        cards.refresh_city(instance)
+
+
+@receiver(post_save, sender=Category)
+def refresh_category_cards(sender, instance, created, **kwargs):
+    # Срабатывает после invalidate_reference_data, так что путь строится по свежему снимку
+    if not created:
+        cards.refresh_category_paths(instance)
+
+
+@receiver(post_save, sender=User)
+def refresh_author_cards(sender, instance, created, update_fields=None, **kwargs):
+    if not created and update_fields != frozenset({'last_login'}):
+        cards.refresh_author(instance)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, update_fields=None, **kwargs):
+    # Вход обновляет только last_login, он аутентификации не касается
+    if update_fields != frozenset({'last_login'}):
+        invalidate_user(instance.id)
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    # Время и число SQL-запросов для метрик запроса, формы запросов для проверки N+1
+    metrics.instrument(connection)
+    querybudget.instrument(connection)
@@ -0,0 +1,45 @@
+import hashlib
+import os
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASHED_DIRECTORY = 'images'
+HASHED_NAME_RE = re.compile(rf'^{HASHED_DIRECTORY}/[0-9a-f]{{2}}/[0-9a-f]{{2}}/[0-9a-f]{{64}}(\.\w+)?$')
+
+
+def hash_content(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+def hashed_name(digest, name):
+    # images/ab/cd/<sha256>.jpg: два уровня каталогов, чтобы в одном не копились сотни тысяч файлов
+    extension = os.path.splitext(name)[1].lower()
+    return f'{HASHED_DIRECTORY}/{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+
+def is_hashed_name(name):
+    return bool(HASHED_NAME_RE.match(name))
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    # Файл называется по sha256 содержимого: одна и та же фотография у разных объявлений
+    # лежит на диске один раз, а повторная загрузка не пишет ничего.
+    # Сколько строк ссылается на файл, считает MediaBlob (см. app/images.py)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = hashed_name(hash_content(content), name)
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length)
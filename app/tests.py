@@ -1,3 +1,1121 @@
-from django.test import TestCase
+import asyncio
+import base64
+import json
+import os
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncRequestFactory, LiveServerTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image as PILImage
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import async_views, benchmarks, cards, images, listing, loadtest, metrics, querybudget
+from .cache import bump_generation, get_cached_response, get_generations, get_reference_data
+from .datagen import DatasetGenerator
+from .models import Category, City, MediaBlob, Product, ProductCard, ProductFavorite, ProductFeature, ProductImage, User
+from .serializers import ProductCardSerializer, ProductSerializer, serialize_images
+from .views import ProductList
+
+# Тесты не должны видеть ответы, закэшированные на диске прошлыми запусками,
+# а лишние запросы к БД в представлениях роняют тест
+test_settings = override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    QUERY_BUDGET_MODE='raise',
+)
+
+
+@test_settings
+class CategoryPathTests(TestCase):
+
+    def setUp(self):
+        self.root = Category.objects.create(name='Транспорт')
+        self.bikes = Category.objects.create(name='Велосипеды', parent=self.root)
+        self.kids = Category.objects.create(name='Детские', parent=self.bikes)
+        self.other = Category.objects.create(name='Недвижимость')
+
+    def test_path_is_built_on_create(self):
+        self.kids.refresh_from_db()
+        self.assertEqual(self.kids.path, f'/{self.root.id}/{self.bikes.id}/{self.kids.id}/')
+        self.assertEqual(self.kids.get_ancestor_ids(), [self.root.id, self.bikes.id])
+
+    def test_descendants_in_one_query(self):
+        with self.assertNumQueries(1):
+            descendants = list(self.root.get_descendants())
+        self.assertEqual({c.id for c in descendants}, {self.bikes.id, self.kids.id})
+
+    def test_move_rewrites_subtree(self):
+        self.bikes.parent = self.other
+        self.bikes.save()
+        self.kids.refresh_from_db()
+        self.assertEqual(self.kids.path, f'/{self.other.id}/{self.bikes.id}/{self.kids.id}/')
+        self.assertEqual(list(self.root.get_descendants()), [])
+
+    def test_move_into_own_descendant_is_rejected(self):
+        self.bikes.parent = self.kids
+        with self.assertRaises(ValueError):
+            self.bikes.save()
+
+    def test_category_tree_endpoint(self):
+        response = APIClient().get('/category/tree', {'category': self.root.id})
+        self.assertEqual([c['value'] for c in response.data], [self.bikes.id, self.kids.id, self.root.id])
+        self.assertEqual(response.data[-1]['children'][0]['children'][0]['title'], 'Детские')
+
+
+@test_settings
+class ReferenceDataTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.root = Category.objects.create(name='Транспорт')
+        City.objects.create(name='Екатеринбург')
+
+    def test_steady_state_makes_no_queries(self):
+        self.client.get('/category/tree')
+        with self.assertNumQueries(0):
+            self.client.get('/category/tree')
+            self.client.get('/category/tree', {'category': self.root.id})
+            self.client.get('/category')
+            self.client.get('/city')
+
+    def test_snapshot_is_invalidated_on_save_and_delete(self):
+        self.assertEqual(len(self.client.get('/city').data), 1)
+        city = City.objects.create(name='Пермь')
+        self.assertEqual(len(self.client.get('/city').data), 2)
+        city.delete()
+        self.assertEqual(len(self.client.get('/city').data), 1)
+
+        Category.objects.create(name='Велосипеды', parent=self.root)
+        tree = self.client.get('/category/tree').data
+        self.assertEqual(tree[0]['children'][0]['title'], 'Велосипеды')
+
+
+def create_product(category=None, author=None, **fields):
+    # Активный товар; категория и автор создаются, если не переданы
+    return Product.objects.create(
+        category=category or Category.objects.create(name='Велосипеды'),
+        author=author or User.objects.create(username='author', phone='1'),
+        **{'name': 'Велосипед', 'description': '', 'price': 100, 'status': Product.Status.ACTIVE, **fields},
+    )
+
+
+class TempMediaMixin:
+    # Файлы теста пишутся во временный MEDIA_ROOT и удаляются вместе с ним.
+    # media_settings — другие настройки, которые нужны на время теста
+    media_settings = {}
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root, **self.media_settings)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+def create_products(count, category, city, author, subscribers=()):
+    products = []
+    for i in range(count):
+        product = Product.objects.create(
+            name=f'Товар {i}', description='Описание', price=100 + i, status=Product.Status.ACTIVE,
+            author=author, category=category, city=city,
+        )
+        ProductFeature.objects.create(product=product, name='Цвет', value='Красный')
+        ProductFeature.objects.create(product=product, name='Вес', value='10')
+        ProductImage.objects.create(product=product)
+        for user in subscribers:
+            ProductFavorite.objects.create(user=user, product=product)
+        products.append(product)
+    return products
+
+
+@test_settings
+class ProductQueryCountTests(TestCase):
+
+    def setUp(self):
+        self.category = Category.objects.create(name='Транспорт')
+        self.city = City.objects.create(name='Екатеринбург')
+        self.author = User.objects.create(username='author', phone='1')
+        self.subscribers = [User.objects.create(username=f'user{i}', phone=f'2{i}') for i in range(3)]
+        self.client = APIClient()
+
+    def assert_constant_queries(self, num, url, params=None, page_sizes=(1, 5, 20), user=None):
+        if user is not None:
+            self.client.force_authenticate(user)
+        created = 0
+        for size in page_sizes:
+            create_products(size - created, self.category, self.city, self.author, self.subscribers)
+            created = size
+            with self.assertNumQueries(num):
+                response = self.client.get(url, params or {})
+            self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_product_list(self):
+        response = self.assert_constant_queries(3, '/product', {'city': self.city.id, 'status': 'AC'})
+        self.assertEqual(len(response.data['results']), 20)
+        self.assertEqual(response.data['results'][0]['city_name'], 'Екатеринбург')
+        self.assertFalse(response.data['results'][0]['is_favorite'])
+
+    def test_product_list_favorites(self):
+        user = User.objects.create(username='reader', phone='3')
+        response = self.assert_constant_queries(
+            4, '/product', {'city': self.city.id, 'status': 'AC'}, page_sizes=(2, 20), user=user,
+        )
+        products = response.data['results']
+        self.assertFalse(any(product['is_favorite'] for product in products))
+        ProductFavorite.objects.create(user=user, product_id=products[3]['id'])
+        products = self.client.get('/product', {'city': self.city.id, 'status': 'AC'}).data['results']
+        self.assertEqual([product['is_favorite'] for product in products].count(True), 1)
+        self.assertTrue(products[3]['is_favorite'])
+
+    def test_product_search(self):
+        response = self.assert_constant_queries(4, '/search/', {'category': self.category.id, 'city': self.city.id})
+        self.assertEqual(len(response.data['results']), 20)
+
+    def test_product_detail(self):
+        product, = create_products(1, self.category, self.city, self.author, self.subscribers)
+        # Версия карточки для ETag и три запроса на сам товар
+        with self.assertNumQueries(4):
+            response = self.client.get(f'/product/{product.id}/')
+        self.assertEqual(len(response.data['features']), 2)
+
+    def test_user_favorites(self):
+        response = self.assert_constant_queries(3, '/api/user/', user=self.subscribers[0])
+        self.assertEqual(len(response.data['favorites']), 20)
+        self.assertTrue(all(product['is_favorite'] for product in response.data['favorites']))
+
+
+@test_settings
+class ProductSearchTests(TestCase):
+
+    def setUp(self):
+        self.category = Category.objects.create(name='Транспорт')
+        self.author = User.objects.create(username='author', phone='1')
+        self.bike = self.create('Горный ВЕЛОСИПЕД', 'Почти новый')
+        self.tree = self.create('Ёлка искусственная', 'Высота два метра')
+        ProductFeature.objects.create(product=self.tree, name='Цвет', value='Зелёный')
+        self.phone = self.create('Телефон', 'Телефон и зарядка к телефону')
+
+    def create(self, name, description):
+        return Product.objects.create(
+            name=name, description=description, price=100, status=Product.Status.ACTIVE,
+            author=self.author, category=self.category,
+        )
+
+    def search(self, name):
+        return [product['id'] for product in APIClient().get('/search/', {'name': name}).data['results']]
+
+    def test_case_insensitive_cyrillic_prefix(self):
+        self.assertEqual(self.search('велосипеды'), [self.bike.id])
+        self.assertEqual(self.search('горн вел'), [self.bike.id])
+
+    def test_description_features_and_yo(self):
+        self.assertEqual(self.search('елка'), [self.tree.id])
+        self.assertEqual(self.search('зеленая'), [self.tree.id])
+        self.assertEqual(self.search('метра'), [self.tree.id])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.phone.name = 'Смартфон'
+        self.phone.description = 'Без зарядки'
+        self.phone.save()
+        self.assertEqual(self.search('телефон'), [])
+        self.assertEqual(self.search('смартфон'), [self.phone.id])
+        self.phone.delete()
+        self.assertEqual(self.search('смартфон'), [])
+
+    def test_results_are_ranked(self):
+        other = self.create('Чехол', 'Подходит на телефон')
+        self.assertEqual(self.search('телефон'), [self.phone.id, other.id])
+
+
+@test_settings
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(name='Транспорт')
+        self.city = City.objects.create(name='Екатеринбург')
+        author = User.objects.create(username='author', phone='1')
+        self.products = create_products(7, category, self.city, author)
+        # Одинаковые цены и даты проверяют, что курсор различает строки по id
+        Product.objects.filter(id__in=[p.id for p in self.products[:4]]).update(price=500)
+        Product.objects.update(created_at=self.products[0].created_at)
+
+    def walk(self, url, params):
+        ids, params = [], {**params, 'page_size': 3}
+        response = APIClient().get(url, params)
+        while True:
+            ids += [product['id'] for product in response.data['results']]
+            if response.data['next'] is None:
+                return ids
+            response = APIClient().get(response.data['next'])
+
+    def test_pages_by_created_at(self):
+        ids = self.walk('/product', {'city': self.city.id, 'status': 'AC'})
+        self.assertEqual(ids, sorted((p.id for p in self.products), reverse=True))
+
+    def test_pages_by_price(self):
+        ids = self.walk('/search/', {'ordering': 'price'})
+        prices = {p.id: p.price for p in Product.objects.all()}
+        self.assertEqual(ids, sorted(prices, key=lambda pk: (prices[pk], pk)))
+
+    def test_invalid_cursor(self):
+        self.assertEqual(APIClient().get('/search/', {'cursor': 'garbage'}).status_code, 404)
+        for cursor in (
+            {'o': 'price', 'p': ['abc', 1]},
+            {'o': 'price', 'p': [1, 'x']},
+            {'o': 'price', 'p': {'a': 1, 'b': 2}},
+            {'o': 'price', 'p': [True, 1]},
+            {'o': '-created_at', 'p': [1, 1]},
+            {'o': '-created_at', 'p': ['2023-01-01T00:00:00', None]},
+            {'o': 'price'},
+            ['price', [1, 1]],
+        ):
+            encoded = base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+            self.assertEqual(APIClient().get('/search/', {'cursor': encoded}).status_code, 404, cursor)
+        encoded = base64.urlsafe_b64encode(json.dumps({'o': 'price', 'p': [0, 0]}).encode()).decode()
+        self.assertEqual(APIClient().get('/search/', {'cursor': encoded}).status_code, 200)
+
+
+@test_settings
+class PriceFacetTests(TestCase):
+
+    def setUp(self):
+        self.root = Category.objects.create(name='Транспорт')
+        self.bikes = Category.objects.create(name='Велосипеды', parent=self.root)
+        self.city = City.objects.create(name='Екатеринбург')
+        self.author = User.objects.create(username='author', phone='1')
+        for price, category in [(100, self.root), (150, self.bikes), (900, self.bikes), (1000, self.bikes)]:
+            self.create(price, category)
+
+    def create(self, price, category, **kwargs):
+        return Product.objects.create(
+            name='Товар', description='', price=price, author=self.author, category=category,
+            city=self.city, status=kwargs.pop('status', Product.Status.ACTIVE), **kwargs,
+        )
+
+    def facets(self, **params):
+        return APIClient().get('/search/facets', {'buckets': 3, **params}).data
+
+    def test_histogram_for_category_subtree(self):
+        facets = self.facets(category=self.bikes.id, city=self.city.id)
+        self.assertEqual((facets['min_price'], facets['max_price'], facets['count']), (150, 1000, 3))
+        self.assertEqual([bucket['count'] for bucket in facets['histogram']], [1, 0, 2])
+        self.assertEqual(facets['histogram'][-1]['to'], 1000)
+        self.assertEqual(self.facets(category=self.root.id)['count'], 4)
+
+    def test_invalid_city(self):
+        response = APIClient().get('/search/facets', {'city': 'abc'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.facets(city=self.city.id + 100)['count'], 0)
+
+    def test_stats_follow_product_changes(self):
+        product = self.create(5000, self.bikes, status=Product.Status.ON_MODERATE)
+        self.assertEqual(self.facets()['max_price'], 1000)
+        product.status = Product.Status.ACTIVE
+        product.save()
+        self.assertEqual(self.facets()['max_price'], 5000)
+        product.price = 20
+        product.save()
+        self.assertEqual((self.facets()['min_price'], self.facets()['max_price']), (20, 1000))
+        product.delete()
+        Product.objects.filter(price=1000).update(status=Product.Status.ARCHIVED)
+        self.assertEqual((self.facets()['min_price'], self.facets()['max_price']), (100, 900))
+
+    def test_search_uses_facet_range(self):
+        product = APIClient().get('/search/', {'category': self.bikes.id, 'name': 'товар'}).data['results'][0]
+        self.assertEqual((product['min_price'], product['max_price']), (150, 1000))
+
+
+@test_settings
+class ProductReadModelTests(TestCase):
+
+    def setUp(self):
+        self.root = Category.objects.create(name='Транспорт')
+        self.category = Category.objects.create(name='Велосипеды', parent=self.root)
+        self.city = City.objects.create(name='Екатеринбург')
+        self.author = User.objects.create(username='author', phone='1')
+        self.user = User.objects.create(username='reader', phone='2')
+        self.products = create_products(5, self.category, self.city, self.author, [self.user])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_both(self, url, params):
+        with override_settings(PRODUCT_READ_MODEL=False):
+            expected = self.client.get(url, params).content
+        with override_settings(PRODUCT_READ_MODEL=True):
+            actual = self.client.get(url, params).content
+        self.assertEqual(actual, expected)
+        return actual
+
+    def test_cards_render_like_products(self):
+        self.get_both('/product', {'city': self.city.id, 'status': 'AC'})
+        self.get_both('/search/', {'category': self.root.id, 'ordering': 'price'})
+        self.get_both('/search/', {'name': 'товар'})
+
+    @override_settings(PRODUCT_READ_MODEL=True)
+    def test_listing_reads_only_cards(self):
+        with self.assertNumQueries(2):
+            self.client.get('/product', {'city': self.city.id, 'status': 'AC'})
+
+    def test_cards_follow_related_changes(self):
+        product = self.products[0]
+        self.city.name = 'Пермь'
+        self.city.save()
+        self.author.email = 'author@example.com'
+        self.author.save()
+        self.category.parent = None
+        self.category.save()
+        ProductImage.objects.filter(product=product).delete()
+        ProductFeature.objects.create(product=product, name='Рама', value='Сталь')
+
+        card = ProductCard.objects.get(product=product)
+        self.assertEqual(card.city_name, 'Пермь')
+        self.assertEqual(card.author['email'], 'author@example.com')
+        self.assertEqual(card.category_path, [{'id': self.category.id, 'name': 'Велосипеды'}])
+        self.assertEqual(card.images, [])
+        self.assertEqual(len(card.features), 3)
+        self.get_both('/product', {'city': self.city.id, 'status': 'AC'})
+
+        product.delete()
+        self.assertFalse(ProductCard.objects.filter(product_id=product.id).exists())
+
+    def test_category_rename_updates_branch_in_one_statement(self):
+        other = Category.objects.create(name='Самокаты', parent=self.root)
+        product, = create_products(1, other, self.city, self.author)
+        self.root.name = 'Транспорт и спорт'
+        with CaptureQueriesContext(connection) as queries:
+            self.root.save()
+        updates = [query for query in queries if query['sql'].startswith('UPDATE "app_productcard"')]
+        self.assertEqual(len(updates), 1)
+        root = {'id': self.root.id, 'name': 'Транспорт и спорт'}
+        self.assertEqual(
+            ProductCard.objects.get(product=product).category_path, [root, {'id': other.id, 'name': 'Самокаты'}],
+        )
+        self.assertEqual(
+            ProductCard.objects.get(product=self.products[0]).category_path,
+            [root, {'id': self.category.id, 'name': 'Велосипеды'}],
+        )
+
+    def test_rebuild_command(self):
+        ProductCard.objects.all().delete()
+        call_command('rebuild_product_cards', chunk_size=2, stdout=open(os.devnull, 'w'))
+        self.assertEqual(ProductCard.objects.count(), 5)
+        self.get_both('/search/', {})
+
+
+@test_settings
+class ImageVariantTests(TempMediaMixin, TestCase):
+    media_settings = {'IMAGE_VARIANT_WIDTHS': (200, 400, 800)}
+
+    def setUp(self):
+        super().setUp()
+        self.product = create_product()
+
+    def create_image(self, content):
+        with self.captureOnCommitCallbacks() as callbacks:
+            image = ProductImage.objects.create(product=self.product, image=ContentFile(content, 'photo.jpg'))
+        self.assertTrue(callbacks)
+        return image
+
+    def test_variants_are_built_and_exposed(self):
+        buffer = BytesIO()
+        PILImage.new('RGB', (600, 300), 'red').save(buffer, 'jpeg')
+        image = self.create_image(buffer.getvalue())
+
+        self.assertEqual(images.generate_variants(image.id), ProductImage.VariantsStatus.READY)
+        image.refresh_from_db()
+        self.assertEqual(list(image.variants['webp']), ['200', '400'])
+        with default_storage.open(image.variants['webp']['200']) as file:
+            self.assertEqual(PILImage.open(file).size, (200, 100))
+
+        card = ProductCard.objects.get(product=self.product)
+        srcset = card.images[0]['srcset']
+        self.assertEqual(srcset['webp'].count('w, '), 1)
+        self.assertTrue(srcset['jpeg'].endswith('/400.jpg 400w'))
+
+    def test_broken_image_is_marked_failed(self):
+        image = self.create_image(b'not an image')
+        with self.assertLogs('app.images', 'ERROR'):
+            self.assertEqual(images.generate_variants(image.id), ProductImage.VariantsStatus.FAILED)
+        self.assertEqual(ProductCard.objects.get(product=self.product).images[0]['srcset'], {})
+
+
+@test_settings
+@override_settings(MAX_IMAGE_UPLOAD_SIZE=100 * 1024, MAX_IMAGE_UPLOAD_FILES=3)
+class ImageUploadTests(TempMediaMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.product = create_product()
+        self.author = self.product.author
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def photo(self, name='photo.jpg', size=(300, 200)):
+        buffer = BytesIO()
+        PILImage.new('RGB', size, 'blue').save(buffer, 'jpeg')
+        return ContentFile(buffer.getvalue(), name)
+
+    def upload(self, files):
+        return self.client.post(f'/product/{self.product.id}/image', {'images': files}, format='multipart')
+
+    def test_images_are_verified_in_pool(self):
+        response = self.upload([self.photo(f'photo{i}.jpg') for i in range(3)])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(ProductImage.objects.filter(product=self.product).count(), 3)
+
+    def test_broken_image_is_rejected(self):
+        truncated = ContentFile(self.photo().read()[:400], 'broken.jpg')
+        response = self.upload([self.photo(), truncated])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.json()['images']), ['1'])
+        self.assertFalse(ProductImage.objects.exists())
+
+    def test_size_and_count_limits(self):
+        noise = PILImage.frombytes('RGB', (400, 400), os.urandom(400 * 400 * 3))
+        buffer = BytesIO()
+        noise.save(buffer, 'png')
+        self.assertEqual(self.upload([ContentFile(buffer.getvalue(), 'big.png')]).status_code, 413)
+        self.assertEqual(self.upload([self.photo(f'photo{i}.jpg') for i in range(4)]).status_code, 413)
+        self.assertFalse(ProductImage.objects.exists())
+
+    @override_settings(MAX_IMAGE_DECODE_PIXELS=500 * 500)
+    def test_pixel_limit(self):
+        # Однотонный PNG сжимается в сотни байт, но раскрылся бы в память целиком
+        buffer = BytesIO()
+        PILImage.new('RGB', (1000, 1000), 'blue').save(buffer, 'png')
+        response = self.upload([ContentFile(buffer.getvalue(), 'flat.png')])
+        self.assertEqual(response.status_code, 400)
+        # JPEG проверяется в масштабе 1/8, лимит относится к уменьшенному изображению
+        self.assertEqual(self.upload([self.photo(size=(1000, 1000))]).status_code, 201)
+
+    @override_settings(MAX_IMAGE_UPLOAD_REQUEST_SIZE=200 * 1024)
+    def test_raw_body_is_not_accepted(self):
+        url = f'/product/{self.product.id}/image'
+        # Тело не multipart: большое отклоняется по Content-Length, остальное — как неподдерживаемый тип
+        response = self.client.post(url, b'\0' * 300 * 1024, content_type='image/jpeg')
+        self.assertEqual(response.status_code, 413)
+        response = self.client.post(url, self.photo().read(), content_type='image/jpeg')
+        self.assertEqual(response.status_code, 415)
+        self.assertFalse(ProductImage.objects.exists())
+
+
+@test_settings
+class MediaStorageTests(TempMediaMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        product = create_product(name='Велосипед 0')
+        self.products = [product, create_product(product.category, product.author, name='Велосипед 1')]
+
+    def test_same_content_is_stored_once(self):
+        first, second = [
+            ProductImage.objects.create(product=product, image=ContentFile(b'photo', f'{product.id}.JPG'))
+            for product in self.products
+        ]
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(first.image.name, r'^images/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+        self.assertEqual(MediaBlob.objects.get(name=first.image.name).ref_count, 2)
+
+        path = first.image.path
+        first.delete()
+        self.assertTrue(os.path.exists(path))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[1].delete()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_dedup_legacy_tree(self):
+        legacy = os.path.join(self.media_root, 'images', '2023', '04', '22')
+        os.makedirs(legacy)
+        for name in ('a.jpg', 'b.jpg', 'orphan.jpg'):
+            with open(os.path.join(legacy, name), 'wb') as file:
+                file.write(b'photo')
+        for product, name in zip(self.products, ('a.jpg', 'b.jpg')):
+            ProductImage.objects.create(product=product, image=f'images/2023/04/22/{name}')
+
+        call_command('dedup_media', stdout=open(os.devnull, 'w'))
+        names = set(ProductImage.objects.values_list('image', flat=True))
+        self.assertEqual(len(names), 1)
+        name = names.pop()
+        self.assertEqual(MediaBlob.objects.get().name, name)
+        self.assertEqual(MediaBlob.objects.get().ref_count, 2)
+        self.assertEqual(os.listdir(legacy), ['orphan.jpg'])
+        self.assertTrue(ProductCard.objects.get(product=self.products[0]).image.endswith(name))
+
+
+@test_settings
+class MediaGarbageTests(TempMediaMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.checkpoint = os.path.join(self.media_root, 'gc.checkpoint')
+        product = create_product()
+        self.kept = ProductImage.objects.create(product=product, image=ContentFile(b'kept', 'kept.jpg')).image.name
+        self.files = {
+            self.kept: True,
+            f'variants/{self.kept}/200.webp': True,
+            'images/2023/04/22/orphan.jpg': False,
+            'variants/images/2023/04/22/orphan.jpg/200.webp': False,
+            'images/ff/ff/deleted.jpg': False,
+        }
+        for name in self.files:
+            path = os.path.join(self.media_root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'ab') as file:
+                file.write(b'data')
+            os.utime(path, (0, 0))
+
+    def collect(self, **options):
+        output = StringIO()
+        call_command('collect_media_garbage', checkpoint=self.checkpoint, stdout=output, **options)
+        return output.getvalue()
+
+    def assert_files(self, expected):
+        for name, exists in expected.items():
+            self.assertEqual(os.path.exists(os.path.join(self.media_root, name)), exists, name)
+
+    def test_dry_run_reports_without_deleting(self):
+        self.assertIn('Можно удалить файлов без ссылок: 3', self.collect(dry_run=True))
+        self.assert_files(dict.fromkeys(self.files, True))
+
+    def test_incremental_collection(self):
+        self.collect(limit=2, batch_size=1)
+        self.assertTrue(os.path.exists(self.checkpoint))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'images/2023/04/22/orphan.jpg')))
+        self.collect(batch_size=2)
+        self.assert_files(self.files)
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'images/2023')))
+        self.assertFalse(os.path.exists(self.checkpoint))
+        self.assertTrue(MediaBlob.objects.filter(name=self.kept).exists())
+
+
+@test_settings
+class ProductImportExportTests(TestCase):
+
+    def setUp(self):
+        self.category = Category.objects.create(name='Велосипеды')
+        self.city = City.objects.create(name='Пермь')
+        self.author = User.objects.create(username='partner', phone='1', email='partner@example.com')
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def test_import_jsonl_builds_products_and_cards(self):
+        path = self.write('products.jsonl', '\n'.join([
+            '{"name": "Велосипед", "price": 100, "category": "Велосипеды", "city": "Пермь", '
+            '"author": "partner", "status": "AC", "features": {"Рама": "Сталь"}}',
+            '{"name": "Самокат", "price": 50, "category": %d, "features": []}' % self.category.id,
+            '{"name": "Без цены", "category": "Велосипеды"}',
+        ]))
+        errors = StringIO()
+        get_reference_data()
+        # Пользователь, справочники, одна пачка: вставки товаров, характеристик и карточек
+        with self.assertNumQueries(8):
+            call_command('import_products', path, author='partner', stdout=StringIO(), stderr=errors)
+        self.assertIn('Строка 3: invalid price', errors.getvalue())
+
+        product = Product.objects.get(name='Велосипед')
+        self.assertEqual((product.city_id, product.status), (self.city.id, Product.Status.ACTIVE))
+        self.assertEqual(Product.objects.get(name='Самокат').status, Product.Status.ON_MODERATE)
+        card = ProductCard.objects.get(product=product)
+        expected = cards.build_card(Product.objects.with_related().get(id=product.id))
+        for field in cards.CARD_FIELDS:
+            self.assertEqual(getattr(card, field), getattr(expected, field), field)
+
+    def test_bad_rows_are_reported_and_skipped(self):
+        path = self.write('products.jsonl', '\n'.join([
+            '{"name": "Велосипед", "price": 100, "category": "Велосипеды"}',
+            '{"name": "Обрыв", "price": 1',
+            '["не", "объект"]',
+            '{"name": "Без названия", "price": 1, "category": "Велосипеды", "features": [{"value": "x"}]}',
+            '{"name": "Длинная", "price": 1, "category": "Велосипеды", "features": [{"name": "a", "value": "%s"}]}'
+            % ('x' * 300),
+            '{"name": "Список", "price": 1, "category": "Велосипеды", "features": "[1, 2]"}',
+            '{"name": ["не строка"], "price": 1, "category": "Велосипеды"}',
+            '{"name": "Автор", "price": 1, "category": "Велосипеды", "author": {"id": 1}}',
+            '{"name": "Огромная цена", "price": 1e40, "category": "Велосипеды"}',
+            '{"name": "Самокат", "price": 50, "category": "Велосипеды", "features": {"Колёса": 2}}',
+        ]))
+        errors = StringIO()
+        call_command('import_products', path, author='partner', stdout=StringIO(), stderr=errors)
+        for number, message in ((2, 'invalid row JSON'), (3, 'row must be an object'),
+                                (4, 'feature must be an object with name and value'), (5, 'invalid feature value'),
+                                (6, 'feature must be an object'), (7, 'name must be a string'),
+                                (8, 'author must be a string'), (9, 'price out of range')):
+            self.assertIn(f'Строка {number}: {message}', errors.getvalue())
+        self.assertEqual(sorted(Product.objects.values_list('name', flat=True)), ['Велосипед', 'Самокат'])
+        self.assertEqual(list(ProductFeature.objects.values_list('name', 'value')), [('Колёса', '2')])
+
+    def test_bad_csv_features_cell(self):
+        path = self.write('products.csv', 'name,price,category,features\n'
+                                          'Велосипед,100,Велосипеды,"[{""name"": ""Рама"", ""value"": ""Сталь""}]"\n'
+                                          'Самокат,50,Велосипеды,{не json\n')
+        errors = StringIO()
+        call_command('import_products', path, author='partner', stdout=StringIO(), stderr=errors)
+        self.assertIn('Строка 2: invalid features JSON', errors.getvalue())
+        self.assertEqual(list(Product.objects.values_list('name', flat=True)), ['Велосипед'])
+
+    def test_export_import_round_trip(self):
+        product = Product.objects.create(
+            name='Велосипед, "горный"', description='Строка\nвторая', price=100, category=self.category,
+            city=self.city, author=self.author, status=Product.Status.ACTIVE, is_lower_bound=True,
+        )
+        ProductFeature.objects.create(product=product, name='Рама', value='Сталь')
+        paths = [os.path.join(self.directory, file_name) for file_name in ('products.csv', 'products.jsonl')]
+        for path in paths:
+            call_command('export_products', path, stderr=StringIO())
+        for path in paths:
+            call_command('import_products', path, stdout=StringIO())
+
+        imported = Product.objects.exclude(id=product.id)
+        self.assertEqual(imported.count(), 2)
+        for copy in imported:
+            self.assertEqual(
+                (copy.name, copy.description, copy.is_lower_bound, copy.city_id, copy.author_id),
+                (product.name, product.description, True, self.city.id, self.author.id),
+            )
+            self.assertEqual(list(copy.features.values_list('name', 'value')), [('Рама', 'Сталь')])
+
+
+@test_settings
+class ProductFeatureWriteTests(TestCase):
+
+    def setUp(self):
+        self.category = Category.objects.create(name='Велосипеды')
+        self.city = City.objects.create(name='Пермь')
+        self.author = User.objects.create(username='author', phone='1')
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def feature_writes(self, queries):
+        return [
+            query['sql'] for query in queries
+            if 'app_productfeature' in query['sql'] and not query['sql'].startswith('SELECT')
+        ]
+
+    def test_create_inserts_features_in_one_statement(self):
+        features = [{'name': f'Свойство {i}', 'value': str(i)} for i in range(40)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/product', {
+                'name': 'Велосипед', 'description': 'Горный', 'price': 100, 'category': self.category.id,
+                'city': self.city.id, 'features': features,
+            }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(len(self.feature_writes(queries)), 1)
+        self.assertEqual(ProductCard.objects.get(product_id=response.data['id']).features, features)
+
+    def test_update_touches_only_changed_rows(self):
+        product = Product.objects.create(
+            name='Велосипед', description='', price=100, category=self.category, city=self.city, author=self.author,
+        )
+        features = [{'name': f'Свойство {i}', 'value': str(i)} for i in range(40)]
+        ProductFeature.objects.bulk_create([ProductFeature(product=product, **feature) for feature in features])
+        ids = list(product.features.order_by('id').values_list('id', flat=True))
+
+        features[5] = {'name': 'Свойство 5', 'value': 'новое'}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(f'/product/{product.id}/', {'features': features}, format='json')
+        self.assertEqual(response.status_code, 200)
+        writes = self.feature_writes(queries)
+        self.assertEqual(len(writes), 1)
+        self.assertTrue(writes[0].startswith('UPDATE'))
+        self.assertEqual(list(product.features.order_by('id').values_list('id', flat=True)), ids)
+        self.assertEqual(ProductCard.objects.get(product=product).features, features)
+
+        features = features[:10] + [{'name': 'Рама', 'value': 'Сталь'}]
+        self.client.patch(f'/product/{product.id}/', {'features': features}, format='json')
+        self.assertEqual(
+            list(product.features.order_by('id').values('name', 'value')),
+            features[:10] + [{'name': 'Рама', 'value': 'Сталь'}],
+        )
+        self.assertEqual(ProductCard.objects.get(product=product).features, features)
+
+    def test_update_keeps_submitted_order(self):
+        product = Product.objects.create(
+            name='Велосипед', description='', price=100, category=self.category, city=self.city, author=self.author,
+        )
+        features = [{'name': name, 'value': name} for name in 'abcde']
+        product.set_features(features)
+
+        for features in (
+            [features[1], features[0], *features[2:]],
+            [features[1], features[0], features[2], features[4]],
+            [{'name': 'x', 'value': 'x'}, *features],
+            features[::-1],
+        ):
+            response = self.client.patch(f'/product/{product.id}/', {'features': features}, format='json')
+            self.assertEqual(response.data['features'], features)
+            self.assertEqual(list(product.features.order_by('id').values('name', 'value')), features)
+
+        # Удаление из середины — один DELETE, остальные строки не трогаются
+        with CaptureQueriesContext(connection) as queries:
+            self.client.patch(f'/product/{product.id}/', {'features': features[:2] + features[3:]}, format='json')
+        writes = self.feature_writes(queries)
+        self.assertEqual(len(writes), 1)
+        self.assertTrue(writes[0].startswith('DELETE'))
+
+
+@test_settings
+class FavoriteTests(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(name='Велосипеды')
+        self.user = User.objects.create(username='reader', phone='1')
+        self.products = create_products(3, category, None, self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_toggle(self):
+        url = f'/product/{self.products[0].id}/favorite/'
+        # Точка сохранения, DELETE, INSERT ... SELECT по товару
+        with self.assertNumQueries(4):
+            self.assertIs(self.client.post(url).data, True)
+        with self.assertNumQueries(3):
+            self.assertIs(self.client.post(url).data, False)
+        self.assertFalse(ProductFavorite.objects.exists())
+        self.assertEqual(self.client.post('/product/999999/favorite/').status_code, 404)
+
+    def test_batch(self):
+        ProductFavorite.objects.create(user=self.user, product=self.products[0])
+        response = self.client.post('/product/favorites/', {
+            'add': [self.products[1].id, self.products[2].id, 999999],
+            'remove': [self.products[0].id, self.products[2].id],
+        }, format='json')
+        self.assertEqual(response.data, {'favorites': [self.products[1].id]})
+        self.assertEqual(self.client.post('/product/favorites/', {'add': ['x']}, format='json').status_code, 400)
+
+
+@test_settings
+class ResponseCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.root = Category.objects.create(name='Транспорт')
+        self.category = Category.objects.create(name='Велосипеды', parent=self.root)
+        self.city, self.other_city = City.objects.create(name='Пермь'), City.objects.create(name='Казань')
+        self.author = User.objects.create(username='author', phone='1')
+        self.products = create_products(2, self.category, self.city, self.author)
+        self.client = APIClient()
+
+    def get(self, url, params):
+        response = self.client.get(url, params)
+        return response['X-Cache'] if response.has_header('X-Cache') else None
+
+    def test_anonymous_listing_is_cached(self):
+        params = {'city': self.city.id, 'status': 'AC'}
+        self.assertEqual(self.get('/product', params), 'MISS')
+        with self.assertNumQueries(0):
+            response = self.client.get('/product', {**params, '_': 'ignored'})
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(len(response.data['results']), 2)
+
+        self.client.force_authenticate(self.author)
+        self.assertIsNone(self.get('/product', params))
+
+    def test_changes_invalidate_only_affected_locations(self):
+        city_params = {'city': self.city.id, 'status': 'AC'}
+        search_params = {'category': self.root.id}
+        for params in (city_params, search_params):
+            self.get('/search/' if 'category' in params else '/product', params)
+
+        create_products(1, self.root, self.other_city, self.author)
+        self.assertEqual(self.get('/product', city_params), 'HIT')
+        self.assertEqual(self.get('/search/', search_params), 'MISS')
+
+        ProductFeature.objects.create(product=self.products[0], name='Рама', value='Сталь')
+        self.assertEqual(self.get('/product', city_params), 'MISS')
+        self.products[1].delete()
+        self.assertEqual(len(self.client.get('/product', city_params).data['results']), 1)
+
+    def test_stale_copy_while_another_worker_recomputes(self):
+        self.assertEqual(get_cached_response('key', ['test'], lambda: 'old'), ('old', 'MISS'))
+        bump_generation('test')
+        generation, = get_generations('test')
+        cache.add(f'lock:response:key:{generation}', True)
+        self.assertEqual(get_cached_response('key', ['test'], lambda: self.fail('recomputed')), ('old', 'STALE'))
+
+
+@test_settings
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Велосипеды')
+        self.city = City.objects.create(name='Пермь')
+        self.author = User.objects.create(username='author', phone='1')
+        self.product = create_products(1, category, self.city, self.author)[0]
+        self.url = f'/product/{self.product.id}/'
+        self.client = APIClient()
+
+    def test_detail_revalidation(self):
+        response = self.client.get(self.url)
+        self.assertTrue(response.has_header('Last-Modified'))
+        # Одна строка карточки, без сериализатора
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        etag = response['ETag']
+
+        ProductFeature.objects.create(product=self.product, name='Рама', value='Сталь')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['features'][-1], {'name': 'Рама', 'value': 'Сталь'})
+
+        # ETag зависит от пользователя и отметки «в избранном»
+        self.client.force_authenticate(self.author)
+        etag = self.client.get(self.url)['ETag']
+        ProductFavorite.objects.create(user=self.author, product=self.product)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response.data['is_favorite']), (200, True))
+        self.assertFalse(response.has_header('Last-Modified'))
+
+    def test_list_revalidation(self):
+        params = {'city': self.city.id, 'status': 'AC'}
+        response = self.client.get('/product', params)
+        with self.assertNumQueries(0):
+            not_modified = self.client.get('/product', params, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        response = self.client.get('/product', params, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+        create_products(1, self.product.category, self.city, self.author)
+        response = self.client.get('/product', params, HTTP_IF_NONE_MATCH=not_modified['ETag'])
+        self.assertEqual((response.status_code, len(response.data['results'])), (200, 2))
+
+
+@test_settings
+class AsyncReadViewTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.root = Category.objects.create(name='Транспорт')
+        self.category = Category.objects.create(name='Велосипеды', parent=self.root)
+        self.city = City.objects.create(name='Пермь')
+        self.author = User.objects.create(username='author', phone='1')
+        self.products = create_products(3, self.category, self.city, self.author)
+        self.factory = AsyncRequestFactory()
+
+    async def test_responses_match_sync_views(self):
+        product_id = self.products[0].id
+        cases = [
+            ('/product', {'city': self.city.id, 'status': 'AC', 'page_size': 2}, async_views.product_list, {}),
+            ('/search/', {'name': 'товар', 'category': self.root.id}, async_views.product_search, {}),
+            ('/search/', {'cursor': 'broken'}, async_views.product_search, {}),
+            (f'/product/{product_id}/', {}, async_views.product_detail, {'pk': product_id}),
+            ('/category/tree', {}, async_views.get_category_tree, {}),
+            ('/city', {}, async_views.get_city_list, {}),
+        ]
+        for url, params, view, kwargs in cases:
+            with self.subTest(url=url, params=params):
+                expected = await self.async_client.get(url, params)
+                response = await view(self.factory.get(url, params), **kwargs)
+                self.assertEqual((response.status_code, response.content), (expected.status_code, expected.content))
+
+        # Кэш ответов общий с синхронными представлениями
+        params = {'city': self.city.id, 'status': 'AC', 'page_size': 2}
+        response = await async_views.product_list(self.factory.get('/product', params))
+        self.assertEqual(response['X-Cache'], 'HIT')
+        next_page = await async_views.product_list(self.factory.get(json.loads(response.content)['next']))
+        self.assertEqual(len(json.loads(next_page.content)['results']), 1)
+        not_modified = await async_views.product_list(
+            self.factory.get('/product', params, headers={'If-None-Match': response['ETag']})
+        )
+        self.assertEqual(not_modified.status_code, 304)
+
+
+@test_settings
+class LeanListingTests(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(name='Велосипеды')
+        city = City.objects.create(name='Пермь')
+        author = User.objects.create(username='author', phone='1', email='author@example.com')
+        self.user = User.objects.create(username='reader', phone='2')
+        products = create_products(2, category, city, author, [self.user]) + create_products(1, category, None, author)
+        products[1].price_suffix = Product.PriceSuffix.HOUR
+        products[1].save()
+        image = products[0].images.get()
+        image.variants = {'webp': {'200': 'variants/a/200.webp'}}
+        image.save()
+
+    def test_renders_like_serializers(self):
+        request = SimpleNamespace(user=self.user)
+        querysets = [(Product.objects.with_related(), ProductSerializer), (ProductCard.objects.all(), ProductCardSerializer)]
+        for queryset, serializer_class in querysets:
+            for prices in ({}, {'min_price': 101, 'max_price': 101}):
+                serializer = serializer_class(queryset.order_by('pk'), many=True, context={'request': request, **prices})
+                rows = list(listing.get_rows(queryset.order_by('pk')))
+                with self.subTest(model=queryset.model.__name__, prices=prices):
+                    self.assertEqual(
+                        JSONRenderer().render(listing.render_products(rows, request, **prices)),
+                        JSONRenderer().render(serializer.data),
+                    )
+
+
+@test_settings
+class CachedAuthenticationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='reader', phone='1')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def test_user_is_cached_until_saved(self):
+        self.assertEqual(self.client.get('/api/user/').data['username'], 'reader')
+        # Остался только запрос избранного, пользователь из кэша
+        with self.assertNumQueries(1):
+            self.client.get('/api/user/')
+
+        self.user.last_login = timezone.now()
+        self.user.save(update_fields=['last_login'])
+        with self.assertNumQueries(1):
+            self.client.get('/api/user/')
+
+        self.user.first_name = 'Иван'
+        self.user.save()
+        self.assertEqual(self.client.get('/api/user/').data['first_name'], 'Иван')
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/user/').status_code, 401)
+
+
+@test_settings
+class PerformanceMetricsTests(TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        category = Category.objects.create(name='Велосипеды')
+        author = User.objects.create(username='author', phone='1')
+        self.product = create_products(1, category, None, author)[0]
+
+    def test_server_timing_and_metrics(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().get(f'/product/{self.product.id}/')
+        timings = dict(item.split(';', 1) for item in response['Server-Timing'].split(', '))
+        self.assertEqual(set(timings), {'db', 'serialize', 'view', 'total'})
+        self.assertIn(f'desc="{len(queries)} queries"', timings['db'])
+
+        text = APIClient().get('/metrics').content.decode()
+        labels = 'route="product/<int:pk>/",method="GET"'
+        self.assertIn(f'http_requests_total{{{labels},status="200"}} 1', text)
+        self.assertIn(f'http_request_db_queries_bucket{{{labels},le="+Inf"}} 1', text)
+        self.assertIn(f'http_response_size_bytes_sum{{{labels}}} {len(response.content)}', text)
+
+
+@test_settings
+class QueryBudgetTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Велосипеды')
+        author = User.objects.create(username='author', phone='1')
+        create_products(3, category, None, author)
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            querybudget.fingerprint('SELECT * FROM "a"\n WHERE "id" IN (%s, %s, %s) AND "s" = \'AC\' LIMIT 21'),
+            querybudget.fingerprint('SELECT * FROM "a" WHERE "id" IN (%s) AND "s" = \'OFF\' LIMIT 5'),
+        )
+
+    def test_repeated_queries_fail_with_stack(self):
+        with override_settings(QUERY_REPEAT_LIMIT=0):
+            with self.assertRaises(querybudget.QueryBudgetExceeded) as raised:
+                APIClient().get('/product', {'status': 'AC'})
+        self.assertIn('похоже на N+1', str(raised.exception))
+        self.assertIn('app/views.py', str(raised.exception))
+
+    def test_budget(self):
+        with mock.patch.object(ProductList, 'query_budget', {'GET': 1}):
+            with self.assertRaises(querybudget.QueryBudgetExceeded) as raised:
+                APIClient().get('/product', {'status': 'AC'})
+            self.assertIn('при бюджете 1', str(raised.exception))
+            # Бюджет задан только для GET
+            self.assertEqual(APIClient().post('/product', {}).status_code, 401)
+
+    def test_log_mode(self):
+        with override_settings(QUERY_BUDGET_MODE='log'), mock.patch.object(ProductList, 'query_budget', {'GET': 1}):
+            with self.assertLogs('app.querybudget', 'WARNING'):
+                self.assertEqual(APIClient().get('/product', {'status': 'AC'}).status_code, 200)
+
+
+@test_settings
+class GeneratedDataTests(TempMediaMixin, TestCase):
+    media_settings = {'IMAGE_VARIANT_WIDTHS': (200,)}
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.counts = DatasetGenerator(seed=1, password='secret').generate(
+            products=40, cities=3, users=6, category_depth=2, category_branching=2, image_pool=2, chunk_size=15,
+        )
+
+    def test_dataset(self):
+        self.assertEqual(self.counts['products'], 40)
+        self.assertEqual(ProductCard.objects.count(), 40)
+        leaf = Category.objects.exclude(parent=None).first()
+        self.assertEqual(leaf.path, f'/{leaf.parent_id}/{leaf.id}/')
+        # Товары лежат только в листьях
+        self.assertFalse(Product.objects.filter(category__parent=None).exists())
+
+        # Карточки собраны без сигналов, но совпадают с пересобранными
+        product = Product.objects.with_related().exclude(images=None).first()
+        card = ProductCard.objects.get(product=product)
+        self.assertEqual(card.images, serialize_images(product))
+        self.assertEqual(card.category_path, cards.get_category_path(product.category_id))
+        self.assertEqual(sum(MediaBlob.objects.values_list('ref_count', flat=True)), ProductImage.objects.count())
+        self.assertTrue(User.objects.get(username='gen_user0').check_password('secret'))
+
+    def test_benchmark_report(self):
+        # Тестовый клиент замеров ходит на localhost, как команда benchmark
+        with override_settings(RESPONSE_CACHE_TIMEOUT=0, ALLOWED_HOSTS=['localhost']):
+            report = benchmarks.run(repeat=1, password='secret')
+        results = report['results']
+        self.assertEqual(report['meta']['products'], 40)
+        self.assertLessEqual({'product_list.orm', 'product_list.serialize', 'product_detail.view', 'token.view'},
+                             set(results))
+        self.assertEqual(results['product_list.orm']['queries'], 1)
+        self.assertEqual({change for _, _, _, change, _ in benchmarks.compare(report, report)}, {0})
+
+
+@test_settings
+@override_settings(IMAGE_VERIFY_WORKERS=0, IMAGE_VARIANT_WIDTHS=(200,))
+class LoadTestTests(TempMediaMixin, LiveServerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        DatasetGenerator(password='secret').generate(
+            products=30, cities=2, users=2, category_depth=1, category_branching=2, image_pool=0, images_per_product=0,
+        )
+
+    def test_scenarios_run_against_live_server(self):
+        weights = {name: 1 for name in loadtest.SCENARIOS}
+        # Один виртуальный пользователь: потоки тестового сервера делят одно соединение с SQLite в памяти,
+        # и параллельные записи мешали бы друг другу только здесь
+        test = loadtest.LoadTest(self.live_server_url, concurrency=1, duration=1, users=2, password='secret',
+                                 weights=weights)
+        report = asyncio.run(test.run())
+        self.assertEqual(report['total']['error_rate'], 0, report['routes'])
+        self.assertIn('GET /search/', report['routes'])
+        self.assertGreater(report['routes']['GET /product']['requests'], 0)
+        self.assertLessEqual(report['total']['p50_ms'], report['total']['p99_ms'])
@@ -0,0 +1,116 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from PIL import Image
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.parsers import MultiPartParser
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class UploadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Upload is too large.'
+    default_code = 'upload_too_large'
+
+
+def check_content_length(content_length):
+    # Заведомо слишком большой запрос отклоняем, не читая тело. Некорректный Content-Length
+    # пропускаем: его отклонит парсер, а байты всё равно считает обработчик загрузки
+    try:
+        content_length = int(content_length or 0)
+    except (TypeError, ValueError):
+        return
+    if content_length > settings.MAX_IMAGE_UPLOAD_REQUEST_SIZE:
+        raise UploadTooLarge('Request body exceeds the upload limit.')
+
+
+class LimitedTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    # Каждый файл сразу пишется во временный файл кусками, в памяти не больше одного куска,
+    # сколько бы файлов и какого бы размера ни прислали
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.received = 0
+        self.file_count = 0
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        check_content_length(content_length)
+
+    def new_file(self, *args, **kwargs):
+        self.file_count += 1
+        if self.file_count > settings.MAX_IMAGE_UPLOAD_FILES:
+            raise UploadTooLarge(f'No more than {settings.MAX_IMAGE_UPLOAD_FILES} files per upload.')
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        # Content-Length может не быть (chunked), поэтому считаем полученные байты сами
+        self.received += len(raw_data)
+        if start + len(raw_data) > settings.MAX_IMAGE_UPLOAD_SIZE:
+            self.upload_interrupted()
+            raise UploadTooLarge(f'File {self.file_name} exceeds the upload limit.')
+        if self.received > settings.MAX_IMAGE_UPLOAD_REQUEST_SIZE:
+            self.upload_interrupted()
+            raise UploadTooLarge('Request body exceeds the upload limit.')
+        super().receive_data_chunk(raw_data, start)
+
+
+class ImageUploadParser(MultiPartParser):
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context['request']
+        request.upload_handlers = [LimitedTemporaryFileUploadHandler(request)]
+        return super().parse(stream, media_type, parser_context)
+
+
+def verify_image(source, max_pixels=None):
+    # Выполняется в процессе пула. Файл открывается по пути, а не передаётся в память целиком
+    if isinstance(source, bytes):
+        source = BytesIO(source)
+    try:
+        with Image.open(source) as image:
+            image.verify()
+        if isinstance(source, BytesIO):
+            source.seek(0)
+        with Image.open(source) as image:
+            # JPEG декодируется в масштабе 1/8: обрезанный файл всё равно найдётся, а память почти не нужна
+            image.draft('RGB', (max(image.width // 8, 1), max(image.height // 8, 1)))
+            # PNG, WebP и GIF уменьшенного декодирования не умеют и раскрываются целиком,
+            # поэтому память процесса ограничивает только число пикселей, а не размер файла
+            if max_pixels and image.width * image.height > max_pixels:
+                return False
+            image.load()
+    except Exception:
+        return False
+    return True
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, а не fork: процесс сервера многопоточный
+            _pool = ProcessPoolExecutor(settings.IMAGE_VERIFY_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def get_source(file):
+    if hasattr(file, 'temporary_file_path'):
+        return file.temporary_file_path()
+    content = file.read()
+    file.seek(0)
+    return content
+
+
+def verify_images(files):
+    sources = [get_source(file) for file in files]
+    max_pixels = [settings.MAX_IMAGE_DECODE_PIXELS] * len(sources)
+    if not settings.IMAGE_VERIFY_WORKERS:
+        return list(map(verify_image, sources, max_pixels))
+    return list(get_pool().map(verify_image, sources, max_pixels))
@@ -1,5 +1,6 @@
+from django.conf import settings
 from django.urls import path, include
-from app import views
+from app import async_views, views
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
@@ -10,18 +11,41 @@ from .views import UserCreateAPIView, UserView
 
 router = DefaultRouter()
 
+# Эндпоинты чтения: под ASGI с ASYNC_READ_VIEWS — асинхронные версии из async_views
+if settings.ASYNC_READ_VIEWS:
+    read_views = {
+        'category_tree': async_views.get_category_tree,
+        'category_list': async_views.get_category_list,
+        'city_list': async_views.get_city_list,
+        'product_list': async_views.product_list,
+        'product_search': async_views.product_search,
+        'product_detail': async_views.product_detail,
+    }
+else:
+    read_views = {
+        'category_tree': views.get_category_tree,
+        'category_list': views.get_category_list,
+        'city_list': views.get_city_list,
+        'product_list': views.ProductList.as_view(),
+        'product_search': views.ProductSearchView.as_view(),
+        'product_detail': views.ProductDetail.as_view(),
+    }
+
 urlpatterns = [
-    path('category/tree', views.get_category_tree),
-    path('category', views.get_category_list),
-    path('city', views.get_city_list),
-    path('product', views.ProductList.as_view()),
+    path('category/tree', read_views['category_tree']),
+    path('category', read_views['category_list']),
+    path('city', read_views['city_list']),
+    path('product', read_views['product_list']),
     path('product/<int:product_id>/image', views.upload_product_images),
-    path('search/', views.ProductSearchView.as_view(), name='product-search'),
-    path('product/<int:pk>/', views.ProductDetail.as_view(), name='product-detail'),
+    path('search/', read_views['product_search'], name='product-search'),
+    path('search/facets', views.get_price_facets, name='price-facets'),
+    path('product/<int:pk>/', read_views['product_detail'], name='product-detail'),
     path('products/<int:product_id>/images/<int:image_id>/', views.delete_product_image, name='delete_image'),
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('api/auth/register/', UserCreateAPIView.as_view(), name='register'),
     path('api/user/', UserView.as_view()),
     path('product/<int:product_id>/favorite/', views.create_or_delete_favorite),
+    path('product/favorites/', views.update_favorites, name='update-favorites'),
+    path('metrics', views.get_metrics),
 ]
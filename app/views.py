@@ -1,66 +1,176 @@
+import hashlib
+from urllib.parse import urlencode
 
 from rest_framework import generics, status
 from rest_framework.decorators import api_view, parser_classes, permission_classes
 from rest_framework.permissions import AllowAny
-from django.db.models import Max, Min
 from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework import generics
-from rest_framework.parsers import FileUploadParser, MultiPartParser
+from django.conf import settings
+from django.http import Http404, HttpResponse
 from django.core.exceptions import PermissionDenied
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
 from rest_framework.permissions import BasePermission
 
 
-from .models import Category, Product, User, City, ProductImage, ProductFavorite
-from .serializers import CategoryHierarchySerializer, CategorySerializer, ProductSerializer, UserCreateSerializer, \
-    UserSerializer, CitySerializer, ProductCreateSerializer, ProductImageSerializer, UserUpdateSerializer
+from . import cache, facets, listing, metrics, search, uploads
+from .authentication import CachedJWTAuthentication
+from .cache import REFERENCE_GENERATION, get_generations, get_reference_data, product_generation
+from .conditional import make_etag, not_modified, set_validators
+from .models import Product, User, ProductImage, ProductFavorite, ProductCard
+from .pagination import KeysetPagination
+from .querybudget import query_budget
+from .serializers import ProductSerializer, UserCreateSerializer, UserSerializer, ProductCreateSerializer, \
+    ProductImageSerializer, UserUpdateSerializer, FavoriteBatchSerializer
+from .uploads import ImageUploadParser
 
 
 @api_view(['GET'])
 def get_category_tree(request):
+    # Ответы собираются из снимка справочников, в установившемся режиме без запросов к БД
+    reference_data = get_reference_data()
     category_id = request.query_params.get('category')
     if category_id:
-        try:
-            category = Category.objects.get(id=category_id)
-            child_categories = category.get_descendants()
-            child_categories.append(category)
-            return Response(CategoryHierarchySerializer(child_categories, many=True).data)
-        except Category.DoesNotExist:
+        subtree = reference_data.get_subtree(int(category_id)) if category_id.isdigit() else None
+        if subtree is None:
             return Response({'error': 'Category not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(subtree)
     else:
-        parent_categories = Category.objects.filter(parent_id=None)
-        return Response(CategoryHierarchySerializer(parent_categories, many=True).data)
+        return Response(reference_data.category_tree)
 
 
 @api_view(['GET'])
 def get_category_list(request):
-    parent_categories = Category.objects.filter(parent_id=None)
-    return Response(CategorySerializer(parent_categories, many=True).data)
+    return Response(get_reference_data().category_list)
 
 
 @api_view(['GET'])
 def get_city_list(request):
-    cities = City.objects.all()
-    return Response(CitySerializer(cities, many=True).data)
+    return Response(get_reference_data().city_list)
 
 
-class ProductList(generics.ListCreateAPIView):
+@query_budget(2)
+@api_view(['GET'])
+def get_price_facets(request):
+    city_id = request.query_params.get('city')
+    category_id = request.query_params.get('category')
+    if city_id and not city_id.isdigit():
+        return Response({'error': 'Invalid city'}, status=status.HTTP_400_BAD_REQUEST)
+    category = None
+    if category_id:
+        category = get_reference_data().categories.get(int(category_id)) if category_id.isdigit() else None
+        if category is None:
+            return Response({'error': 'Category not found'}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        buckets = min(max(int(request.query_params.get('buckets', facets.DEFAULT_BUCKETS)), 1), facets.MAX_BUCKETS)
+    except ValueError:
+        buckets = facets.DEFAULT_BUCKETS
+    return Response(facets.get_price_facets(int(city_id) if city_id else None, category, buckets))
+
+
+class AnonymousResponseCacheMixin:
+    # Анонимные GET с одинаковыми параметрами получают один и тот же JSON, поэтому отдаём его из кэша.
+    # Ключ — нормализованные параметры из cache_query_params, остальные параметры на ответ не влияют
+    cache_query_params = ()
+
+    def get_cache_generation_names(self, params):
+        # Поколения, от которых зависит ответ; None — такой запрос не кэшируем
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        if request.user.is_authenticated or not settings.RESPONSE_CACHE_TIMEOUT:
+            return super().get(request, *args, **kwargs)
+        params = {name: request.query_params[name] for name in self.cache_query_params if name in request.query_params}
+        generation_names = self.get_cache_generation_names(params)
+        if generation_names is None:
+            return super().get(request, *args, **kwargs)
+
+        base_key = get_response_cache_key(type(self).__name__, request, params)
+        # Ответ на If-None-Match не трогает ни кэш ответов, ни БД
+        etag, last_modified = get_list_validators(base_key, get_generations(*generation_names))
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+        response = None
+
+        def compute():
+            nonlocal response
+            response = super(AnonymousResponseCacheMixin, self).get(request, *args, **kwargs)
+            return response.data if response.status_code == status.HTTP_200_OK else None
+
+        data, state = cache.get_cached_response(base_key, generation_names, compute)
+        if response is None:
+            response = Response(data)
+        response['X-Cache'] = state
+        # Устаревшая копия старше поколений из ETag: с валидаторами клиент держал бы её до следующего изменения
+        if state != 'STALE' and response.status_code == status.HTTP_200_OK:
+            set_validators(response, etag, last_modified)
+        return response
+
+
+def get_response_cache_key(name, request, params):
+    # Хост тоже в ключе: ссылка на следующую страницу абсолютная
+    query = urlencode(sorted(params.items()))
+    return f'{name}:{hashlib.sha1(f"{request.get_host()}?{query}".encode()).hexdigest()}'
+
+
+def get_list_validators(base_key, generations):
+    # Поколение — time_ns() момента изменения, самое позднее из них годится как Last-Modified
+    return make_etag(base_key, *generations), max(generations) / 10 ** 9
+
+
+def get_location_generation_names(params):
+    city_id, category_id = params.get('city'), params.get('category')
+    if (city_id and not city_id.isdigit()) or (category_id and not category_id.isdigit()):
+        return None
+    # products:city:* сдвигается при любом изменении товаров, так что запрос без фильтров тоже сбросится
+    names = [REFERENCE_GENERATION, product_generation('city', int(city_id) if city_id else None)]
+    if category_id:
+        names.append(product_generation('category', int(category_id)))
+    return names
+
+
+class ProductReadModelMixin:
+    # При включённом PRODUCT_READ_MODEL лента и поиск читают только таблицу карточек
+
+    def get_product_queryset(self):
+        if settings.PRODUCT_READ_MODEL:
+            return ProductCard.objects.all()
+        return Product.objects.with_related()
+
+
+class ProductList(AnonymousResponseCacheMixin, ProductReadModelMixin, generics.ListCreateAPIView):
     queryset = Product.objects.all()
     serializer_class = ProductCreateSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
+    pagination_class = KeysetPagination
+    cache_query_params = ('city', 'status', 'cursor', 'ordering', 'page_size')
+    # Строки, характеристики, фото, избранное и пользователь при промахе кэша авторизации
+    query_budget = {'GET': 5}
+
+    def get_cache_generation_names(self, params):
+        # Лента анонимов фильтруется только по городу
+        return get_location_generation_names({'city': params.get('city')})
 
     def list(self, request, **kwargs):
-        queryset = self.get_queryset()
+        # фильтруем по статусу, сортировку и границу страницы задаёт пагинатор.
+        # Ответ собирается из строк values(), без сериализатора на каждый товар
+        page = self.paginate_queryset(listing.get_rows(self.get_list_queryset(request)))
+        return self.get_paginated_response(listing.render_products(page, request))
+
+    def get_list_queryset(self, request):
+        queryset = self.get_product_queryset()
         own = self.request.query_params.get('own', False)
 
         # проверяем наличие jwt токена
         if request.user.is_authenticated and own:
             # получаем пользователя из токена
             user = request.user
-            queryset = queryset.filter(author=user)
+            queryset = queryset.filter(author_id=user.id)
         else:
             # если пользователь не аутентифицирован, то фильтруем по x-city-id
             if 'city' in self.request.query_params:
@@ -71,19 +181,31 @@ class ProductList(generics.ListCreateAPIView):
 
         # получаем значение параметра status из URL
         status = request.query_params.get('status', 'ACTIVE')
-
-        # фильтруем по статусу
-        queryset = queryset.filter(status=status).order_by('-created_at')[:20]
-        serializer = ProductSerializer(queryset, many=True, context={'request': request})
-        return Response(serializer.data)
+        return queryset.filter(status=status)
 
     def perform_create(self, serializer):
         author = self.request.user
         serializer.save(author=author)
 
 
-class ProductSearchView(generics.ListAPIView):
-    serializer_class = ProductSerializer
+class ProductSearchView(AnonymousResponseCacheMixin, ProductReadModelMixin, generics.ListAPIView):
+    pagination_class = KeysetPagination
+    cache_query_params = ('name', 'city', 'category', 'minRange', 'maxRange', 'cursor', 'ordering', 'page_size')
+    # Как у ленты и границы цен; категория берётся из снимка справочников
+    query_budget = {'GET': 6}
+
+    def get_cache_generation_names(self, params):
+        return get_location_generation_names(params)
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(listing.get_rows(self.get_queryset()))
+        return self.get_paginated_response(listing.render_products(
+            page, request, self.kwargs.get('min_price'), self.kwargs.get('max_price'),
+        ))
+
+    @property
+    def default_ordering(self):
+        return 'relevance' if self.request.query_params.get('name') else '-created_at'
 
     def get_queryset(self):
         search_name = self.request.query_params.get('name')
@@ -92,17 +214,25 @@ class ProductSearchView(generics.ListAPIView):
         min_price = self.request.query_params.get('minRange')
         max_price = self.request.query_params.get('maxRange')
 
-        queryset = Product.objects.filter(status='AC')
+        queryset = self.get_product_queryset().filter(status='AC')
 
+        category = None
         if search_category:
-            # Получаем все дочерние категории
-            category_ids = [int(search_category)]
-            category_ids += self.get_child_categories(int(search_category))
-
-            queryset = queryset.filter(category_id__in=category_ids)
+            reference_data = get_reference_data()
+            category = reference_data.categories.get(int(search_category)) if search_category.isdigit() else None
+            if category is None:
+                return queryset.none()
+            if reference_data.children.get(category.id):
+                # Товары всей ветки категории: подзапрос по диапазону материализованного пути.
+                # Значений category_id несколько, поэтому выдачу по ветке SQLite досортировывает
+                # во временном B-дереве
+                queryset = queryset.filter(category_id__in=category.get_descendants(include_self=True).values('id'))
+            else:
+                # У листа одно значение: лента идёт по индексу (status, category, created_at) уже в нужном порядке
+                queryset = queryset.filter(category_id=category.id)
 
         if search_name:
-            queryset = queryset.filter(name__icontains=search_name)
+            queryset = search.filter_products(queryset, search_name)
 
         if search_city:
             queryset = queryset.filter(city_id=search_city)
@@ -110,39 +240,25 @@ class ProductSearchView(generics.ListAPIView):
         if min_price and max_price:
             queryset = queryset.filter(price__range=(min_price, max_price))
 
-        # Вычисляем минимальную и максимальную стоимость только для отфильтрованных продуктов
-        min_price_filtered = queryset.aggregate(Min('price'))['price__min']
-        max_price_filtered = queryset.aggregate(Max('price'))['price__max']
+        # Границы цен для слайдера берём из счётчиков цен по городу и ветке категорий,
+        # а не агрегатом по отфильтрованной выдаче
+        prices = facets.get_price_range(search_city, category)
+
+        # Границы цен сохраняем в kwargs представления, их добавляет в каждый товар render_products в list()
+        self.kwargs['min_price'] = prices['min_price']
+        self.kwargs['max_price'] = prices['max_price']
 
-        # Добавляем значения минимальной и максимальной стоимости в контекст для использования в сериализаторе
-        self.kwargs['min_price'] = min_price_filtered
-        self.kwargs['max_price'] = max_price_filtered
+        if search_name:
+            # По умолчанию пагинатор сортирует по релевантности
+            queryset = search.annotate_rank(queryset, search_name)
 
         return queryset
 
-    def get_child_categories(self, category_id):
-        # Рекурсивная функция для получения всех дочерних категорий
-        category_ids = []
-        children = Category.objects.filter(parent_id=category_id)
-        for child in children:
-            category_ids.append(child.id)
-            category_ids += self.get_child_categories(child.id)
-        return category_ids
-
-    def get_serializer_context(self):
-        context = super().get_serializer_context()
-        context['min_price'] = self.kwargs.get('min_price')
-        context['max_price'] = self.kwargs.get('max_price')
-        return context
-
-    def get_child_categories(self, category_id):
-        # Рекурсивная функция для получения всех дочерних категорий
-        category_ids = []
-        children = Category.objects.filter(parent_id=category_id)
-        for child in children:
-            category_ids.append(child.id)
-            category_ids += self.get_child_categories(child.id)
-        return category_ids
+
+def get_detail_validators(product_id, updated_at, user_id, is_favorite):
+    # Отметка «в избранном» меняется без updated_at, поэтому дату отдаём только анонимам
+    etag = make_etag(product_id, updated_at.isoformat(), user_id, is_favorite)
+    return etag, updated_at.timestamp() if user_id is None else None
 
 
 class IsOwnerOrReadOnly(BasePermission):
@@ -153,12 +269,39 @@ class IsOwnerOrReadOnly(BasePermission):
 
 
 class ProductDetail(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Product.objects.all()
+    queryset = Product.objects.with_related()
     serializer_class = ProductSerializer
     permission_classes = [IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly]
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
+    query_budget = {'GET': 5}
+
+    def get_card_version(self, request):
+        # Версия ответа по строке карточки: updated_at меняется при любой пересборке,
+        # is_favorite зависит от пользователя и в карточку не входит. Один запрос вместо рендера
+        cards = ProductCard.objects.filter(product_id=self.kwargs['pk'])
+        if request.user.is_authenticated:
+            cards = cards.annotate(is_favorite=Exists(
+                ProductFavorite.objects.filter(user_id=request.user.id, product_id=OuterRef('product_id'))
+            ))
+            return cards.values_list('updated_at', 'author_id', 'is_favorite').first()
+        version = cards.values_list('updated_at', 'author_id').first()
+        return version and version + (False,)
 
     def retrieve(self, request, *args, **kwargs):
+        version = self.get_card_version(request)
+        if version is None or (request.auth and version[1] != request.user.id):
+            # Нет карточки или чужой товар: обычный путь с 404/403
+            return self.retrieve_object(request)
+
+        updated_at, _, is_favorite = version
+        user_id = request.user.id if request.user.is_authenticated else None
+        etag, last_modified = get_detail_validators(self.kwargs['pk'], updated_at, user_id, is_favorite)
+        response = not_modified(request, etag, last_modified, vary=['Authorization'])
+        if response is None:
+            response = set_validators(self.retrieve_object(request), etag, last_modified, vary=['Authorization'])
+        return response
+
+    def retrieve_object(self, request):
         instance = self.get_object()
 
         if not request.auth:
@@ -204,6 +347,8 @@ class ProductDetail(generics.RetrieveUpdateDestroyAPIView):
         serializer = self.get_serializer(instance, data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
         serializer.save(status=status, city_id=city_id, price_suffix=price_suffix)
+        # Как в UpdateModelMixin: после записи предзагруженные features/images устарели
+        instance._prefetched_objects_cache = {}
         return Response(serializer.data)
 
     def patch(self, request, *args, **kwargs):
@@ -218,14 +363,18 @@ class ProductDetail(generics.RetrieveUpdateDestroyAPIView):
         serializer = self.get_serializer(instance, data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        instance._prefetched_objects_cache = {}
         return Response(serializer.data)
 
 
 
 @api_view(['POST'])
-@parser_classes([MultiPartParser, FileUploadParser])
+@parser_classes([ImageUploadParser])
 @permission_classes([IsAuthenticated])
 def upload_product_images(request, product_id):
+    # Фотографии принимаются только multipart-формой: её парсер пишет файлы с ограничениями.
+    # Тело другого типа не читается вовсе, слишком большое отклоняется сразу по Content-Length
+    uploads.check_content_length(request.META.get('CONTENT_LENGTH'))
     serializer = ProductImageSerializer(data=request.data, context={'request': request})
     if serializer.is_valid():
         product = Product.objects.get(id=product_id)
@@ -252,18 +401,55 @@ def delete_product_image(request, product_id, image_id):
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def create_or_delete_favorite(request, product_id):
-    if ProductFavorite.objects.filter(user_id=request.user.id, product_id=product_id).exists():
-        ProductFavorite.objects.filter(user_id=request.user.id, product_id=product_id).delete()
-        return Response(False, status=200)
-    else:
-        fav = ProductFavorite(user_id=request.user.id, product_id=product_id)
-        fav.save()
-        return Response(True, status=200)
+    # Сначала пробуем удалить: если удалять было нечего, добавляем. Повторная вставка при двойном
+    # нажатии упрётся в уникальность (user, product) и будет пропущена, а не создаст дубль
+    with transaction.atomic():
+        deleted, _ = ProductFavorite.objects.filter(user_id=request.user.id, product_id=product_id).delete()
+        if not deleted and not insert_favorite(request.user.id, product_id):
+            # Ноль строк: товара нет или параллельный запрос уже добавил его. Различаем только здесь,
+            # обычное добавление обходится без отдельной проверки товара
+            if not Product.objects.filter(id=product_id).exists():
+                return Response(status=status.HTTP_404_NOT_FOUND)
+    return Response(not deleted, status=200)
+
+
+def insert_favorite(user_id, product_id):
+    # Вставка берёт товар из SELECT: для несуществующего id вставлять нечего. Возвращает число вставленных строк
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {ProductFavorite._meta.db_table} (user_id, product_id) '
+            f'SELECT %s, id FROM {Product._meta.db_table} WHERE id = %s ON CONFLICT DO NOTHING',
+            [user_id, product_id],
+        )
+        return cursor.rowcount
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def update_favorites(request):
+    # Синхронизация избранного, накопленного клиентом офлайн: {"add": [id, ...], "remove": [id, ...]}.
+    # Удаление применяется после добавления, несуществующие товары пропускаются
+    serializer = FavoriteBatchSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    add, remove = set(serializer.validated_data['add']), set(serializer.validated_data['remove'])
+    favorites = ProductFavorite.objects.filter(user_id=request.user.id)
+
+    with transaction.atomic():
+        if add - remove:
+            product_ids = Product.objects.filter(id__in=add - remove).values_list('id', flat=True)
+            ProductFavorite.objects.bulk_create(
+                [ProductFavorite(user_id=request.user.id, product_id=product_id) for product_id in product_ids],
+                ignore_conflicts=True,
+            )
+        if remove:
+            favorites.filter(product_id__in=remove).delete()
+    return Response({'favorites': sorted(favorites.values_list('product_id', flat=True))})
 
 
 class UserView(APIView):
     permission_classes = [IsAuthenticated]
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
+    query_budget = {'GET': 4}
 
     def get(self, request):
         serializer = UserSerializer(request.user, context={'request': request})
@@ -288,3 +474,10 @@ class UserRetrieveUpdateAPIView(generics.RetrieveUpdateAPIView):
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+
+
+def get_metrics(request):
+    # Гистограммы этого процесса в текстовом формате Prometheus
+    if not settings.PERFORMANCE_METRICS:
+        raise Http404
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -49,6 +49,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app.middleware.PerformanceMiddleware',
+    'app.querybudget.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -112,7 +114,7 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'app.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.TokenAuthentication',
     ),
 }
@@ -136,6 +138,50 @@ DATABASES = {
     }
 }
 
+# Общий для всех воркеров кэш: поколения справочников и кэшированные ответы
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'var' / 'cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    }
+}
+
+# Сколько секунд хранить ответы ленты и поиска для анонимных пользователей, 0 — не кэшировать.
+# Устаревшие ответы сбрасываются сразу по поколениям города и категории, срок — лишь верхняя граница
+RESPONSE_CACHE_TIMEOUT = 300
+
+# Лента и поиск читают денормализованные карточки товаров (ProductCard).
+# Перед включением заполните их командой rebuild_product_cards
+
+PRODUCT_READ_MODEL = False
+
+# Асинхронные версии ленты, поиска, карточки товара и справочников (app/async_views.py)
+# для запуска под ASGI, например uvicorn backend.asgi:application. Читают только карточки,
+# поэтому их тоже нужно заполнить командой rebuild_product_cards
+
+ASYNC_READ_VIEWS = False
+
+# Сколько секунд держать в кэше пользователя из JWT (app/authentication.py), 0 — читать из БД на каждый запрос.
+# Сохранение пользователя сбрасывает запись сразу, срок — лишь верхняя граница
+
+AUTH_USER_CACHE_TIMEOUT = 60
+
+# Замеры каждого запроса (app/middleware.py): заголовок Server-Timing и гистограммы на /metrics.
+# /metrics стоит закрыть от внешнего мира на уровне прокси
+
+PERFORMANCE_METRICS = True
+
+# Проверка SQL каждого запроса (app/querybudget.py): повторы одной формы (N+1) и бюджет query_budget
+# представления. 'raise' — исключение, тесты включают его в app/tests.py; 'log' — предупреждение, для staging
+
+QUERY_BUDGET_MODE = None
+# Сколько раз за запрос может выполниться запрос одной формы
+QUERY_REPEAT_LIMIT = 3
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -176,6 +222,20 @@ STATIC_URL = '/static/'
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 MEDIA_URL = '/media/'
 
+# Уменьшенные копии фотографий товаров строятся в фоновых потоках, а не в запросе
+IMAGE_VARIANT_WIDTHS = (200, 400, 800)
+IMAGE_VARIANT_WORKERS = 2
+
+# Загрузка фотографий пишется на диск потоково, с ограничениями на файл и на запрос.
+# Проверка изображений идёт в пуле процессов; 0 — проверять в потоке запроса
+MAX_IMAGE_UPLOAD_SIZE = 10 * 1024 * 1024
+MAX_IMAGE_UPLOAD_REQUEST_SIZE = 60 * 1024 * 1024
+MAX_IMAGE_UPLOAD_FILES = 10
+IMAGE_VERIFY_WORKERS = 4
+# Сколько пикселей процесс проверки готов раскрыть в память (после уменьшения JPEG в 8 раз по сторонам):
+# 24 Мп — около 100 МБ в RGBA. Изображения больше отклоняются, не декодируясь
+MAX_IMAGE_DECODE_PIXELS = 24_000_000
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 